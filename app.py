@@ -1,24 +1,59 @@
 #!/usr/bin/env python3
+import json
 import os
 
 import aws_cdk as cdk
+from aws_cdk import aws_stepfunctions as sfn
 
-from database import AwsActivityDatabaseStack
-from notification import AwsActivityNotificationStack
-from login import AwsSignInActivityStack
+from tools.lambdas import add_layers_to_path
+
+# the stacks read the alert rules of the common layer, importable as in Lambda
+add_layers_to_path()
+from archive import AwsActivityArchiveStack  # noqa: E402
+from database import AwsActivityDatabaseStack  # noqa: E402
+from notification import AwsActivityNotificationStack  # noqa: E402
+from login import AwsSignInActivityStack  # noqa: E402
+from rollups import AwsActivityRollupStack  # noqa: E402
 
 
 app = cdk.App()
 
 us_east_1 = cdk.Environment(region=os.environ["CDK_DEFAULT_REGION"], account=os.getenv('CDK_DEFAULT_ACCOUNT'))
 
+# cdk deploy -c archive=true: activities are archived to S3 as they are stored and only
+# kept in the table for `hot_days` (7 by default) instead of 365 days
+archive = str(app.node.try_get_context('archive')).lower() == 'true'
+hot_days = int(app.node.try_get_context('hot_days') or 7) if archive else 365
+# cdk deploy -c rollups=true: per-user daily counters maintained from the table stream
+rollups = str(app.node.try_get_context('rollups')).lower() == 'true'
+
 # database
 db_stack = AwsActivityDatabaseStack(app, 'aws-activity-db', env=us_east_1,
+    stream=archive or rollups,
     description='Tracking AWS activities for security compliance'
 )
 
+if archive:
+    AwsActivityArchiveStack(app, 'aws-activity-archive', env=us_east_1,
+        dynamodb_table=db_stack.table,
+        description='Archive of AWS activities for security compliance'
+    )
+
+if rollups:
+    AwsActivityRollupStack(app, 'aws-activity-rollup', env=us_east_1,
+        dynamodb_table=db_stack.table,
+        description='Daily rollups of AWS activities for security compliance'
+    )
+
 # notification
+# cdk deploy -c notification_targets=targets.json: more webhooks and email addresses per channel
+notification_targets = None
+if app.node.try_get_context('notification_targets'):
+    with open(app.node.try_get_context('notification_targets')) as file:
+        notification_targets = json.load(file)
 notification_stack = AwsActivityNotificationStack(app, 'aws-activity-notification', env=us_east_1,
+    dynamodb_table=db_stack.table,
+    notification_targets=notification_targets,
     description='Notify AWS activities for security compliance'
 )
 
@@ -26,6 +61,15 @@ notification_stack = AwsActivityNotificationStack(app, 'aws-activity-notificatio
 AwsSignInActivityStack(app, 'aws-sign-in-activity', env=us_east_1,
     dynamodb_table=db_stack.table,
     notification_topic=notification_stack.topic,
+    # cdk deploy -c buffered=true: EventBridge -> SQS -> batched store-sign-in-activity
+    buffered=str(app.node.try_get_context('buffered')).lower() == 'true',
+    # cdk deploy -c express=true: run the state machine as an EXPRESS workflow
+    state_machine_type=sfn.StateMachineType.EXPRESS if str(app.node.try_get_context('express')).lower() == 'true' else sfn.StateMachineType.STANDARD,
+    # cdk deploy -c write_shards=8: spread the index writes of users under attack over 8 keys
+    write_shards=int(app.node.try_get_context('write_shards') or 1),
+    activity_ttl=cdk.Duration.days(hot_days),
+    # cdk deploy -c parallel_alerts=false: store first, then decide every alert rule
+    parallel_alerts=str(app.node.try_get_context('parallel_alerts')).lower() != 'false',
     description='Tracking AWS sign-in activities for security compliance'
 )
 
@@ -0,0 +1 @@
+from .infra import AwsActivityArchiveStack
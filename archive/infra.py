@@ -0,0 +1,114 @@
+from aws_cdk import (
+    Duration,
+    Stack,
+    aws_dynamodb as dynamodb,
+    aws_lambda as lambda_,
+    aws_lambda_event_sources as event_sources,
+    aws_iam as iam,
+    aws_s3 as s3,
+    aws_sqs as sqs,
+    aws_cloudwatch as cloudwatch
+)
+from constructs import Construct
+
+from bundling import layers
+
+
+class AwsActivityArchiveStack(Stack):
+    def __init__(self, scope: Construct, id: str, dynamodb_table: dynamodb.ITable,
+                 batch_size: int = 1000, batch_window: Duration = Duration.minutes(5), **kwargs) -> None:
+        super().__init__(scope, id, **kwargs)
+
+        if not dynamodb_table.table_stream_arn:
+            raise ValueError('the activity table must have a stream, AwsActivityDatabaseStack(stream=True)')
+
+        # IAM role
+        role = iam.Role(self, 'Role',
+            role_name='aws-activity-archive',
+            description='Role for functions related to aws-activity-archive',
+            assumed_by=iam.ServicePrincipal('lambda.amazonaws.com'),
+            inline_policies={
+                'CloudwatchLog': iam.PolicyDocument(statements=[
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=[
+                            'logs:CreateLogGroup'
+                        ],
+                        resources=[f'arn:aws:logs:{self.region}:{self.account}:*']
+                    ),
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=['logs:CreateLogStream', 'logs:PutLogEvents'],
+                        resources=[f'arn:aws:logs:{self.region}:{self.account}:log-group:/aws/lambda/*:*']
+                    )
+                ])
+            }
+        )
+
+        # gzipped JSON lines partitioned by day and user bucket, see activity_common/archive.py.
+        # Old partitions are rarely read and move to cheaper storage classes
+        self.bucket = s3.Bucket(self, 'Bucket',
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            enforce_ssl=True,
+            lifecycle_rules=[s3.LifecycleRule(
+                transitions=[
+                    s3.Transition(storage_class=s3.StorageClass.INFREQUENT_ACCESS, transition_after=Duration.days(30)),
+                    s3.Transition(storage_class=s3.StorageClass.GLACIER_INSTANT_RETRIEVAL, transition_after=Duration.days(90))
+                ]
+            )]
+        )
+        self.bucket.grant_put(role)
+
+        archive_function = lambda_.Function(self, 'ArchiveActivityFunction',
+            function_name='archive-aws-activity',
+            handler='index.handler',
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            description='Archive AWS activities from the DynamoDB stream into S3',
+            code=lambda_.Code.from_asset(
+                path='assets/lambda-functions/archive-activity'
+            ),
+            environment={
+                'ARCHIVE_BUCKET_NAME': self.bucket.bucket_name,
+                'LOG_LEVEL': 'INFO'
+            },
+            timeout=Duration.minutes(2),
+            memory_size=256,
+            role=role,
+            layers=layers(self, 'aws-activity-archive', dependencies=False)
+        )
+
+        # large batches make few, large objects. A failing batch is split to isolate the
+        # record, which goes to the dead-letter queue once retries are exhausted
+        dead_letter_queue = sqs.Queue(self, 'DeadLetterQueue',
+            queue_name='aws-activity-archive-dlq',
+            retention_period=Duration.days(14)
+        )
+        archive_function.add_event_source(event_sources.DynamoEventSource(dynamodb_table,
+            starting_position=lambda_.StartingPosition.TRIM_HORIZON,
+            batch_size=batch_size,
+            max_batching_window=batch_window,
+            bisect_batch_on_error=True,
+            retry_attempts=10,
+            on_failure=event_sources.SqsDlq(dead_letter_queue)
+        ))
+
+        # activities must be archived well before they expire from the table
+        cloudwatch.Alarm(self, 'IteratorAgeAlarm',
+            alarm_name='aws-activity-archive-iterator-age',
+            alarm_description='Archiving lags the activity table stream by over 1 hour',
+            metric=archive_function.metric('IteratorAge', statistic='Maximum', period=Duration.minutes(5)),
+            threshold=60 * 60 * 1000,
+            evaluation_periods=3,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+        )
+        cloudwatch.Alarm(self, 'DeadLetterAlarm',
+            alarm_name='aws-activity-archive-dead-letters',
+            alarm_description='Stream records could not be archived',
+            metric=dead_letter_queue.metric_approximate_number_of_messages_visible(),
+            threshold=0,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+        )
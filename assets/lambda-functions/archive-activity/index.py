@@ -0,0 +1,39 @@
+import logging
+import boto3
+import os
+
+from activity_common import archive, instrumentation, item_format
+
+
+# configured once per container, not on every invocation
+logger=instrumentation.configure_logging(logging.getLogger(__name__))
+# archived activities and objects, one EMF line per invocation
+metrics = instrumentation.Metrics()
+
+# created on first use and reused by warm invocations
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = archive.S3Store(boto3.client('s3'), os.getenv('ARCHIVE_BUCKET_NAME'))
+    return _store
+
+@instrumentation.instrumented(metrics, logger)
+def handler(event, context):
+    # a batch of the activity table stream. Only inserted activities are archived: TTL
+    # expiry and the removal of failed activities are not, and counter, profile, alert,
+    # rollup and idempotency items have no eventName
+    activities = []
+    for record in event['Records']:
+        image = record['dynamodb'].get('NewImage')
+        if record['eventName'] != 'INSERT' or not image or 'eventName' not in image:
+            continue
+        activities.append(item_format.decode(item_format.from_stream(image)))
+
+    with metrics.timer('Archive'):
+        keys = archive.write(get_store(), activities, os.getenv('ARCHIVE_PREFIX', archive.PREFIX))
+    metrics.add('ArchivedActivities', len(activities))
+    metrics.add('ArchiveObjects', len(keys))
+    logger.info(f'{len(activities)} of {len(event["Records"])} stream records archived into {len(keys)} objects')
+    return {'archived': len(activities), 'objects': len(keys)}
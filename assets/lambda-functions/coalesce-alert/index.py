@@ -0,0 +1,106 @@
+import logging
+import time
+import boto3
+import os
+import json
+
+from activity_common import coalescing, envelope, idempotency, instrumentation, ip_database, item_format
+
+
+# configured once per container, not on every invocation
+logger=instrumentation.configure_logging(logging.getLogger(__name__))
+# phase timings and consumed capacity, one EMF line per invocation
+metrics = instrumentation.Metrics()
+
+# created on first use and reused by warm invocations
+_table = None
+_sns = None
+_sqs = None
+_ip_database = None
+
+def get_table():
+    global _table
+    if _table is None:
+        _table = boto3.resource('dynamodb').Table(os.getenv('DYNAMODB_TABLE_NAME'))
+        metrics.instrument(_table.meta.client)
+    return _table
+
+def get_sns():
+    global _sns
+    if _sns is None:
+        _sns = boto3.client('sns')
+    return _sns
+
+def get_sqs():
+    global _sqs
+    if _sqs is None:
+        _sqs = boto3.client('sqs')
+    return _sqs
+
+def get_ip_database():
+    # memory-mapped on first use, None when no database is shipped
+    global _ip_database
+    if _ip_database is None:
+        try:
+            _ip_database = ip_database.IpDatabase(os.getenv('IP_DATABASE_PATH', ip_database.DEFAULT_PATH))
+        except (OSError, ValueError):
+            _ip_database = False
+    return _ip_database or None
+
+def window_seconds():
+    return int(os.getenv('ALERT_WINDOW_SECONDS', coalescing.DEFAULT_WINDOW_SECONDS))
+
+@instrumentation.instrumented(metrics, logger)
+def handler(event, context):
+    # digest requests scheduled through the delayed SQS queue
+    if 'Records' in event:
+        return flush_digests(event['Records'])
+
+    # {"event": <stored activity>, "reason": <alert reason>} from the state machine. Stateless
+    # rules alert on the EventBridge event while it is being stored, `envelope` is then
+    # what the state machine publishes
+    now = int(time.time())
+    activity = event['event'] if 'userIdentity' in event['event'] else from_event(event['event'], now)
+    with metrics.timer('Coalesce'):
+        result = coalescing.coalesce(get_table(), get_sqs(), os.getenv('DIGEST_QUEUE_URL'), activity['userIdentity'],
+                                     event['reason'], activity['timestamp'], now, window_seconds(), activity['id'])
+    if result.get('duplicate'):
+        logger.info(f'{event["reason"]} for {activity["id"]} has already been coalesced')
+    else:
+        logger.info(f'{event["reason"]} for {activity["userIdentity"]}: {result["count"]} in window {result["windowStart"]}')
+    return {**result, 'windowSeconds': window_seconds(), 'envelope': envelope.slim(activity)}
+
+def from_event(event, now):
+    # the activity store-sign-in-activity builds, as far as the event alone tells
+    try:
+        timestamp = item_format.event_time(event['time'])
+    except ValueError:
+        # not ISO-8601, the alert window is that of its arrival
+        timestamp = now
+    activity = item_format.from_event(event, timestamp)
+    database = get_ip_database()
+    ip_info = database.lookup(event['detail'].get('sourceIPAddress')) if database else None
+    if ip_info:
+        activity['ipInfo'] = dict(ip_info)
+    return activity
+
+def flush_digests(records):
+    failures = []
+    for record in records:
+        try:
+            request = json.loads(record['body'])
+            with metrics.timer('BuildDigest'):
+                digest = coalescing.build_digest(get_table(), request)
+            # the first alert of a window schedules its digest again when it is retried
+            if digest and idempotency.claim(get_table(), 'Digest', coalescing.digest_key(request), int(time.time())):
+                try:
+                    coalescing.publish_digest(get_sns(), os.getenv('SNS_TOPIC_ARN'), digest)
+                except Exception:
+                    idempotency.release(get_table(), 'Digest', coalescing.digest_key(request))
+                    raise
+                idempotency.complete(get_table(), 'Digest', coalescing.digest_key(request), int(time.time()))
+                logger.info(f'Digest of {digest["suppressed"]} suppressed {digest["reason"]} alerts published for {digest["userIdentity"]}')
+        except Exception:
+            logger.exception(f'Cannot publish digest {record["messageId"]}')
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
@@ -2,59 +2,46 @@ import logging
 import time
 import boto3
 import os
-from boto3.dynamodb.conditions import Key, Attr
 
+from activity_common import failure_counter, instrumentation, sharding
 
-logging.basicConfig(level=logging.DEBUG)
-logger=logging.getLogger(__name__)
 
-def handler(event, context):
-    logger.setLevel(logging.DEBUG)
+# configured once per container, not on every invocation
+logger=instrumentation.configure_logging(logging.getLogger(__name__))
+# phase timings, consumed capacity and query pages, one EMF line per invocation
+metrics = instrumentation.Metrics()
+
+# created on first use and reused by warm invocations
+_table = None
+_shard_map = None
 
-    TABLE_NAME = os.getenv('DYNAMODB_TABLE_NAME')
-    user_identity_index = {
-        'name': 'UserIdentityIndex',
-        'hash_key': 'userIdentity',
-        'sort_key': 'timestamp'
-    }
-        
+def get_table():
+    global _table
+    if _table is None:
+        _table = boto3.resource('dynamodb').Table(os.getenv('DYNAMODB_TABLE_NAME'))
+        metrics.instrument(_table.meta.client)
+    return _table
 
+def get_shard_map():
+    global _shard_map
+    if _shard_map is None:
+        _shard_map = sharding.ShardMap(get_table())
+    return _shard_map
+
+@instrumentation.instrumented(metrics, logger)
+def handler(event, context):
     user_identity = event['userIdentity']
-    
-    # last 1 hour = now - 1h
-    # seconds
+
+    # failures are pre-aggregated into minute buckets by store-sign-in-activity,
+    # so the last 1 hour is at most 60 small counter items per shard of the user
     now = int(time.time())
-    last_one_hour = now - 1 * 60 * 60
-    
-    # table = boto3.resource('dynamodb', region_name='us-east-1').Table(TABLE_NAME)
-    table = boto3.resource('dynamodb').Table(TABLE_NAME)
-    results = []
-    last_evaluated_key = None
-    
-    while True:
-        if not last_evaluated_key:
-            response = table.query(
-                IndexName=user_identity_index['name'],
-                KeyConditionExpression=Key(user_identity_index['hash_key']).eq(user_identity) & Key(user_identity_index['sort_key']).between(last_one_hour, now),
-                FilterExpression=Attr('eventName').eq('ConsoleLogin') & Attr('detail.responseElements.ConsoleLogin').eq('Failure'),
-                ScanIndexForward=False,
-            )
-        else: 
-            response = table.query(
-                IndexName=user_identity_index['name'],
-                KeyConditionExpression=Key(user_identity_index['hash_key']).eq(user_identity) & Key(user_identity_index['sort_key']).between(last_one_hour, now),
-                FilterExpression=Attr('eventName').eq('ConsoleLogin') & Attr('detail.responseElements.ConsoleLogin').eq('Failure'),
-                ScanIndexForward=False,
-                ExclusiveStartKey=last_evaluated_key
-            )
-        results.extend(response['Items'])
-
-        last_evaluated_key = response.get('LastEvaluatedKey')
-        if not last_evaluated_key:
-            break
-    logger.info(len(results))
-    
-    event['failedAttempts'] = len(results)
-    logger.debug(event)
-    
+
+    with metrics.timer('CountFailures'):
+        failed_attempts = failure_counter.count_failures(get_table(), user_identity, now,
+                                                         get_shard_map().shards_of(user_identity))
+    logger.info('Failed attempts counted', extra={'userIdentity': user_identity, 'failedAttempts': failed_attempts})
+
+    event['failedAttempts'] = failed_attempts
+    logger.debug('Activity counted', extra={'activity': event})
+
     return event
@@ -0,0 +1,64 @@
+import logging
+import boto3
+import os
+
+from activity_common import instrumentation, item_format, rollups
+
+
+# configured once per container, not on every invocation
+logger=instrumentation.configure_logging(logging.getLogger(__name__))
+# applied and replayed rollups, one EMF line per invocation
+metrics = instrumentation.Metrics()
+
+# rollups and addresses a window holds before it is applied early: Lambda passes at most
+# 1 MB of state from one invocation to the next
+MAX_WINDOW_SIZE = 5000
+# TTL expiry is deleted by the DynamoDB service, the activity was counted and stays counted
+TTL_PRINCIPAL = 'dynamodb.amazonaws.com'
+
+# created on first use and reused by warm invocations
+_table = None
+
+def get_table():
+    global _table
+    if _table is None:
+        _table = boto3.resource('dynamodb').Table(os.getenv('DYNAMODB_TABLE_NAME'))
+        metrics.instrument(_table.meta.client)
+    return _table
+
+@instrumentation.instrumented(metrics, logger)
+def handler(event, context):
+    # a batch of the activity table stream (NEW_AND_OLD_IMAGES) in a tumbling window of one
+    # shard. Lambda passes the returned `state` to the next invocation of the window and
+    # flags the last one, which applies the rollups, see activity_common/rollups.py
+    window = event.get('state') or rollups.empty_window()
+    for record in event['Records']:
+        activity, sign = change(record)
+        if activity:
+            rollups.add(window, activity, sign, record['dynamodb']['SequenceNumber'])
+
+    if not event.get('isFinalInvokeForWindow') and rollups.size(window) <= MAX_WINDOW_SIZE:
+        return {'state': window}
+    with metrics.timer('Rollup'):
+        applied, replayed = rollups.flush(get_table(), event['shardId'], window,
+                                          int(os.getenv('ROLLUP_TTL_DAYS', rollups.DEFAULT_TTL_DAYS)))
+    metrics.add('AppliedRollups', applied)
+    metrics.add('ReplayedRollups', replayed)
+    logger.info(f'{applied} rollups applied, {replayed} already applied from shard {event["shardId"]}')
+    return {'state': rollups.empty_window()}
+
+def change(record):
+    # (activity, 1) for a stored activity, (activity, -1) for the removal of one whose
+    # processing failed (its retry stores it again), (None, 0) for anything else: TTL
+    # expiry, and counter, profile, alert, rollup and idempotency items have no eventName
+    if record['eventName'] == 'INSERT':
+        image, sign = record['dynamodb'].get('NewImage'), 1
+    elif record['eventName'] == 'REMOVE' and (record.get('userIdentity') or {}).get('principalId') != TTL_PRINCIPAL:
+        image, sign = record['dynamodb'].get('OldImage'), -1
+    else:
+        return None, 0
+    if not image or 'eventName' not in image:
+        return None, 0
+    item = item_format.from_stream(image)
+    # items stored before the compact format carry the event as-is
+    return (item if item_format.is_compact(item) else {**item, **item_format.hot_fields(item)}), sign
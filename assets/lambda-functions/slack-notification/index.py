@@ -1,28 +1,234 @@
+import asyncio
+import hashlib
 import logging
-import requests
+import time
 import json
+from collections import namedtuple
 from datetime import datetime
 import os
 
+from activity_common import dispatch, envelope, idempotency, instrumentation
 
-logging.basicConfig(level=logging.DEBUG)
-logger=logging.getLogger(__name__)
+
+# configured once per container, not on every invocation
+logger=instrumentation.configure_logging(logging.getLogger(__name__))
+# latency and status per attempt and target type, one EMF line per invocation
+metrics = instrumentation.Metrics()
 
 SLACK_CHANNELS = {
     'alarm-aws': os.environ.get('SLACK_WEBHOOK_ALARM_AWS')
 }
+# more targets per channel, e.g. {"alarm-aws": {"slack": [url], "webhook": [url], "email": [address]}}.
+# A message goes to the targets of its channel whose type is in its `targets` attribute
+NOTIFICATION_TARGETS = json.loads(os.environ.get('NOTIFICATION_TARGETS') or '{}')
+SMTP_SETTINGS = {
+    'host': os.environ.get('SMTP_HOST'),
+    'port': int(os.environ.get('SMTP_PORT', 587)),
+    'sender': os.environ.get('SMTP_SENDER'),
+    'starttls': os.environ.get('SMTP_STARTTLS', 'true').lower() == 'true'
+}
+# name or ARN of the Secrets Manager secret with the relay's {"username": ..., "password": ...}
+SMTP_CREDENTIALS_SECRET = os.environ.get('SMTP_CREDENTIALS_SECRET')
+
+# per target type: metric prefix, timeout of one attempt in seconds and failed attempts
+# before giving up. Rate limited attempts are not failures, they are retried until the deadline
+TARGET_TYPES = {
+    'slack': {'label': 'Slack', 'timeout': 10, 'attempts': 8},
+    'webhook': {'label': 'Webhook', 'timeout': 5, 'attempts': 5},
+    'email': {'label': 'Email', 'timeout': 20, 'attempts': 3}
+}
+# without a `targets` attribute
+DEFAULT_TARGETS = ['Slack']
+
+# requests in flight per webhook
+MAX_WORKERS = 8
+BACKOFF_BASE_SECONDS = 0.2
+# stop retrying this long before the Lambda times out
+TIMEOUT_MARGIN_SECONDS = 2
+# budget when there is no Lambda context, e.g. local runs
+DEFAULT_BUDGET_SECONDS = 30
+
+# every (SNS message, target) is claimed in this scope before it is sent
+IDEMPOTENCY_SCOPE = 'Notification'
+
+# fields render() reads per alert reason. Alerts are slim envelopes (activity_common/envelope.py),
+# the stored activity is only read when one of them is missing
+RENDERED_PATHS = {
+    'ManyFailedSignInAttempt': ('$.detail.userIdentity.userName', '$.failedAttempts'),
+    'NoMFAUsed': ('$.detail.userIdentity.userName', '$.eventName'),
+    'ImpossibleTravel': ('$.detail.userIdentity.userName', '$.profile'),
+    'NewSourceIP': ('$.detail.userIdentity.userName', '$.profile'),
+    'RootActivity': ('$.eventName',)
+}
+COMMON_RENDERED_PATHS = ('$.id', '$.detail.sourceIPAddress')
+
+Target = namedtuple('Target', ['type', 'address'])
+
+# one event loop and keep-alive connections per container, reused by warm invocations
+_dispatcher = None
+_table = None
+_smtp_credentials = None
 
+class NotificationError(Exception):
+    pass
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = dispatch.Dispatcher(metrics, logger)
+    return _dispatcher
+
+def get_table():
+    # None without DYNAMODB_TABLE_NAME, every message is sent then
+    global _table
+    if _table is None and os.getenv('DYNAMODB_TABLE_NAME'):
+        # imported here, boto3 is most of the cold import and only the claims need it
+        import boto3
+        _table = boto3.resource('dynamodb').Table(os.getenv('DYNAMODB_TABLE_NAME'))
+        metrics.instrument(_table.meta.client)
+    return _table
+
+def get_smtp_credentials():
+    # read with the first email and kept by the container, the credentials are never in
+    # the environment of the function
+    global _smtp_credentials
+    if _smtp_credentials is None:
+        credentials = {}
+        if SMTP_CREDENTIALS_SECRET:
+            import boto3
+            secret = json.loads(boto3.client('secretsmanager').get_secret_value(SecretId=SMTP_CREDENTIALS_SECRET)['SecretString'])
+            credentials = {'username': secret.get('username'), 'password': secret.get('password')}
+        _smtp_credentials = credentials
+    return _smtp_credentials
+
+@instrumentation.instrumented(metrics, logger)
 def handler(event, context):
-    logger.setLevel(logging.DEBUG)
-    logger.debug(event)
+    logger.debug('Notifications received', extra={'notifications': event})
+
+    records = event['Records']
+    budget = context.get_remaining_time_in_millis() / 1000 - TIMEOUT_MARGIN_SECONDS if context else DEFAULT_BUDGET_SECONDS
+    deadline = time.monotonic() + budget
+
+    failures = []
+    deliveries = []
+    for record in records:
+        try:
+            notification = render(record)
+            deliveries.extend((record, notification, target) for target in route(record))
+        except Exception as error:
+            logger.exception(f'Cannot notify {record["Sns"].get("MessageId")}')
+            failures.append({'messageId': record['Sns'].get('MessageId'), 'error': str(error)})
+
+    table = get_table()
+    # a claim outlives this invocation, then a retry may take over
+    lease_seconds = int(budget) + TIMEOUT_MARGIN_SECONDS + 1
+
+    async def deliver_all():
+        # every target at once, each with its own timeout and retries
+        return await asyncio.gather(*(deliver(record, notification, target, deadline, table, lease_seconds)
+                                      for record, notification, target in deliveries))
+
+    failures.extend(failure for failure in get_dispatcher().run(deliver_all()) if failure)
+
+    sent = len(deliveries) - sum('target' in failure for failure in failures)
+    metrics.add('Notifications', sent)
+    metrics.add('NotificationFailures', len(failures))
+    logger.info(f'{sent} notifications of {len(records)} messages have been sent, {len(failures)} failed')
+    if failures:
+        # SNS invokes asynchronously: failing the invocation lets Lambda retry it
+        raise NotificationError(json.dumps(failures))
+    return {'sent': sent, 'failures': failures}
 
-    message = json.loads(event['Records'][0]['Sns']['Message'])
-    message_attributes = event['Records'][0]['Sns']['MessageAttributes']
+def route(record) -> list:
+    # the targets of the channel of the message whose type is in its `targets` attribute
+    attributes = record['Sns']['MessageAttributes']
+    channel = attributes['channel']['Value']
+    types = DEFAULT_TARGETS
+    if 'targets' in attributes:
+        value = attributes['targets']['Value']
+        types = json.loads(value) if attributes['targets'].get('Type') == 'String.Array' else [value]
+
+    configured = NOTIFICATION_TARGETS.get(channel, {})
+    targets = []
+    for target_type in dict.fromkeys(str(name).lower() for name in types):
+        if target_type not in TARGET_TYPES:
+            logger.warning(f'Unknown target type {target_type} for channel {channel}')
+            continue
+        addresses = configured.get(target_type, [])
+        if target_type == 'slack':
+            addresses = [SLACK_CHANNELS.get(channel)] + addresses
+        targets.extend(Target(target_type, address) for address in dict.fromkeys(addresses) if address)
+    if not targets:
+        raise NotificationError(f'No {", ".join(types)} target configured for channel {channel}')
+    return targets
+
+def target_key(target: Target) -> str:
+    # addresses are secrets (webhook URLs), only a digest of them is recorded
+    return f'{target.type}#{hashlib.sha256(target.address.encode("utf-8")).hexdigest()[:16]}'
+
+async def deliver(record, notification, target: Target, deadline: float, table, lease_seconds: int):
+    message_id = record['Sns'].get('MessageId')
+    key = f'{message_id}#{target_key(target)}'
+    claimed = False
+    try:
+        if table and message_id:
+            claimed = await asyncio.to_thread(idempotency.claim, table, IDEMPOTENCY_SCOPE, key, int(time.time()), lease_seconds)
+            if not claimed:
+                metrics.add('DuplicateNotifications', 1)
+                logger.info(f'{message_id} is being or has been notified to {target.type}')
+                return None
+        await send(target, notification, record, deadline)
+    except Exception as error:
+        logger.exception(f'Cannot notify {target.type} of {message_id}')
+        if claimed:
+            await asyncio.to_thread(release, table, key)
+        return {'messageId': message_id, 'target': target.type, 'error': str(error)}
+    if claimed:
+        try:
+            await asyncio.to_thread(idempotency.complete, table, IDEMPOTENCY_SCOPE, key, int(time.time()))
+        except Exception:
+            # sent all the same, a redelivery after the lease would send it again
+            logger.exception(f'Cannot record {message_id} as notified to {target.type}')
+    return None
+
+def release(table, key):
+    # the retry of the invocation sends the message again
+    try:
+        idempotency.release(table, IDEMPOTENCY_SCOPE, key)
+    except Exception:
+        logger.exception(f'Cannot release {key}, its retry waits for the claim to lapse')
+
+async def send(target: Target, notification: dict, record, deadline: float):
+    settings = TARGET_TYPES[target.type]
+    dispatcher = get_dispatcher()
+    if target.type == 'email':
+        if not SMTP_SETTINGS.get('host'):
+            raise NotificationError('No SMTP server configured')
+        subject, text = email_content(notification)
+        smtp_settings = {**SMTP_SETTINGS, **await asyncio.to_thread(get_smtp_credentials)}
+        await dispatcher.send_email(smtp_settings, [target.address], subject, text, deadline, settings['timeout'],
+                                    label=settings['label'], attempts=settings['attempts'],
+                                    backoff_base=BACKOFF_BASE_SECONDS)
+    else:
+        payload = slack_payload(**notification) if target.type == 'slack' else webhook_payload(notification, record)
+        logger.debug(f'{settings["label"]} payload', extra={'payload': payload})
+        await dispatcher.post_json(target.address, json.dumps(payload, default=str), deadline, settings['timeout'],
+                                   label=settings['label'], attempts=settings['attempts'],
+                                   max_connections=MAX_WORKERS, backoff_base=BACKOFF_BASE_SECONDS)
+    logger.info(f'{settings["label"]} notified')
+
+def render(record):
+    message = json.loads(record['Sns']['Message'])
+    message_attributes = record['Sns']['MessageAttributes']
+    if 'digest' in message_attributes:
+        return render_digest(message, message_attributes)
 
     fields = []
 
     text = 'See detail below'
     reason = message_attributes['reason']['Value']
+    if envelope.is_slim(message) and envelope.missing(message, RENDERED_PATHS.get(reason, ()) + COMMON_RENDERED_PATHS):
+        message = expand(message)
     if reason == 'ManyFailedSignInAttempt':
         text = 'There are many failed sign-in attempts in last one hour'
         fields.extend([
@@ -51,6 +257,41 @@ def handler(event, context):
                 'short': True
             }
         ])
+    elif reason == 'ImpossibleTravel':
+        profile = message['profile']
+        text = 'Detected sign-ins too far apart for the time between them'
+        fields.extend([
+            {
+                'title': 'User',
+                "value": message['detail']['userIdentity']['userName'],
+                'short': True
+            },
+            {
+                'title': 'Travel',
+                "value": f'{profile.get("previousCountry")} to {(message.get("ipInfo") or {}).get("country")} at {profile["travelSpeed"]} km/h',
+                'short': True
+            }
+        ])
+    elif reason == 'NewSourceIP':
+        profile = message['profile']
+        text = 'Detected sign-in from a source IP not seen for this user'
+        fields.extend([
+            {
+                'title': 'User',
+                "value": message['detail']['userIdentity']['userName'],
+                'short': True
+            },
+            {
+                'title': 'New user agent',
+                "value": 'Yes' if profile.get('newUserAgent') else 'No',
+                'short': True
+            },
+            {
+                'title': 'Distinct IPs',
+                "value": profile.get('distinctIps'),
+                'short': True
+            }
+        ])
     elif reason == 'RootActivity':
         text = 'Detected Root activity'
         fields.extend([
@@ -66,12 +307,13 @@ def handler(event, context):
             }
         ])
 
+    fields.append({
+        'title': 'IP address',
+        "value": message['detail']['sourceIPAddress'],
+        'short': True
+    })
+    fields.extend(ip_fields(message.get('ipInfo')))
     fields.extend([
-        {
-            'title': 'IP address',
-            "value": message['detail']['sourceIPAddress'],
-            'short': True
-        },
         {
             'title': 'Severity',
             "value": message_attributes['severity']['Value'],
@@ -84,14 +326,73 @@ def handler(event, context):
         }
     ])
 
-    send_slack(
-        channel=message_attributes['channel']['Value'],
-        title=text,
-        fields=fields,
-        severity=message_attributes['severity']['Value']
-    )
+    return {
+        'channel': message_attributes['channel']['Value'],
+        'title': text,
+        'fields': fields,
+        'severity': message_attributes['severity']['Value']
+    }
+
+def expand(message):
+    # the stored activity behind an envelope, the envelope alone without the table
+    table = get_table()
+    if table is None:
+        return message
+    metrics.add('EnvelopeExpansions', 1)
+    with metrics.timer('Expand'):
+        return envelope.expand(table, message)
+
+def ip_fields(ip_info):
+    # enrichment of the source address by store-sign-in-activity, if any
+    if not ip_info:
+        return []
+    network = ' '.join(part for part in (f'AS{ip_info["asn"]}' if 'asn' in ip_info else '', ip_info.get('org', '')) if part)
+    if 'country' in ip_info:
+        network = f'{network} ({ip_info["country"]})' if network else ip_info['country']
+    fields = [{'title': 'Network', 'value': network, 'short': True}] if network else []
+    if ip_info.get('lists'):
+        fields.append({'title': 'Known bad', 'value': ', '.join(ip_info['lists']), 'short': True})
+    return fields
+
+def render_digest(message, message_attributes):
+    # repeats of an alert coalesced over one window
+    def utc(timestamp):
+        return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S UTC')
+
+    return {
+        'channel': message_attributes['channel']['Value'],
+        'title': f'{message["suppressed"]} more {message["reason"]} alerts were suppressed',
+        'fields': [
+            {
+                'title': 'User',
+                'value': message['userIdentity'].split('#', 1)[-1],
+                'short': True
+            },
+            {
+                'title': 'Occurrences',
+                'value': message['count'],
+                'short': True
+            },
+            {
+                'title': 'First seen',
+                'value': utc(message['firstSeen']),
+                'short': True
+            },
+            {
+                'title': 'Last seen',
+                'value': utc(message['lastSeen']),
+                'short': True
+            },
+            {
+                'title': 'Severity',
+                'value': message_attributes['severity']['Value'],
+                'short': True
+            }
+        ],
+        'severity': message_attributes['severity']['Value']
+    }
 
-def send_slack(channel: str, title: str, fields: list, severity='Medium'):
+def slack_payload(channel: str, title: str, fields: list, severity='Medium'):
     color = '#36a64f'
     if severity == 'Medium':
         color = '#edaf2b'
@@ -99,7 +400,7 @@ def send_slack(channel: str, title: str, fields: list, severity='Medium'):
         color = '#cc5f00'
     elif severity == 'Critical':
         color = '#cc0000'
-    
+
     payload = {
         'username': 'Cloud Guard',
         'attachments': [{
@@ -112,7 +413,21 @@ def send_slack(channel: str, title: str, fields: list, severity='Medium'):
     }
     if severity.lower() == 'critical':
         payload['attachments'][0].update({'pretext': '<!here>'})
+    return payload
+
+def webhook_payload(notification: dict, record):
+    # generic JSON webhooks get the rendered alert and the attributes of the message
+    attributes = record['Sns']['MessageAttributes']
+    return {
+        'messageId': record['Sns'].get('MessageId'),
+        'reason': attributes.get('reason', {}).get('Value'),
+        'channel': notification['channel'],
+        'severity': notification['severity'],
+        'title': notification['title'],
+        'fields': {field['title']: field['value'] for field in notification['fields']}
+    }
 
-    logger.info(payload)
-    requests.post(SLACK_CHANNELS.get(channel), data=json.dumps(payload), headers={'Content-Type': 'application/json'})
-    logger.info('Send Slack notify successfully')
+def email_content(notification: dict):
+    subject = f'[{notification["severity"]}] {notification["title"]}'
+    text = '\n'.join(f'{field["title"]}: {field["value"]}' for field in notification['fields'])
+    return subject, f'{notification["title"]}\n\n{text}\n'
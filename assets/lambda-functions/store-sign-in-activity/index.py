@@ -1,40 +1,361 @@
+import gc
 import logging
+import random
 import time
-from dateutil import parser
 import boto3
 import os
 import json
 
+from activity_common import alerting, envelope, failure_counter, idempotency, instrumentation, item_format, json_values, sharding
 
-logging.basicConfig(level=logging.DEBUG)
-logger=logging.getLogger(__name__)
 
+# configured once per container, not on every invocation
+logger=instrumentation.configure_logging(logging.getLogger(__name__))
+# phase timings and consumed capacity, one EMF line per invocation
+metrics = instrumentation.Metrics()
+
+# BatchWriteItem accepts at most 25 put requests
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_ATTEMPTS = 5
+BATCH_WRITE_BASE_DELAY = 0.05
+DEFAULT_TTL_DAYS = 365
+
+# clients are created on first use and reused by warm invocations
+_table = None
+_sns = None
+_sqs = None
+_shard_map = None
+_ip_database = None
+# what was returned for the last events, answered again to their retries
+results = idempotency.Results()
+
+def get_table():
+    global _table
+    if _table is None:
+        _table = boto3.resource('dynamodb').Table(os.getenv('DYNAMODB_TABLE_NAME'))
+        metrics.instrument(_table.meta.client)
+    return _table
+
+def get_sns():
+    global _sns
+    if _sns is None:
+        _sns = boto3.client('sns')
+    return _sns
+
+def get_sqs():
+    global _sqs
+    if _sqs is None:
+        _sqs = boto3.client('sqs')
+    return _sqs
+
+def get_shard_map():
+    global _shard_map
+    if _shard_map is None:
+        _shard_map = sharding.ShardMap(get_table(),
+                                       shards=int(os.getenv('WRITE_SHARDS', sharding.DEFAULT_SHARDS)),
+                                       threshold=int(os.getenv('WRITE_SHARD_THRESHOLD', sharding.DEFAULT_THRESHOLD)))
+    return _shard_map
+
+def get_ip_database():
+    # memory-mapped on first use, None when no database is shipped
+    global _ip_database
+    if _ip_database is None:
+        from activity_common import ip_database
+        path = os.getenv('IP_DATABASE_PATH', ip_database.DEFAULT_PATH)
+        try:
+            _ip_database = ip_database.IpDatabase(path)
+        except (OSError, ValueError):
+            logger.warning(f'No IP database at {path}, activities are not enriched')
+            _ip_database = False
+    return _ip_database or None
+
+@instrumentation.instrumented(metrics, logger)
 def handler(event, context):
-    # logger.setLevel(logging.DEBUG)
-    
-    # 365 days
-    ttl = int(time.time()) + 365 * 24 * 60 * 60
-    timestamp = int(parser.parse(event['time']).timestamp())
-
-    event_detail = event['detail']
-    event_name = event_detail['eventName']
-    user_identity_type = event_detail['userIdentity']['type']
-
-    user_identity = f'{user_identity_type}#Unknown'
-    if user_identity_type == 'IAMUser':
-        user_identity = f'{user_identity_type}#{event_detail["userIdentity"]["userName"]}'
-    elif user_identity_type == 'Root':
-        user_identity = f'{user_identity_type}#Root'
-    elif user_identity == 'AssumedRole':
-        user_identity = f'{user_identity_type}#{event_detail["userIdentity"]["sessionContext"]["sessionIssuer"]["userName"]}'
-
-    event = {**event, 'eventName': event_name, 'userIdentity': user_identity, 'timestamp': timestamp, 'ttl': ttl}
-    logger.debug(json.dumps(event))
-
-    # dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(os.getenv('DYNAMODB_TABLE_NAME'))
-    table.put_item(Item=event)
-    logger.info(f'Activity has been stored into database successfully')
-
-    return event
+    # buffered mode: a batch of EventBridge events delivered by SQS
+    if 'Records' in event:
+        return handle_batch(event['Records'])
+
+    # {"event": <EventBridge event>, "executionId": <$$.Execution.Id>} from the state machine
+    execution_id = event.get('executionId')
+    if execution_id:
+        event = event['event']
+
+    # a retry or duplicated delivery of an event this container has handled
+    previous = results.get(event['id'])
+    if previous is not None:
+        handled_by, activity = previous
+        return retried(activity) if execution_id and handled_by == execution_id else duplicate(activity)
+
+    with metrics.timer('Build'):
+        event = build_item(event)
+    logger.debug('Activity built', extra={'activity': event})
+
+    table = get_table()
+    shard_map = get_shard_map()
+    # stored compact under the shard key of the user, with the execution storing it
+    user_key = shard_map.key_of(event['userIdentity'], event['id'])
+    item = item_format.encode({**event, 'userIdentity': user_key})
+    if execution_id:
+        item['executionId'] = execution_id
+    with metrics.timer('Store'):
+        stored = idempotency.put_once(table, item)
+    resumed = {}
+    if not stored:
+        resumed = stored_item(table, event) if execution_id else {}
+        if not execution_id or resumed.get('executionId') != execution_id:
+            results.put(event['id'], (resumed.get('executionId'), event))
+            return duplicate(event)
+        # the task is retried in the execution that stored the activity, e.g. its response
+        # was lost: the processing resumes after the store step
+        logger.info(f'Activity {event["id"]} has been stored by this execution, resuming')
+    else:
+        metrics.add('Activities', 1)
+        logger.info(f'Activity has been stored into database successfully')
+
+    if alerting.is_failed_console_login(event):
+        # counted once: the retry of a failed task, which the state machine makes, resumes here
+        with metrics.timer('CountFailure'):
+            count = failure_counter.record_failure(table, user_key, event['timestamp'], event_ids=[event['id']])
+        if count is not None:
+            observe(shard_map, event['userIdentity'], count)
+
+    if 'profile' in resumed:
+        # compared before the retry, the profile already holds this sign-in
+        event['profile'] = json_values.plain(resumed['profile'])
+    else:
+        with metrics.timer('Profile'):
+            compare_with_profiles(table, [event])
+        if execution_id and 'profile' in event:
+            # for a retry of the task, see above
+            table.update_item(Key={'id': event['id'], 'timestamp': event['timestamp']},
+                              UpdateExpression='SET #profile = :profile',
+                              ExpressionAttributeNames={'#profile': 'profile'},
+                              ExpressionAttributeValues={':profile': event['profile']})
+
+    results.put(event['id'], (execution_id, event))
+    # the states after this one, SNS and the notifier get the slim envelope, see activity_common/envelope.py
+    return envelope.slim(event)
+
+def stored_item(table, event):
+    # the execution id and, once compared, the profile of a stored activity
+    return table.get_item(
+        Key={'id': event['id'], 'timestamp': event['timestamp']},
+        ProjectionExpression='#execution, #profile',
+        ExpressionAttributeNames={'#execution': 'executionId', '#profile': 'profile'},
+        ConsistentRead=True
+    ).get('Item', {})
+
+def retried(event):
+    # the task is retried in the execution that handled the event, it gets the same result
+    logger.info(f'Activity {event["id"]} has been handled by this execution')
+    return envelope.slim(event)
+
+def duplicate(event):
+    # the state machine stops on `duplicate`: another execution has counted and alerted on the event
+    metrics.add('Duplicates', 1)
+    logger.info(f'Activity {event["id"]} has already been stored')
+    return {**envelope.slim(event), 'duplicate': True}
+
+def forget(table, event):
+    # removes a stored activity whose alerting failed, its redelivery is not a duplicate then
+    try:
+        table.delete_item(Key={'id': event['id'], 'timestamp': event['timestamp']})
+    except Exception:
+        logger.exception(f'Cannot remove activity {event["id"]}, its retry will be dropped as a duplicate')
+
+def build_item(event):
+    # 365 days, or the days kept in the table when activities are archived (archive/infra.py)
+    ttl = int(time.time()) + int(os.getenv('ACTIVITY_TTL_DAYS', DEFAULT_TTL_DAYS)) * 24 * 60 * 60
+    item = {**item_format.from_event(event, parse_timestamp(event['time'])), 'ttl': ttl}
+    # network and known-bad lists of the source address
+    database = get_ip_database()
+    ip_info = database.lookup(event['detail'].get('sourceIPAddress')) if database else None
+    if ip_info:
+        item['ipInfo'] = dict(ip_info)
+    return item
+
+def parse_timestamp(value):
+    # anything item_format.event_time does not parse falls back to dateutil
+    try:
+        return item_format.event_time(value)
+    except ValueError:
+        from dateutil import parser
+        metrics.add('TimestampFallbacks', 1)
+        return int(parser.parse(value).timestamp())
+
+def handle_batch(records):
+    table = get_table()
+
+    failed_message_ids = set()
+    items = {}
+    with metrics.timer('Build'):
+        for record in records:
+            try:
+                item = build_item(json.loads(record['body']))
+            except Exception:
+                logger.exception(f'Cannot parse message {record["messageId"]}')
+                failed_message_ids.add(record['messageId'])
+                continue
+            # BatchWriteItem rejects duplicated keys in one request, EventBridge retries may deliver twice
+            items.setdefault((item['id'], item['timestamp']), []).append((record['messageId'], item))
+
+    shard_map = get_shard_map()
+    with metrics.timer('Store'):
+        # redelivered messages and retried events already stored are acknowledged, not handled again
+        duplicates = [items.pop(key) for key in idempotency.stored(table, [
+            {'id': event_id, 'timestamp': timestamp} for event_id, timestamp in items
+        ])]
+        unprocessed = batch_put(table, [
+            item_format.encode({**item, 'userIdentity': shard_map.key_of(item['userIdentity'], item['id'])})
+            for item in (entries[-1][1] for entries in items.values())
+        ])
+    for item in unprocessed:
+        failed_message_ids.update(message_id for message_id, _ in items.pop((item['id'], item['timestamp'])))
+    metrics.add('Activities', len(items))
+    metrics.add('Duplicates', len(duplicates))
+    logger.info(f'{len(items)} activities have been stored into database, {len(duplicates)} duplicates, '
+                f'{len(failed_message_ids)} failed')
+
+    stored = [entries[-1][1] for entries in items.values()]
+    with metrics.timer('Profile'):
+        compare_with_profiles(table, stored)
+    with metrics.timer('Alerting'):
+        failed_message_ids.update(apply_alerting(table, stored, items))
+    metrics.add('FailedRecords', len(failed_message_ids))
+
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(failed_message_ids)]}
+
+def compare_with_profiles(table, events):
+    # adds `profile`, the features of every successful console sign-in against the
+    # baseline of its user (see activity_common/baseline.py), updating the baselines
+    # with one read and one write per user
+    by_user = {}
+    for event in sorted(events, key=lambda e: e['timestamp']):
+        if alerting.is_successful_console_login(event) and not event['userIdentity'].endswith('#Unknown'):
+            by_user.setdefault(event['userIdentity'], []).append(event)
+    if not by_user:
+        return
+    from activity_common import baseline
+    database = get_ip_database()
+    for user_identity, user_events in by_user.items():
+        sign_ins = []
+        for event in user_events:
+            country = (event.get('ipInfo') or {}).get('country')
+            sign_ins.append({
+                'ip': event['detail'].get('sourceIPAddress'),
+                'userAgent': event['detail'].get('userAgent'),
+                'timestamp': event['timestamp'],
+                'country': country,
+                'location': database.location(country) if database and country else None
+            })
+        try:
+            features = baseline.update(table, user_identity, sign_ins)
+        except Exception:
+            # the rules on the profile do not match then, the others still apply
+            metrics.add('ProfileErrors', 1)
+            logger.exception(f'Cannot compare sign-ins of {user_identity} with their profile')
+            continue
+        for event, event_features in zip(user_events, features):
+            event['profile'] = event_features
+
+def observe(shard_map, user_identity, count):
+    # `count` failures in the minute on one shard key, an estimate of the user's rate
+    if shard_map.observe(user_identity, count * shard_map.shards_of(user_identity)):
+        logger.warning(f'{user_identity} has been sharded over {shard_map.shards} keys')
+
+def batch_put(table, items):
+    # returns the items still unprocessed after retrying with exponential backoff and jitter
+    unprocessed = []
+    for start in range(0, len(items), BATCH_WRITE_SIZE):
+        requests = [{'PutRequest': {'Item': item}} for item in items[start:start + BATCH_WRITE_SIZE]]
+        for attempt in range(BATCH_WRITE_ATTEMPTS):
+            if attempt:
+                metrics.add('BatchWriteRetries', 1)
+                time.sleep(random.uniform(0, BATCH_WRITE_BASE_DELAY * 2 ** attempt))
+            try:
+                response = table.meta.client.batch_write_item(RequestItems={table.name: requests})
+            except table.meta.client.exceptions.ProvisionedThroughputExceededException:
+                continue
+            requests = response.get('UnprocessedItems', {}).get(table.name, [])
+            if not requests:
+                break
+        unprocessed.extend(request['PutRequest']['Item'] for request in requests)
+    return unprocessed
+
+def apply_alerting(table, events, items):
+    # the same decision tree as the state machine, applied to every stored record.
+    # Returns the message ids whose alerting failed so SQS redrives only those
+    failed_message_ids = set()
+    failed_event_ids = set()
+
+    def fail(event):
+        logger.exception(f'Cannot apply alerting to {event["id"]}')
+        # redelivered, the message is stored and alerted on again. Its failure, if counted
+        # already, is not counted twice (failure_counter.record_failure)
+        if event['id'] not in failed_event_ids:
+            forget(table, event)
+        failed_event_ids.add(event['id'])
+        failed_message_ids.update(message_id for message_id, _ in items[(event['id'], event['timestamp'])])
+
+    # one counter update per user shard and minute bucket instead of one per failure
+    shard_map = get_shard_map()
+    failures = {}
+    for event in events:
+        if alerting.is_failed_console_login(event):
+            user_key = shard_map.key_of(event['userIdentity'], event['id'])
+            failures.setdefault((event['userIdentity'], user_key, failure_counter.bucket_of(event['timestamp'])), []).append(event)
+    for (user_identity, user_key, bucket), bucket_events in failures.items():
+        try:
+            count = failure_counter.record_failure(table, user_key, bucket, event_ids=[event['id'] for event in bucket_events])
+            if count is not None:
+                observe(shard_map, user_identity, count)
+        except Exception:
+            for event in bucket_events:
+                fail(event)
+
+    # number each failure as if it had been counted on its own, so the 1st and 2nd
+    # failures of a batch don't alert with the total of the batch
+    now = int(time.time())
+    by_user = {}
+    for event in sorted(filter(alerting.needs_failed_attempts, events), key=lambda e: e['timestamp']):
+        by_user.setdefault(event['userIdentity'], []).append(event)
+    for user_identity, user_events in by_user.items():
+        user_events = [event for event in user_events if event['id'] not in failed_event_ids]
+        try:
+            total = failure_counter.count_failures(table, user_identity, now, shard_map.shards_of(user_identity))
+        except Exception:
+            for event in user_events:
+                fail(event)
+            continue
+        for rank, event in enumerate(user_events, start=1):
+            event['failedAttempts'] = total - len(user_events) + rank
+
+    from activity_common import coalescing
+    sns = get_sns()
+    for event in events:
+        if event['id'] in failed_event_ids:
+            continue
+        try:
+            # the alerts of the parallel state machine, a stateless one and a stored one
+            for reason in alerting.reasons(event):
+                # repeats inside the alert window only count towards its digest
+                result = coalescing.coalesce(table, get_sqs(), os.getenv('DIGEST_QUEUE_URL'), event['userIdentity'], reason,
+                                             event['timestamp'], now, int(os.getenv('ALERT_WINDOW_SECONDS', coalescing.DEFAULT_WINDOW_SECONDS)),
+                                             event['id'])
+                if result['first']:
+                    try:
+                        alerting.publish(sns, os.getenv('SNS_TOPIC_ARN'), event, reason)
+                    except Exception:
+                        # coalesced again when the message is redelivered
+                        coalescing.forget(table, reason, event['id'])
+                        raise
+                    logger.info(f'Alert {reason} has been published for {event["id"]}')
+                else:
+                    logger.info(f'Alert {reason} for {event["id"]} has been coalesced, {result["count"]} in window')
+        except Exception:
+            fail(event)
+    return failed_message_ids
+
+# what the imports allocated lives as long as the container. Frozen, a full collection in
+# the first invocations does not walk it again (about 30 ms of the first invoke)
+gc.freeze()
@@ -0,0 +1,52 @@
+import json
+
+from activity_common import envelope, rules
+
+
+# in-process counterpart of the decision tree of the sign-in state machine, used where
+# events are processed in batches instead of one execution per event. Both are compiled
+# from the same rules, see rules.py
+
+
+def is_failed_console_login(event: dict) -> bool:
+    detail = event['detail']
+    return detail['eventName'] == 'ConsoleLogin' and (detail.get('responseElements') or {}).get('ConsoleLogin') == 'Failure'
+
+
+def is_successful_console_login(event: dict) -> bool:
+    detail = event['detail']
+    return detail['eventName'] == 'ConsoleLogin' and (detail.get('responseElements') or {}).get('ConsoleLogin') == 'Success'
+
+
+def needs_failed_attempts(event: dict) -> bool:
+    return 'failedAttempts' in rules.default().needs(event)
+
+
+def classify(event: dict):
+    # returns the alert reason, or None. Events for which needs_failed_attempts() is true
+    # must carry `failedAttempts`
+    return rules.default().classify(event)
+
+
+def reasons(event: dict) -> list:
+    # the alert reasons of the parallel state machine, see rules.Evaluator.alerts()
+    return rules.default().alerts(event)
+
+
+def message_attributes(reason: str) -> dict:
+    rule = rules.default().rule(reason)
+    return {
+        'severity': {'DataType': 'String', 'StringValue': rule['severity']},
+        'reason': {'DataType': 'String', 'StringValue': reason},
+        'targets': {'DataType': 'String.Array', 'StringValue': json.dumps(rule['targets'])},
+        'channel': {'DataType': 'String', 'StringValue': rule['channel']}
+    }
+
+
+def publish(sns, topic_arn: str, event: dict, reason: str):
+    # the slim envelope of the event, as the state machine publishes it
+    return sns.publish(
+        TopicArn=topic_arn,
+        Message=json.dumps(envelope.slim(event), default=str),
+        MessageAttributes=message_attributes(reason)
+    )
@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from activity_common import sharding
+from activity_common.json_values import plain
+
+
+# Cold tier of the activity table. Activities are archived as they are stored (from the
+# table stream, or by a batch export of the table), so the hot table only keeps them for
+# the days alerting and recent reports need, see ACTIVITY_TTL_DAYS of
+# store-sign-in-activity. Objects are gzipped JSON lines, one decoded activity per line
+# sorted by user and time, partitioned Hive-style by UTC day and a hash bucket of the
+# logical userIdentity:
+#   <prefix>/date=2022-04-20/bucket=07/<first timestamp>-<digest>.jsonl.gz
+# A query by user and time range only lists and reads one bucket of the days in range.
+# Object names follow from their content, so a retried batch overwrites its own objects;
+# readers drop the duplicates left by a batch retried with other records.
+PREFIX = 'activity'
+BUCKETS = 16
+# attributes of the hot table only
+DROPPED_ATTRIBUTES = ('ttl',)
+
+
+def bucket_of(user_identity: str) -> int:
+    return zlib.crc32(sharding.logical(user_identity).encode('utf-8')) % BUCKETS
+
+
+def day_of(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+
+def days(since: int, until: int) -> list:
+    first = datetime.fromtimestamp(since, timezone.utc).date()
+    last = datetime.fromtimestamp(until, timezone.utc).date()
+    return [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+
+
+def partition_prefix(prefix: str, day: str, bucket: int) -> str:
+    return f'{prefix}/date={day}/bucket={bucket:02d}/'
+
+
+def encode(activities: list) -> bytes:
+    lines = ''.join(json.dumps(activity, separators=(',', ':'), sort_keys=True) + '\n' for activity in activities)
+    # no timestamp in the header: the same activities give the same bytes
+    return gzip.compress(lines.encode('utf-8'), mtime=0)
+
+
+def decode(data: bytes):
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as lines:
+        for line in lines:
+            yield json.loads(line)
+
+
+def archived(activity: dict) -> dict:
+    # an activity as decoded by item_format, as it is archived
+    activity = {name: value for name, value in plain(activity).items() if name not in DROPPED_ATTRIBUTES}
+    activity['userIdentity'] = sharding.logical(activity['userIdentity'])
+    return activity
+
+
+def write(store, activities: list, prefix: str = PREFIX) -> list:
+    # archives decoded activities, one object per partition. Returns the keys written
+    partitions = {}
+    for activity in map(archived, activities):
+        key = (day_of(activity['timestamp']), bucket_of(activity['userIdentity']))
+        partitions.setdefault(key, []).append(activity)
+
+    keys = []
+    for (day, bucket), members in sorted(partitions.items()):
+        members.sort(key=lambda activity: (activity['userIdentity'], activity['timestamp'], activity['id']))
+        digest = hashlib.sha256('\n'.join(f'{activity["id"]}#{activity["timestamp"]}' for activity in members).encode('utf-8'))
+        name = f'{min(activity["timestamp"] for activity in members)}-{digest.hexdigest()[:16]}.jsonl.gz'
+        keys.append(partition_prefix(prefix, day, bucket) + name)
+        store.put(keys[-1], encode(members))
+    return keys
+
+
+def query(store, since: int, until: int, user_identity: str = None, prefix: str = PREFIX):
+    # yields the archived activities between `since` and `until` (inclusive), of one user
+    # if given, in no particular order. Only the partitions that can hold them are read
+    buckets = [bucket_of(user_identity)] if user_identity else range(BUCKETS)
+    user_identity = sharding.logical(user_identity) if user_identity else None
+    seen = set()
+    for day in days(since, until):
+        for bucket in buckets:
+            for key in store.list(partition_prefix(prefix, day, bucket)):
+                for activity in decode(store.get(key)):
+                    if not since <= activity['timestamp'] <= until:
+                        continue
+                    if user_identity and activity['userIdentity'] != user_identity:
+                        continue
+                    if (activity['id'], activity['timestamp']) not in seen:
+                        seen.add((activity['id'], activity['timestamp']))
+                        yield activity
+
+
+class LocalStore:
+    # an archive in a local directory, keys are relative paths
+    def __init__(self, root: str):
+        self.root = root
+        self.reads = 0
+        self.bytes_read = 0
+
+    def put(self, key: str, data: bytes):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # readers never see a partial object
+        handle, staging = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.replace(staging, path)
+
+    def get(self, key: str) -> bytes:
+        with open(os.path.join(self.root, key), 'rb') as file:
+            data = file.read()
+        self.reads += 1
+        self.bytes_read += len(data)
+        return data
+
+    def list(self, prefix: str) -> list:
+        directory = os.path.join(self.root, prefix)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(prefix + name for name in os.listdir(directory) if name.endswith('.jsonl.gz'))
+
+
+class S3Store:
+    # an archive in an S3 bucket
+    def __init__(self, client, bucket: str):
+        self.client = client
+        self.bucket = bucket
+        self.reads = 0
+        self.bytes_read = 0
+
+    def put(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType='application/gzip')
+
+    def get(self, key: str) -> bytes:
+        data = self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        self.reads += 1
+        self.bytes_read += len(data)
+        return data
+
+    def list(self, prefix: str) -> list:
+        keys = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(entry['Key'] for entry in page.get('Contents', []))
+        return keys
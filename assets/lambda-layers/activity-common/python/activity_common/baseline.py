@@ -0,0 +1,215 @@
+import hashlib
+import math
+
+
+# Behavioral baseline of every user, one item per user in the activity table that every
+# successful console sign-in reads and rewrites, so deciding whether a sign-in is unusual
+# costs one read and one write whatever the length of the history:
+#   id = 'Profile#<userIdentity>', timestamp = 0
+#   seen          Bloom filter of the source IPs and user agents signed in from
+#   seenBefore    the previous generation of `seen`, which is rotated once it holds
+#                 BLOOM_CAPACITY values: old values age out instead of the false
+#                 positive rate growing with the history
+#   ips           HyperLogLog registers of the distinct source IPs ever seen
+#   lastIp, lastSeen, lastCountry, lastLocation   the previous sign-in
+#   signIns       sign-ins so far, nothing is new during the first LEARNING_SIGN_INS
+#   version       concurrent sign-ins of a user are serialized by a conditional put
+# The item stays under 2.5 KB, 1.4 KB until the first rotation. Locations are the country locations of the IP database,
+# see ip_database.py: travel between neighbouring countries is not told apart.
+KEY_PREFIX = 'Profile#'
+BLOOM_BYTES = 1024
+BLOOM_HASHES = 7
+# about 1% false positives when full
+BLOOM_CAPACITY = 850
+HLL_PRECISION = 8
+LEARNING_SIGN_INS = 5
+# faster than an airliner between locations this far apart is impossible travel
+MAX_SPEED_KMH = 1000
+MIN_TRAVEL_KM = 500
+EARTH_RADIUS_KM = 6371
+# locations are stored in 1/10000 degrees, DynamoDB takes no floats
+LOCATION_SCALE = 10000
+SAVE_ATTEMPTS = 5
+
+
+def profile_key(user_identity: str) -> dict:
+    return {'id': f'{KEY_PREFIX}{user_identity}', 'timestamp': 0}
+
+
+def _hash(value: str, size: int) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=size).digest(), 'big')
+
+
+def _popcount(data: bytes) -> int:
+    return bin(int.from_bytes(data, 'big')).count('1')
+
+
+class BloomFilter:
+    def __init__(self, bits: bytes = None, size: int = BLOOM_BYTES, hashes: int = BLOOM_HASHES):
+        self.bits = bytearray(bits) if bits else bytearray(size)
+        self.hashes = hashes
+
+    def _positions(self, value: str):
+        # double hashing, k positions out of one 128 bit digest
+        digest = _hash(value, 16)
+        first, step = digest >> 64, digest & 0xFFFFFFFFFFFFFFFF | 1
+        size = len(self.bits) * 8
+        return [(first + i * step) % size for i in range(self.hashes)]
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] >> (position & 7) & 1 for position in self._positions(value))
+
+    def count(self) -> float:
+        # estimated number of values added
+        size = len(self.bits) * 8
+        ones = _popcount(self.bits)
+        if ones == size:
+            return math.inf
+        return round(-size / self.hashes * math.log(1 - ones / size))
+
+
+class HyperLogLog:
+    def __init__(self, registers: bytes = None, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers else bytearray(1 << precision)
+
+    def add(self, value: str):
+        digest = _hash(value, 8)
+        index = digest >> (64 - self.precision)
+        rest = digest & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        size = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / size) * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # linear counting while few registers are set
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+
+def distance_km(first, second) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (*first, *second))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class Profile:
+    def __init__(self, user_identity: str, item: dict = None):
+        item = item or {}
+        self.user_identity = user_identity
+        self.version = int(item.get('version', 0))
+        self.seen = BloomFilter(_bytes(item.get('seen')))
+        self.seen_before = BloomFilter(_bytes(item.get('seenBefore')))
+        self.ips = HyperLogLog(_bytes(item.get('ips')))
+        self.sign_ins = int(item.get('signIns', 0))
+        self.last_ip = item.get('lastIp')
+        self.last_seen = int(item['lastSeen']) if 'lastSeen' in item else None
+        self.last_country = item.get('lastCountry')
+        self.last_location = tuple(int(value) / LOCATION_SCALE for value in item['lastLocation']) if 'lastLocation' in item else None
+
+    def _known(self, value: str) -> bool:
+        return value in self.seen or value in self.seen_before
+
+    def _remember(self, value: str):
+        if value in self.seen:
+            return
+        if self.seen.count() >= BLOOM_CAPACITY:
+            self.seen_before, self.seen = self.seen, BloomFilter()
+        self.seen.add(value)
+
+    def observe(self, ip: str, user_agent: str, timestamp: int, country: str = None, location=None) -> dict:
+        # the features of a sign-in against the baseline so far, then the sign-in is
+        # added to it. Sign-ins may be observed out of order
+        learning = self.sign_ins < LEARNING_SIGN_INS
+        features = {}
+        if ip:
+            features['newSourceIp'] = not learning and not self._known(f'ip:{ip}')
+        if user_agent:
+            features['newUserAgent'] = not learning and not self._known(f'ua:{user_agent}')
+        if location and self.last_location and self.last_seen is not None:
+            distance = distance_km(self.last_location, location)
+            hours = max(abs(timestamp - self.last_seen), 1) / 3600
+            features['travelSpeed'] = round(distance / hours)
+            features['impossibleTravel'] = distance >= MIN_TRAVEL_KM and distance / hours > MAX_SPEED_KMH
+            if features['impossibleTravel']:
+                features['previousCountry'] = self.last_country
+
+        if ip:
+            self._remember(f'ip:{ip}')
+            self.ips.add(ip)
+        if user_agent:
+            self._remember(f'ua:{user_agent}')
+        features['distinctIps'] = self.ips.count()
+        self.sign_ins += 1
+        if self.last_seen is None or timestamp >= self.last_seen:
+            self.last_ip, self.last_seen = ip, timestamp
+            if location:
+                self.last_country, self.last_location = country, tuple(location)
+        return features
+
+    def item(self) -> dict:
+        item = {
+            # no userIdentity, the profile stays out of UserIdentityIndex
+            **profile_key(self.user_identity),
+            'seen': bytes(self.seen.bits),
+            'ips': bytes(self.ips.registers),
+            'signIns': self.sign_ins,
+            'version': self.version + 1
+        }
+        if any(self.seen_before.bits):
+            item['seenBefore'] = bytes(self.seen_before.bits)
+        if self.last_seen is not None:
+            item['lastSeen'] = self.last_seen
+        if self.last_ip:
+            item['lastIp'] = self.last_ip
+        if self.last_location:
+            item['lastCountry'] = self.last_country
+            item['lastLocation'] = [round(value * LOCATION_SCALE) for value in self.last_location]
+        return item
+
+
+def _bytes(value):
+    # boto3 returns Binary attributes wrapped
+    return getattr(value, 'value', value)
+
+
+def load(table, user_identity: str) -> Profile:
+    item = table.meta.client.get_item(TableName=table.name, Key=profile_key(user_identity), ConsistentRead=True).get('Item')
+    return Profile(user_identity, item)
+
+
+def save(table, profile: Profile) -> bool:
+    # False when another sign-in of the user saved the profile since it was loaded
+    condition = {'ConditionExpression': 'attribute_not_exists(id)'} if not profile.version else {
+        'ConditionExpression': '#version = :version',
+        'ExpressionAttributeNames': {'#version': 'version'},
+        'ExpressionAttributeValues': {':version': profile.version}
+    }
+    try:
+        table.meta.client.put_item(TableName=table.name, Item=profile.item(), **condition)
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def update(table, user_identity: str, sign_ins: list) -> list:
+    # observes the sign-ins of one user, [{'ip', 'userAgent', 'timestamp', 'country',
+    # 'location'}], in one read and one write. Returns their features in order
+    for _ in range(SAVE_ATTEMPTS):
+        profile = load(table, user_identity)
+        features = [
+            profile.observe(sign_in.get('ip'), sign_in.get('userAgent'), sign_in['timestamp'],
+                            sign_in.get('country'), sign_in.get('location'))
+            for sign_in in sign_ins
+        ]
+        if save(table, profile):
+            return features
+    raise RuntimeError(f'Profile of {user_identity} is updated concurrently, gave up after {SAVE_ATTEMPTS} attempts')
@@ -0,0 +1,126 @@
+import json
+
+from activity_common import alerting, idempotency
+
+
+# alerts are coalesced per (user, reason, window) in the activity table:
+#   id = 'Alert#<reason>#<userIdentity>', timestamp = start of the window
+# The first alert of a window is published right away and schedules a digest for the
+# end of the window; repeats inside the window are only counted. An event is counted
+# once: its alert is claimed (idempotency.claim) before it is registered, so a duplicated
+# delivery or a replayed execution neither alerts nor counts towards the digest again.
+# The window remembers the event of its first alert: coalesced again after its schedule
+# or publish failed (coalescing.forget), that event is still the first, not counted twice.
+KEY_PREFIX = 'Alert#'
+DEFAULT_WINDOW_SECONDS = 15 * 60
+# SQS DelaySeconds is the timer of the digest
+MAX_WINDOW_SECONDS = 15 * 60
+
+
+def alert_key(user_identity: str, reason: str) -> str:
+    return f'{KEY_PREFIX}{reason}#{user_identity}'
+
+
+def window_of(timestamp: int, window_seconds: int) -> int:
+    return timestamp - timestamp % window_seconds
+
+
+def register(table, user_identity: str, reason: str, timestamp: int, window_seconds: int = DEFAULT_WINDOW_SECONDS,
+             event_id: str = None) -> dict:
+    window_start = window_of(timestamp, window_seconds)
+    key = {'id': alert_key(user_identity, reason), 'timestamp': window_start}
+    try:
+        item = table.update_item(
+            Key=key,
+            UpdateExpression='ADD #count :one SET firstSeen = if_not_exists(firstSeen, :seen), '
+                             'firstEvent = if_not_exists(firstEvent, :event), lastSeen = :seen, #ttl = if_not_exists(#ttl, :ttl)',
+            ConditionExpression='attribute_not_exists(firstEvent) OR firstEvent <> :event',
+            ExpressionAttributeNames={'#count': 'count', '#ttl': 'ttl'},
+            ExpressionAttributeValues={':one': 1, ':seen': timestamp, ':event': event_id or '',
+                                       ':ttl': window_start + 2 * window_seconds},
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        # the first event of the window, registered again
+        item = table.get_item(Key=key, ConsistentRead=True)['Item']
+    return {
+        'first': item['firstEvent'] == event_id if event_id else int(item['count']) == 1,
+        'count': int(item['count']),
+        'firstSeen': int(item['firstSeen']),
+        'lastSeen': int(item['lastSeen']),
+        'windowStart': window_start
+    }
+
+
+def digest_request(user_identity: str, reason: str, window_start: int, window_seconds: int) -> dict:
+    return {'userIdentity': user_identity, 'reason': reason, 'windowStart': window_start, 'windowSeconds': window_seconds}
+
+
+def schedule_digest(sqs, queue_url: str, user_identity: str, reason: str, window_start: int, window_seconds: int, now: int):
+    # delivered when the window closes
+    delay = max(0, min(MAX_WINDOW_SECONDS, window_start + window_seconds - now))
+    return sqs.send_message(
+        QueueUrl=queue_url,
+        MessageBody=json.dumps(digest_request(user_identity, reason, window_start, window_seconds)),
+        DelaySeconds=delay
+    )
+
+
+def claim_key(reason: str, event_id: str) -> str:
+    return f'{reason}#{event_id}'
+
+
+def coalesce(table, sqs, queue_url: str, user_identity: str, reason: str, timestamp: int, now: int,
+             window_seconds: int = DEFAULT_WINDOW_SECONDS, event_id: str = None) -> dict:
+    # registers the alert and, for the first one of its window, schedules the digest.
+    # The alert of an event coalesced before is `duplicate`, neither first nor counted.
+    # A digest scheduled again for a retried first event is published once, see digest_key
+    if event_id and not idempotency.claim(table, 'Alert', claim_key(reason, event_id), now):
+        return {'first': False, 'duplicate': True, 'count': None, 'windowStart': window_of(timestamp, window_seconds)}
+    try:
+        result = register(table, user_identity, reason, timestamp, window_seconds, event_id)
+        if result['first']:
+            schedule_digest(sqs, queue_url, user_identity, reason, result['windowStart'], window_seconds, now)
+    except Exception:
+        if event_id:
+            forget(table, reason, event_id)
+        raise
+    if event_id:
+        idempotency.complete(table, 'Alert', claim_key(reason, event_id), now)
+    return result
+
+
+def forget(table, reason: str, event_id: str):
+    # the alert of the event is coalesced again, e.g. when it could not be published
+    idempotency.release(table, 'Alert', claim_key(reason, event_id))
+
+
+def digest_key(request: dict) -> str:
+    # claimed before a digest is published (idempotency.claim)
+    return f'{alert_key(request["userIdentity"], request["reason"])}#{request["windowStart"]}'
+
+
+def build_digest(table, request: dict):
+    # returns the digest of a closed window, or None when nothing was suppressed
+    item = table.get_item(
+        Key={'id': alert_key(request['userIdentity'], request['reason']), 'timestamp': request['windowStart']},
+        ConsistentRead=True
+    ).get('Item')
+    if not item or int(item['count']) < 2:
+        return None
+    return {
+        'userIdentity': request['userIdentity'],
+        'reason': request['reason'],
+        'count': int(item['count']),
+        'suppressed': int(item['count']) - 1,
+        'firstSeen': int(item['firstSeen']),
+        'lastSeen': int(item['lastSeen']),
+        'windowStart': request['windowStart'],
+        'windowEnd': request['windowStart'] + request.get('windowSeconds', DEFAULT_WINDOW_SECONDS)
+    }
+
+
+def publish_digest(sns, topic_arn: str, digest: dict):
+    attributes = alerting.message_attributes(digest['reason'])
+    attributes['digest'] = {'DataType': 'String', 'StringValue': 'true'}
+    return sns.publish(TopicArn=topic_arn, Message=json.dumps(digest), MessageAttributes=attributes)
@@ -0,0 +1,206 @@
+import asyncio
+import random
+import smtplib
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+
+# Delivery of notifications to many targets at once, on one asyncio event loop kept by
+# the container. Every (message, target) pair is a task of its own with its own attempt
+# timeout and retries, so a slow or failing target delays nobody but itself:
+#   - HTTP targets (Slack and generic webhooks) are posted with a requests Session in
+#     the threads of the loop, keeping connections alive across warm invocations. At
+#     most `max_connections` requests are in flight per address, and a 429 makes every
+#     sender of that address wait for Retry-After.
+#   - email goes through smtplib in the same threads: Python 3.9 has no asyncio SMTP
+#     with STARTTLS.
+# 429, 5xx, 4xx SMTP replies and connections that could not be opened are retried with
+# backoff until the deadline, other errors fail the delivery at once. A POST that may
+# have reached the webhook (e.g. its connection dropped or it timed out waiting for the
+# response) is not sent again.
+BACKOFF_BASE_SECONDS = 0.2
+BACKOFF_MAX_SECONDS = 5
+# threads of the loop, i.e. requests and emails in flight over every target
+MAX_THREADS = 32
+
+
+class DeliveryError(Exception):
+    pass
+
+
+class _RetryableError(Exception):
+    def __init__(self, message: str, delay: float = None):
+        super().__init__(message)
+        self.delay = delay
+
+
+def http_session(pool_size: int = MAX_THREADS) -> requests.Session:
+    # no retries by urllib3: a POST is never resent behind our back
+    session = requests.Session()
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0))
+    return session
+
+
+def not_sent(error: requests.RequestException) -> bool:
+    # the connection could not be opened, so the request never left
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectTimeout) or isinstance(reason, ConnectTimeoutError)
+
+
+def _send_email(settings: dict, recipients: list, subject: str, text: str, timeout: float):
+    message = EmailMessage()
+    message['From'] = settings['sender']
+    message['To'] = ', '.join(recipients)
+    message['Subject'] = subject
+    message.set_content(text)
+    with smtplib.SMTP(settings['host'], int(settings.get('port', 25)), timeout=timeout) as smtp:
+        if settings.get('starttls'):
+            smtp.starttls(context=ssl.create_default_context())
+        if settings.get('username'):
+            smtp.login(settings['username'], settings['password'])
+        smtp.send_message(message)
+
+
+class Dispatcher:
+    # `metrics` (instrumentation.Metrics) records per attempt <label>Duration,
+    # <label>Status<n>xx, <label>RateLimited and <label>ConnectionErrors
+
+    def __init__(self, metrics=None, logger=None):
+        self.metrics = metrics
+        self.logger = logger
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=MAX_THREADS))
+        self.http = http_session()
+        self._rate_limited_until = {}
+        self._semaphores = {}
+
+    def run(self, coroutine):
+        # runs `coroutine` to completion on the loop of the container
+        return self.loop.run_until_complete(coroutine)
+
+    def _add(self, name: str, value: float = 1):
+        if self.metrics:
+            self.metrics.add(name, value)
+
+    def _timer(self, label: str):
+        return self.metrics.timer(label) if self.metrics else _NoTimer()
+
+    def _warn(self, message: str):
+        if self.logger:
+            self.logger.warning(message)
+
+    def _semaphore(self, url: str, limit: int):
+        if (url, limit) not in self._semaphores:
+            self._semaphores[url, limit] = asyncio.Semaphore(limit)
+        return self._semaphores[url, limit]
+
+    def close(self):
+        self.http.close()
+        self.loop.close()
+
+    async def post_json(self, url: str, body: str, deadline: float, timeout: float, label: str = 'Webhook',
+                        attempts: int = None, max_connections: int = 8,
+                        backoff_base: float = BACKOFF_BASE_SECONDS) -> requests.Response:
+        async def attempt(attempt_timeout):
+            async with self._semaphore(url, max_connections):
+                await self._wait_rate_limit(url, deadline)
+                with self._timer(label):
+                    try:
+                        response = await asyncio.to_thread(
+                            self.http.post, url, data=body.encode('utf-8'), headers={'Content-Type': 'application/json'},
+                            timeout=max(0.001, min(attempt_timeout, deadline - time.monotonic())))
+                    except requests.RequestException as error:
+                        self._add(f'{label}ConnectionErrors')
+                        if not_sent(error):
+                            raise _RetryableError(f'{label} request failed: {error!r}')
+                        raise DeliveryError(f'{label} request failed, maybe after it was delivered: {error!r}')
+            self._add(f'{label}Status{response.status_code // 100}xx')
+            if response.status_code < 300:
+                return response
+            if response.status_code == 429:
+                self._add(f'{label}RateLimited')
+                delay = retry_after(response)
+                # every concurrent sender of this address waits, not only this one
+                self._rate_limited_until[url] = max(self._rate_limited_until.get(url, 0), time.monotonic() + delay)
+                raise _RetryableError(f'{label} rate limited, retry after {delay}s', delay)
+            if response.status_code >= 500:
+                raise _RetryableError(f'{label} responded {response.status_code}')
+            raise DeliveryError(f'{label} responded {response.status_code}: {response.text}')
+
+        return await self._retry(attempt, label, deadline, timeout, attempts, backoff_base)
+
+    async def send_email(self, settings: dict, recipients: list, subject: str, text: str, deadline: float,
+                         timeout: float, label: str = 'Email', attempts: int = None,
+                         backoff_base: float = BACKOFF_BASE_SECONDS):
+        async def attempt(attempt_timeout):
+            attempt_timeout = max(0.001, min(attempt_timeout, deadline - time.monotonic()))
+            with self._timer(label):
+                try:
+                    await asyncio.wait_for(self.loop.run_in_executor(
+                        None, _send_email, settings, recipients, subject, text, attempt_timeout), attempt_timeout)
+                except smtplib.SMTPResponseException as error:
+                    self._add(f'{label}Status{error.smtp_code // 100}xx')
+                    if 400 <= error.smtp_code < 500:
+                        raise _RetryableError(f'{label} server replied {error.smtp_code}')
+                    raise DeliveryError(f'{label} server replied {error.smtp_code}: {error.smtp_error!r}')
+                except smtplib.SMTPRecipientsRefused as error:
+                    raise DeliveryError(f'{label} recipients refused: {sorted(error.recipients)}')
+                except (OSError, smtplib.SMTPException, asyncio.TimeoutError) as error:
+                    self._add(f'{label}ConnectionErrors')
+                    raise _RetryableError(f'{label} delivery failed: {error!r}')
+            self._add(f'{label}Status2xx')
+
+        await self._retry(attempt, label, deadline, timeout, attempts, backoff_base)
+
+    async def _retry(self, attempt, label: str, deadline: float, timeout: float, attempts: int, backoff_base: float):
+        # until the deadline, and at most `attempts` failed attempts if given
+        tried = failed = 0
+        while True:
+            if deadline - time.monotonic() <= 0:
+                raise DeliveryError(f'No time left to notify {label} after {tried} attempts')
+            tried += 1
+            try:
+                return await attempt(timeout)
+            except _RetryableError as error:
+                if error.delay is None:
+                    failed += 1
+                    if attempts and failed >= attempts:
+                        raise DeliveryError(f'{error}, gave up after {failed} failed attempts')
+                delay = error.delay if error.delay is not None else backoff(failed, backoff_base)
+                self._warn(f'{error}, retry in {delay:.2f}s')
+            if time.monotonic() + delay >= deadline:
+                raise DeliveryError(f'No time left to notify {label} after {tried} attempts')
+            await asyncio.sleep(delay)
+
+    async def _wait_rate_limit(self, url: str, deadline: float):
+        delay = self._rate_limited_until.get(url, 0) - time.monotonic()
+        if delay > 0:
+            if time.monotonic() + delay >= deadline:
+                raise DeliveryError(f'No time left to notify {url} before its rate limit is over')
+            await asyncio.sleep(delay)
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def retry_after(response: requests.Response) -> float:
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', 1)))
+    except ValueError:
+        return 1.0
+
+
+def backoff(attempt: int, base: float = BACKOFF_BASE_SECONDS) -> float:
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, base * 2 ** attempt))
@@ -0,0 +1,72 @@
+from activity_common import item_format, rules
+
+
+# Slim alert envelope. What the sign-in state machine passes between its states, publishes
+# to SNS and the notifier renders is a projection of the activity instead of the whole
+# enriched event: the fields the alert rules read (rules.Evaluator.paths) and those below.
+# Fields keep their place in the event, so rules and renderers read an envelope as they
+# read the event. `id` and `timestamp` are the key of the stored activity, expand() reads
+# anything else from the table when it is needed.
+FORMAT = 1
+MARKER = 'envelope'
+# read by the state machine and its functions, and rendered by slack-notification
+PATHS = (
+    '$.id', '$.timestamp', '$.userIdentity', '$.eventName', '$.duplicate', '$.failedAttempts', '$.profile', '$.ipInfo',
+    '$.detail.userIdentity.type', '$.detail.userIdentity.userName', '$.detail.sourceIPAddress'
+)
+
+_paths = None
+_MISSING = object()
+
+
+def paths() -> tuple:
+    global _paths
+    if _paths is None:
+        _paths = tuple(sorted(set(PATHS) | rules.default().paths()))
+    return _paths
+
+
+def _get(event: dict, keys: list):
+    value = event
+    for key in keys:
+        value = value.get(key, _MISSING) if isinstance(value, dict) else _MISSING
+        if value is _MISSING:
+            break
+    return value
+
+
+def slim(event: dict, projected: tuple = None) -> dict:
+    # the envelope of an activity as built by store-sign-in-activity, or of an envelope
+    envelope = {}
+    for path in projected or paths():
+        keys = path[2:].split('.')
+        value = _get(event, keys)
+        if value is _MISSING:
+            continue
+        parent = envelope
+        for key in keys[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[keys[-1]] = value
+    envelope[MARKER] = FORMAT
+    return envelope
+
+
+def is_slim(message: dict) -> bool:
+    return MARKER in message
+
+
+def missing(message: dict, required) -> list:
+    # the paths of `required` a message does not have
+    return [path for path in required if _get(message, path[2:].split('.')) is _MISSING]
+
+
+def expand(table, envelope: dict) -> dict:
+    # the stored activity with the fields of the envelope, or the envelope alone once the
+    # activity has expired from the table
+    item = table.get_item(Key={'id': envelope['id'], 'timestamp': envelope['timestamp']}).get('Item')
+    if not item:
+        return envelope
+    activity = item_format.decode(item)
+    # the envelope also has the logical userIdentity of a sharded user, see sharding.py
+    activity.update({name: value for name, value in envelope.items() if name not in ('detail', MARKER)})
+    return activity
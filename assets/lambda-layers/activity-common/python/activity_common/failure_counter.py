@@ -0,0 +1,84 @@
+import time
+
+from boto3.dynamodb.conditions import Key
+
+from activity_common import idempotency, sharding
+
+
+# failed sign-in attempts are counted per user in minute buckets, stored in the
+# activity table itself next to the raw events:
+#   id = 'FailedSignIn#<userIdentity>', timestamp = start of the minute bucket
+# A sharded user has one counter per shard key, see sharding.py. Failures recorded with
+# their event ids are claimed first (idempotency.claim, for as long as a retry may come),
+# so a retry resuming after the count does not count them again.
+BUCKET_SECONDS = 60
+WINDOW_SECONDS = 60 * 60
+KEY_PREFIX = 'FailedSignIn#'
+
+
+def counter_key(user_identity: str) -> str:
+    return f'{KEY_PREFIX}{user_identity}'
+
+
+def bucket_of(timestamp: int) -> int:
+    return timestamp - timestamp % BUCKET_SECONDS
+
+
+def record_failure(table, user_identity: str, timestamp: int, count: int = 1, event_ids: list = None) -> int:
+    # adds `count` failures, or those of `event_ids` not counted before, to the bucket of
+    # `timestamp`. Returns the count of the bucket, None when nothing was added
+    claimed = []
+    if event_ids is not None:
+        now = int(time.time())
+        claimed = [event_id for event_id in event_ids
+                   if idempotency.claim(table, 'FailedSignIn', event_id, now, idempotency.DEFAULT_TTL_SECONDS)]
+        if not claimed:
+            return None
+        count = len(claimed)
+    bucket = bucket_of(timestamp)
+    try:
+        response = table.update_item(
+            Key={'id': counter_key(user_identity), 'timestamp': bucket},
+            UpdateExpression='ADD #count :count SET #ttl = if_not_exists(#ttl, :ttl)',
+            ExpressionAttributeNames={'#count': 'count', '#ttl': 'ttl'},
+            ExpressionAttributeValues={
+                ':count': count,
+                # keep the bucket one extra minute so a window ending "now" can still read it
+                ':ttl': bucket + WINDOW_SECONDS + BUCKET_SECONDS
+            },
+            ReturnValues='UPDATED_NEW'
+        )
+    except Exception:
+        # not counted, the retry counts them
+        for event_id in claimed:
+            idempotency.release(table, 'FailedSignIn', event_id)
+        raise
+    return int(response['Attributes']['count'])
+
+
+def count_failures(table, user_identity: str, now: int, shards: int = 1) -> int:
+    # the current bucket plus the previous ones, at most WINDOW_SECONDS / BUCKET_SECONDS keys
+    # per shard, the shards are read concurrently
+    oldest_bucket = bucket_of(now) - WINDOW_SECONDS + BUCKET_SECONDS
+
+    def count(key):
+        query = {
+            'TableName': table.name,
+            'KeyConditionExpression': Key('id').eq(counter_key(key)) & Key('timestamp').between(oldest_bucket, now),
+            'ProjectionExpression': '#count',
+            'ExpressionAttributeNames': {'#count': 'count'},
+            # the store step has just written the bucket, read it back strongly consistent
+            'ConsistentRead': True
+        }
+        total = 0
+        while True:
+            response = table.meta.client.query(**query)
+            total += sum(int(item.get('count', 0)) for item in response['Items'])
+
+            last_evaluated_key = response.get('LastEvaluatedKey')
+            if not last_evaluated_key:
+                break
+            query['ExclusiveStartKey'] = last_evaluated_key
+        return total
+
+    return sum(sharding.fan_out(count, sharding.shard_keys(user_identity, shards)))
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+
+
+# Retried and duplicated deliveries of the same event (EventBridge and SNS deliver at
+# least once, EventBridge targets and asynchronous Lambda invocations retry) are
+# recognised by a key of the event, so it is stored, counted and notified once:
+#   - an activity is written only if its item does not exist yet: the activity item is
+#     itself the record that the event has been handled (put_once)
+#   - other side effects are claimed in the activity table before they are done:
+#       id = 'Idempotency#<scope>#<key>', timestamp = 0
+#     A claim is released when its side effect fails, so the retry does it again, and
+#     lapses after `lease_seconds` if its holder died before completing or releasing it.
+# Everything goes through table.meta.client, callers claim from worker threads.
+KEY_PREFIX = 'Idempotency#'
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETED = 'COMPLETED'
+DEFAULT_LEASE_SECONDS = 5 * 60
+# retries of SNS and asynchronous Lambda invocations stop within hours
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+# BatchGetItem reads at most 100 keys
+BATCH_GET_SIZE = 100
+CACHE_SIZE = 1024
+
+
+def record_key(scope: str, key: str) -> dict:
+    return {'id': f'{KEY_PREFIX}{scope}#{key}', 'timestamp': 0}
+
+
+def put_once(table, item: dict) -> bool:
+    # False when an item with the key of `item` already exists, which is left as it is
+    try:
+        table.meta.client.put_item(TableName=table.name, Item=item, ConditionExpression='attribute_not_exists(id)')
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def stored(table, keys: list) -> set:
+    # the (id, timestamp) of the `keys` whose item exists. BatchWriteItem takes no
+    # condition, batches are checked before they are written
+    found = set()
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request = {table.name: {
+            'Keys': keys[start:start + BATCH_GET_SIZE],
+            'ProjectionExpression': 'id, #timestamp',
+            'ExpressionAttributeNames': {'#timestamp': 'timestamp'},
+            'ConsistentRead': True
+        }}
+        while request:
+            response = table.meta.client.batch_get_item(RequestItems=request)
+            found.update((item['id'], int(item['timestamp'])) for item in response['Responses'].get(table.name, []))
+            request = response.get('UnprocessedKeys')
+    return found
+
+
+def claim(table, scope: str, key: str, now: int, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> bool:
+    # True when the caller holds `key` and does its side effect: it was never claimed,
+    # or the lease of a holder that neither completed nor released it is over
+    try:
+        table.meta.client.put_item(
+            TableName=table.name,
+            Item={**record_key(scope, key), 'status': IN_PROGRESS, 'expires': now + lease_seconds,
+                  'ttl': now + lease_seconds},
+            ConditionExpression='attribute_not_exists(id) OR (#status = :in_progress AND #expires < :now)',
+            ExpressionAttributeNames={'#status': 'status', '#expires': 'expires'},
+            ExpressionAttributeValues={':in_progress': IN_PROGRESS, ':now': now}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def complete(table, scope: str, key: str, now: int, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+    table.meta.client.update_item(
+        TableName=table.name,
+        Key=record_key(scope, key),
+        UpdateExpression='SET #status = :completed, #ttl = :ttl REMOVE #expires',
+        ExpressionAttributeNames={'#status': 'status', '#ttl': 'ttl', '#expires': 'expires'},
+        ExpressionAttributeValues={':completed': COMPLETED, ':ttl': now + ttl_seconds}
+    )
+
+
+def release(table, scope: str, key: str):
+    table.meta.client.delete_item(TableName=table.name, Key=record_key(scope, key))
+
+
+class Results:
+    # the results of the last events handled by a container, so that a retry reaching
+    # the same warm container is answered without reading the table
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._results = OrderedDict()
+
+    def get(self, key: str):
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+        return result
+
+    def put(self, key: str, result: dict):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.size:
+            self._results.popitem(last=False)
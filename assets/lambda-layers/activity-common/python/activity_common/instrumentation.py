@@ -0,0 +1,171 @@
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+
+# Hot-path instrumentation of the handlers. Metrics are written as CloudWatch Embedded
+# Metric Format, one JSON line per invocation that CloudWatch Logs turns into metrics
+# without any PutMetricData call. Outside Lambda (tests, tools) nothing is written unless
+# AWS_LAMBDA_FUNCTION_NAME is set.
+NAMESPACE = 'AwsActivityTracking'
+# EMF accepts at most 100 metrics per document and 100 values per metric
+MAX_METRICS = 100
+MAX_VALUES = 100
+# DynamoDB operations accepting ReturnConsumedCapacity
+READ_OPERATIONS = ('GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems')
+WRITE_OPERATIONS = ('PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems')
+
+# logger name -> (configured level, DEBUG sample rate)
+_levels = {}
+
+
+class Metrics:
+    # Values recorded during an invocation, written and reset by flush(). Thread safe,
+    # handlers record from their worker threads
+
+    def __init__(self, namespace: str = NAMESPACE, stream=None):
+        self.namespace = namespace
+        self.stream = stream
+        self._values = {}
+        self._units = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float, unit: str = 'Count'):
+        with self._lock:
+            self._units[name] = unit
+            self._values.setdefault(name, []).append(value)
+
+    def timer(self, phase: str):
+        # `with metrics.timer('Store'):` records StoreDuration in milliseconds
+        return _Timer(self, f'{phase}Duration')
+
+    def instrument(self, client):
+        # every call of a DynamoDB client returns and records its consumed capacity
+        client.meta.events.register('before-parameter-build.dynamodb', self._request_capacity)
+        client.meta.events.register('after-call.dynamodb', self._record_capacity)
+        return client
+
+    def _request_capacity(self, params, model, **kwargs):
+        if model.name in READ_OPERATIONS or model.name in WRITE_OPERATIONS:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+    def _record_capacity(self, parsed, model, **kwargs):
+        if model.name == 'Query':
+            self.add('QueryPages', 1)
+        consumed = parsed.get('ConsumedCapacity')
+        if not consumed:
+            return
+        units = sum(entry.get('CapacityUnits', 0) for entry in (consumed if isinstance(consumed, list) else [consumed]))
+        name = 'ReadCapacityUnits' if model.name in READ_OPERATIONS else 'WriteCapacityUnits'
+        self.add(name, units)
+
+    def document(self, function_name: str) -> dict:
+        # the EMF document of the values recorded so far, None if there are none
+        with self._lock:
+            values, units = self._values, self._units
+            self._values, self._units = {}, {}
+        if not values:
+            return None
+        names = sorted(values)[:MAX_METRICS]
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': name, 'Unit': units[name]} for name in names]
+                }]
+            },
+            'FunctionName': function_name
+        }
+        for name in names:
+            # counters are summed, timings and latencies keep every value for percentiles
+            recorded = values[name]
+            if units[name] == 'Count':
+                document[name] = sum(recorded)
+            else:
+                document[name] = recorded[0] if len(recorded) == 1 else recorded[:MAX_VALUES]
+        return document
+
+    def flush(self):
+        function_name = os.getenv('AWS_LAMBDA_FUNCTION_NAME')
+        document = self.document(function_name)
+        if document and function_name:
+            stream = self.stream or sys.stdout
+            stream.write(json.dumps(document, separators=(',', ':')) + '\n')
+            stream.flush()
+        return document
+
+
+class _Timer:
+    def __init__(self, metrics: Metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add(self.name, round((time.perf_counter() - self.start) * 1000, 3), 'Milliseconds')
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per record, `extra` fields included as they are
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update({name: value for name, value in vars(record).items() if name not in self.RESERVED})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(logger: logging.Logger) -> logging.Logger:
+    # JSON logs at LOG_LEVEL in Lambda, plain ones elsewhere. LOG_SAMPLE_RATE (0 to 1) of
+    # the invocations log at DEBUG, so full events are seen now and then without paying
+    # for every one
+    if os.getenv('AWS_LAMBDA_FUNCTION_NAME'):
+        root = logging.getLogger()
+        if not root.handlers:
+            root.addHandler(logging.StreamHandler())
+        for handler in root.handlers:
+            handler.setFormatter(JsonFormatter())
+    else:
+        logging.basicConfig()
+    _levels[logger.name] = (logging.getLevelName(os.getenv('LOG_LEVEL', 'INFO').upper()),
+                            float(os.getenv('LOG_SAMPLE_RATE', '0')))
+    logger.setLevel(_levels[logger.name][0])
+    return logger
+
+
+def sample(logger: logging.Logger):
+    # the level of one invocation
+    level, rate = _levels.get(logger.name, (logger.level, 0))
+    logger.setLevel(logging.DEBUG if rate and random.random() < rate else level)
+
+
+def instrumented(metrics: Metrics, logger: logging.Logger):
+    # a handler with a sampled log level, its total duration and one EMF line per invocation
+    def decorate(function):
+        @functools.wraps(function)
+        def handler(event, context):
+            sample(logger)
+            try:
+                with metrics.timer('Invocation'):
+                    return function(event, context)
+            finally:
+                metrics.flush()
+        return handler
+    return decorate
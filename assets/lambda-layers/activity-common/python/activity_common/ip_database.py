@@ -0,0 +1,202 @@
+import bisect
+import functools
+import ipaddress
+import json
+import mmap
+import os
+import socket
+import struct
+
+
+# Offline IP enrichment: network (ASN, organization, country) and known-bad lists of an
+# address, from a range table built by tools/ip_database.py. The file is memory-mapped
+# and searched by bisection in place, opening it only reads the header:
+#   header    'IPDB', version (H), metadata size (I), metadata JSON, which may hold the
+#             locations of countries, {country: [latitude, longitude]}
+#   ipv4      first addresses, last addresses (4 bytes big-endian each), record numbers (I)
+#   ipv6      the same with 16 byte addresses
+#   index     for every /16 prefix p of IPv4 and p = 65536, the number of IPv4 ranges
+#             starting before p (I), narrowing the bisection to the ranges of one prefix
+#   records   asn (I), country (2s), list bitmask (I), organization offset (I)
+#   strings   organizations, length (H) prefixed UTF-8
+# Ranges of a table are sorted and disjoint, big-endian addresses compare as bytes.
+MAGIC = b'IPDB'
+VERSION = 1
+HEADER = struct.Struct('>4sHI')
+RECORD = struct.Struct('>I2sII')
+RECORD_NUMBER = struct.Struct('>I')
+STRING_SIZE = struct.Struct('>H')
+WIDTHS = {4: 4, 6: 16}
+PREFIX_BITS = 16
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ip_ranges.db')
+# addresses cached per container, an attack reuses the same few
+CACHE_SIZE = 4096
+
+
+class _Column:
+    # fixed-width big-endian addresses in the map, a sequence for bisect
+    def __init__(self, data, offset: int, width: int, count: int):
+        self.data = data
+        self.offset = offset
+        self.width = width
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int) -> bytes:
+        start = self.offset + index * self.width
+        return self.data[start:start + self.width]
+
+
+class IpDatabase:
+    def __init__(self, path: str = DEFAULT_PATH, cache_size: int = CACHE_SIZE):
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, metadata_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not an IP database of version {VERSION}')
+        self.metadata = json.loads(self._map[HEADER.size:HEADER.size + metadata_size])
+        self.lists = self.metadata['lists']
+        self.locations = self.metadata.get('locations', {})
+
+        offset = HEADER.size + metadata_size
+        self._tables = {}
+        for ip_version, width in WIDTHS.items():
+            count = self.metadata[f'ipv{ip_version}']
+            first = _Column(self._map, offset, width, count)
+            last = _Column(self._map, offset + count * width, width, count)
+            self._tables[ip_version] = (first, last, offset + 2 * count * width)
+            offset += count * (2 * width + RECORD_NUMBER.size)
+        self._index = offset
+        offset += ((1 << PREFIX_BITS) + 1) * RECORD_NUMBER.size
+        self._records = offset
+        self._strings = offset + self.metadata['records'] * RECORD.size
+        # the cached results are shared, callers copy before changing them
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self._lookup)
+
+    def __len__(self):
+        return sum(len(first) for first, _, _ in self._tables.values())
+
+    def _lookup(self, ip: str):
+        # {'asn', 'org', 'country', 'lists'} of the range holding `ip`, empty fields left
+        # out. None for unknown addresses and values that are no address ('AWS Internal')
+        if not isinstance(ip, str):
+            return None
+        ip_version = 6 if ':' in ip else 4
+        try:
+            key = socket.inet_pton(socket.AF_INET6 if ip_version == 6 else socket.AF_INET, ip)
+        except OSError:
+            return None
+        first, last, records = self._tables[ip_version]
+        if ip_version == 4:
+            prefix = (key[0] << 8 | key[1]) * RECORD_NUMBER.size
+            lo, = RECORD_NUMBER.unpack_from(self._map, self._index + prefix)
+            hi, = RECORD_NUMBER.unpack_from(self._map, self._index + prefix + RECORD_NUMBER.size)
+            index = bisect.bisect_right(first, key, lo, hi) - 1
+        else:
+            index = bisect.bisect_right(first, key) - 1
+        if index < 0 or last[index] < key:
+            return None
+        record, = RECORD_NUMBER.unpack_from(self._map, records + index * RECORD_NUMBER.size)
+        return self._record(record)
+
+    def _record(self, record: int) -> dict:
+        asn, country, lists, org_offset = RECORD.unpack_from(self._map, self._records + record * RECORD.size)
+        size, = STRING_SIZE.unpack_from(self._map, self._strings + org_offset)
+        start = self._strings + org_offset + STRING_SIZE.size
+        info = {
+            'asn': asn,
+            'org': self._map[start:start + size].decode('utf-8'),
+            'country': country.decode('ascii').strip(),
+            'lists': [name for bit, name in enumerate(self.lists) if lists >> bit & 1]
+        }
+        return {name: value for name, value in info.items() if value}
+
+    def location(self, country: str):
+        # (latitude, longitude) of a country, None when the database has no locations
+        location = self.locations.get(country)
+        return tuple(location) if location else None
+
+    def close(self):
+        self.lookup.cache_clear()
+        self._map.close()
+
+
+def _network_bounds(network) -> tuple:
+    network = ipaddress.ip_network(network, strict=False)
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+def build(path: str, ranges=(), lists: dict = None, metadata: dict = None) -> dict:
+    # writes the database of `ranges`, (first address, last address, asn, country, org)
+    # of disjoint networks, and of `lists`, {list name: [CIDR, ...]} that may overlap
+    # them and each other. Returns the metadata written
+    lists = lists or {}
+    list_names = sorted(lists)
+    if len(list_names) > 32:
+        raise ValueError('at most 32 lists')
+    events = {4: [], 6: []}
+    for first, last, asn, country, org in ranges:
+        first, last = ipaddress.ip_address(first), ipaddress.ip_address(last)
+        events[first.version].append((int(first), 1, 'network', (asn, country or '', org or '')))
+        events[first.version].append((int(last) + 1, 0, 'network', (asn, country or '', org or '')))
+    for bit, name in enumerate(list_names):
+        for network in lists[name]:
+            ip_version, first, last = _network_bounds(network)
+            events[ip_version].append((first, 1, 'list', bit))
+            events[ip_version].append((last + 1, 0, 'list', bit))
+
+    records = {}
+    strings = {}
+    string_blob = bytearray()
+    tables = {}
+    for ip_version, version_events in events.items():
+        # a sweep over the range bounds splits overlaps into disjoint ranges
+        version_events.sort(key=lambda event: (event[0], event[1]))
+        active_networks = {}
+        active_lists = [0] * len(list_names)
+        table = []
+        for i, (point, starts, kind, value) in enumerate(version_events):
+            if kind == 'network':
+                active_networks[value] = active_networks.get(value, 0) + (1 if starts else -1)
+                if not active_networks[value]:
+                    del active_networks[value]
+            else:
+                active_lists[value] += 1 if starts else -1
+            following = version_events[i + 1][0] if i + 1 < len(version_events) else None
+            if following is None or following == point:
+                continue
+            mask = sum(1 << bit for bit, count in enumerate(active_lists) if count)
+            network = next(reversed(active_networks)) if active_networks else (0, '', '')
+            if not mask and not active_networks:
+                continue
+            asn, country, org = network
+            if org not in strings:
+                strings[org] = len(string_blob)
+                encoded = org.encode('utf-8')[:0xFFFF]
+                string_blob += STRING_SIZE.pack(len(encoded)) + encoded
+            record = records.setdefault((asn, country, mask, strings[org]), len(records))
+            if table and table[-1][1] + 1 == point and table[-1][2] == record:
+                table[-1][1] = following - 1
+            else:
+                table.append([point, following - 1, record])
+        tables[ip_version] = table
+
+    metadata = {**(metadata or {}), 'lists': list_names, 'ipv4': len(tables[4]), 'ipv6': len(tables[6]),
+                'records': len(records)}
+    encoded_metadata = json.dumps(metadata, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(encoded_metadata)))
+        file.write(encoded_metadata)
+        for ip_version, width in WIDTHS.items():
+            for column in (0, 1):
+                file.write(b''.join(entry[column].to_bytes(width, 'big') for entry in tables[ip_version]))
+            file.write(b''.join(RECORD_NUMBER.pack(entry[2]) for entry in tables[ip_version]))
+        firsts = [entry[0] for entry in tables[4]]
+        file.write(b''.join(RECORD_NUMBER.pack(bisect.bisect_left(firsts, prefix << (32 - PREFIX_BITS)))
+                            for prefix in range((1 << PREFIX_BITS) + 1)))
+        for (asn, country, mask, org_offset) in records:
+            file.write(RECORD.pack(asn, country.encode('ascii')[:2].ljust(2), mask, org_offset))
+        file.write(string_blob)
+    return metadata
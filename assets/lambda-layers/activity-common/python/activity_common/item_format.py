@@ -0,0 +1,111 @@
+import base64
+import json
+import zlib
+from datetime import datetime
+
+
+# Compact storage format of sign-in activities (format 2). The fields the pipeline and
+# UserIdentityIndex query are top-level scalars; the whole EventBridge event is kept
+# zlib-compressed in `raw` and only decompressed on read. Items written before have no
+# `format` and carry the event as-is, decode() reads both.
+FORMAT = 2
+# top-level attributes derived by store-sign-in-activity
+KEY_ATTRIBUTES = ('id', 'timestamp', 'ttl', 'userIdentity', 'eventName', 'ipInfo')
+# projected into UserIdentityIndex next to the keys, see database/infra.py
+HOT_ATTRIBUTES = ('eventName', 'identityType', 'userName', 'consoleLogin', 'mfaUsed', 'sourceIPAddress', 'userAgent')
+COMPRESSION_LEVEL = 6
+
+# created by the first from_stream(), importing boto3 is left to the functions that use it
+_deserializer = None
+
+
+def user_identity(detail: dict) -> str:
+    # the logical identity an activity is stored and alerted under, e.g. IAMUser#alice
+    identity = detail['userIdentity']
+    identity_type = identity['type']
+    if identity_type == 'IAMUser':
+        return f'{identity_type}#{identity["userName"]}'
+    if identity_type == 'Root':
+        return f'{identity_type}#Root'
+    if identity_type == 'AssumedRole':
+        return f'{identity_type}#{identity["sessionContext"]["sessionIssuer"]["userName"]}'
+    return f'{identity_type}#Unknown'
+
+
+def event_time(value: str) -> int:
+    # EventBridge sends `time` as UTC ISO-8601 (2022-04-20T10:00:00Z), which the stdlib
+    # parses once the `Z` suffix is spelled out. Raises ValueError on anything else
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+
+
+def from_event(event: dict, timestamp: int = None) -> dict:
+    # the EventBridge event plus the key attributes derived from it alone, without the
+    # `ttl` and `ipInfo` of the stored activity
+    detail = event['detail']
+    return {**event, 'eventName': detail['eventName'], 'userIdentity': user_identity(detail),
+            'timestamp': event_time(event['time']) if timestamp is None else timestamp}
+
+
+def hot_fields(event: dict) -> dict:
+    detail = event['detail']
+    identity = detail.get('userIdentity') or {}
+    fields = {
+        'identityType': identity.get('type'),
+        'userName': identity.get('userName') or ((identity.get('sessionContext') or {}).get('sessionIssuer') or {}).get('userName'),
+        'consoleLogin': (detail.get('responseElements') or {}).get('ConsoleLogin'),
+        'mfaUsed': (detail.get('additionalEventData') or {}).get('MFAUsed'),
+        'sourceIPAddress': detail.get('sourceIPAddress'),
+        'userAgent': detail.get('userAgent')
+    }
+    return {name: value for name, value in fields.items() if value is not None}
+
+
+def encode(event: dict) -> dict:
+    # `event` is an activity as built by store-sign-in-activity: the EventBridge event
+    # plus the derived key attributes
+    raw = {name: value for name, value in event.items() if name not in KEY_ATTRIBUTES or name == 'id'}
+    item = {name: event[name] for name in KEY_ATTRIBUTES if name in event}
+    item.update(hot_fields(event))
+    item['format'] = FORMAT
+    item['raw'] = zlib.compress(json.dumps(raw, separators=(',', ':'), default=str).encode('utf-8'), COMPRESSION_LEVEL)
+    return item
+
+
+def decode(item: dict) -> dict:
+    # the activity as built by store-sign-in-activity, whichever format it was stored in
+    if 'raw' in item:
+        raw = item['raw']
+        raw = raw.value if hasattr(raw, 'value') else raw
+        event = json.loads(zlib.decompress(bytes(raw)))
+        event.update({name: item[name] for name in KEY_ATTRIBUTES if name in item})
+    else:
+        event = dict(item)
+    for name in ('timestamp', 'ttl'):
+        if name in event:
+            event[name] = int(event[name])
+    return event
+
+
+def is_compact(item: dict) -> bool:
+    return 'raw' in item
+
+
+def from_stream(image: dict) -> dict:
+    # an item of a table stream record, which comes as DynamoDB JSON with base64 binaries
+    global _deserializer
+    if _deserializer is None:
+        from boto3.dynamodb.types import TypeDeserializer
+        _deserializer = TypeDeserializer()
+    return {name: _deserializer.deserialize(_binaries(value)) for name, value in image.items()}
+
+
+def _binaries(value: dict) -> dict:
+    if 'B' in value:
+        return {'B': base64.b64decode(value['B'])}
+    if 'BS' in value:
+        return {'BS': [base64.b64decode(member) for member in value['BS']]}
+    if 'M' in value:
+        return {'M': {name: _binaries(member) for name, member in value['M'].items()}}
+    if 'L' in value:
+        return {'L': [_binaries(member) for member in value['L']]}
+    return value
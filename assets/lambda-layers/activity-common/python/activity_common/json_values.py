@@ -0,0 +1,16 @@
+import base64
+from decimal import Decimal
+
+
+# apart from reporting.py, the handlers that only need plain() don't import the scan code
+def plain(value):
+    # Decimal and Binary as returned by boto3, made JSON serializable
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {name: plain(v) for name, v in value.items()}
+    if isinstance(value, (list, set, tuple)):
+        return [plain(v) for v in value]
+    if hasattr(value, 'value') and isinstance(value.value, bytes):
+        return base64.b64encode(value.value).decode('ascii')
+    return value
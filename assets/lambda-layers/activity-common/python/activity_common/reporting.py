@@ -0,0 +1,174 @@
+import base64
+import heapq
+import json
+import queue
+import threading
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from activity_common import item_format, sharding
+from activity_common.json_values import plain
+
+
+# Reading the activity table for reports: a parallel segmented Scan for exports, and the
+# history of one user through UserIdentityIndex, paginated with opaque cursors. Both
+# report the logical userIdentity of sharded users, see sharding.py
+INDEX_NAME = 'UserIdentityIndex'
+# what an export reads by default: the keys and the hot scalars, not the compressed event
+EXPORT_ATTRIBUTES = ('id', 'timestamp', 'userIdentity') + item_format.HOT_ATTRIBUTES
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+# pages buffered between the scanning workers and the writer
+QUEUE_PAGES = 16
+
+
+def projection(attributes) -> dict:
+    # every name through a placeholder, `timestamp` and `ttl` are reserved words
+    names = {f'#a{i}': name for i, name in enumerate(attributes)}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+
+def scan_segment(table, segment: int, total_segments: int, attributes=EXPORT_ATTRIBUTES, page_size: int = None):
+    # yields the pages of activities of one segment. Counter and alert items have no eventName
+    kwargs = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'FilterExpression': Attr('eventName').exists()
+    }
+    if attributes:
+        kwargs.update(projection(attributes))
+    if page_size:
+        kwargs['Limit'] = page_size
+    while True:
+        response = table.scan(**kwargs)
+        items = [plain(item) for item in response['Items']]
+        for item in items:
+            if 'userIdentity' in item:
+                item['userIdentity'] = sharding.logical(item['userIdentity'])
+        yield items
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def parallel_scan(tables: list, attributes=EXPORT_ATTRIBUTES, page_size: int = None):
+    # yields pages from one concurrent worker per segment as they arrive. Only a bounded
+    # number of pages is held in memory, workers block while the consumer is behind.
+    # `tables` holds one Table per segment, boto3 resources are not thread safe
+    total_segments = len(tables)
+    pages = queue.Queue(maxsize=QUEUE_PAGES)
+    done = object()
+    stop = threading.Event()
+
+    def worker(segment):
+        try:
+            for page in scan_segment(tables[segment], segment, total_segments, attributes, page_size):
+                if stop.is_set():
+                    return
+                pages.put(page)
+        except Exception as error:
+            pages.put(error)
+        finally:
+            pages.put(done)
+
+    threads = [threading.Thread(target=worker, args=(segment,), daemon=True) for segment in range(total_segments)]
+    for thread in threads:
+        thread.start()
+    try:
+        running = total_segments
+        while running:
+            page = pages.get()
+            if page is done:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        stop.set()
+        # unblock workers waiting on a full queue
+        while any(thread.is_alive() for thread in threads):
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def encode_cursor(cursor: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(plain(cursor), separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str, user_identity: str) -> dict:
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    # a cursor only continues the history it was issued for
+    if (not isinstance(decoded, dict) or decoded.get('userIdentity') != user_identity
+            or not isinstance(decoded.get('shards'), int) or not isinstance(decoded.get('after'), dict)):
+        raise ValueError('Invalid cursor')
+    return decoded
+
+
+def index_key(item: dict) -> dict:
+    return {name: item[name] for name in ('userIdentity', 'timestamp', 'id')}
+
+
+def history(table, user_identity: str, since: int = None, until: int = None, limit: int = DEFAULT_PAGE_SIZE,
+            cursor: str = None, newest_first: bool = True) -> dict:
+    # one page of the activities of a user, {'items': [...], 'cursor': <next page> or None}.
+    # Every shard of the user is queried concurrently for a page and the pages are merged
+    # in timestamp order. The cursor keeps the position in each shard that is not
+    # exhausted, and the shard count of the first page
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    if cursor:
+        decoded = decode_cursor(cursor, user_identity)
+        shards, after = decoded['shards'], decoded['after']
+    else:
+        shards = sharding.ShardMap(table).shards_of(user_identity)
+        after = {key: None for key in sharding.shard_keys(user_identity, shards)}
+
+    def query(key):
+        condition = Key('userIdentity').eq(key)
+        if since is not None and until is not None:
+            condition &= Key('timestamp').between(since, until)
+        elif since is not None:
+            condition &= Key('timestamp').gte(since)
+        elif until is not None:
+            condition &= Key('timestamp').lte(until)
+        kwargs = {
+            'TableName': table.name,
+            'IndexName': INDEX_NAME,
+            'KeyConditionExpression': condition,
+            'ScanIndexForward': not newest_first,
+            'Limit': limit
+        }
+        if after[key]:
+            kwargs['ExclusiveStartKey'] = after[key]
+        response = table.meta.client.query(**kwargs)
+        return response['Items'], response.get('LastEvaluatedKey')
+
+    keys = [key for key in sharding.shard_keys(user_identity, shards) if key in after]
+    pages = dict(zip(keys, sharding.fan_out(query, keys)))
+    merged = heapq.merge(*([(key, item) for item in items] for key, (items, _) in pages.items()),
+                         key=lambda entry: entry[1]['timestamp'], reverse=newest_first)
+    page = [entry for _, entry in zip(range(limit), merged)]
+
+    consumed = {key: 0 for key in keys}
+    for key, _ in page:
+        consumed[key] += 1
+    next_after = {}
+    for key, (items, last_evaluated_key) in pages.items():
+        if consumed[key] < len(items):
+            # the merge stopped inside this page, continue after its last returned item
+            next_after[key] = index_key(items[consumed[key] - 1]) if consumed[key] else after[key]
+        elif last_evaluated_key:
+            next_after[key] = last_evaluated_key
+    items = [plain(item) for _, item in page]
+    for item in items:
+        item['userIdentity'] = user_identity
+    return {
+        'items': items,
+        'cursor': encode_cursor({'userIdentity': user_identity, 'shards': shards, 'after': next_after}) if next_after else None
+    }
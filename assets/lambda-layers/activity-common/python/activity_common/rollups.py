@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+from activity_common import sharding
+from activity_common.json_values import plain
+from activity_common.reporting import projection
+
+
+# Per-user daily rollups of sign-in activities, maintained from the activity table stream
+# by rollup-activity. One item of the activity table per logical user and UTC day:
+#   id = 'Rollup#<userIdentity>', timestamp = <start of the day>,
+#   signIns, failures, noMfa = counters, ips = string set of the source addresses,
+#   'sequence:<shard id>' = last stream sequence number applied from that shard
+# so a report over N days is one Query of N small items instead of every activity of the
+# user. Stream records are aggregated per (user, day) over a tumbling window and each
+# rollup gets one UpdateItem, conditional on the sequence range of the window not having
+# been applied from that shard yet: a retried or replayed window adds nothing twice.
+# Sequence numbers only grow within a shard and are compared as zero-padded strings.
+PREFIX = 'Rollup#'
+DAY = 24 * 60 * 60
+COUNTERS = ('signIns', 'failures', 'noMfa')
+SEQUENCE_DIGITS = 40
+DEFAULT_TTL_DAYS = 400
+# concurrent UpdateItem calls of a flush
+MAX_WORKERS = 16
+
+
+def day_start(timestamp: int) -> int:
+    return int(timestamp) - int(timestamp) % DAY
+
+
+def rollup_id(user_identity: str) -> str:
+    return PREFIX + sharding.logical(user_identity)
+
+
+def sequence(number: str) -> str:
+    return number.zfill(SEQUENCE_DIGITS)
+
+
+def counts(activity: dict) -> dict:
+    # the counters of one activity, from the hot attributes of item_format
+    if activity.get('eventName') != 'ConsoleLogin':
+        return {}
+    if activity.get('consoleLogin') == 'Failure':
+        return {'failures': 1}
+    if activity.get('consoleLogin') == 'Success':
+        return {'signIns': 1, 'noMfa': int(activity.get('mfaUsed') == 'No')}
+    return {}
+
+
+def empty_window() -> dict:
+    # tumbling window state, JSON as Lambda passes it between invocations:
+    # {'rollups': {'<day>|<userIdentity>': {counter: n, 'ips': [...]}}, 'first': seq, 'last': seq}
+    return {'rollups': {}, 'first': None, 'last': None}
+
+
+def add(window: dict, activity: dict, sign: int = 1, sequence_number: str = None):
+    # counts an inserted (sign 1) or removed (sign -1) activity into the window. The
+    # address of a removed activity stays: it was seen, and a retry stores it again
+    key = f'{day_start(activity["timestamp"])}|{sharding.logical(activity["userIdentity"])}'
+    rollup = window['rollups'].setdefault(key, {})
+    for counter, value in counts(activity).items():
+        rollup[counter] = rollup.get(counter, 0) + sign * value
+    address = activity.get('sourceIPAddress')
+    if sign > 0 and address and address not in rollup.setdefault('ips', []):
+        rollup['ips'].append(address)
+    if sequence_number:
+        padded = sequence(sequence_number)
+        window['first'] = min(window['first'] or padded, padded)
+        window['last'] = max(window['last'] or padded, padded)
+
+
+def update(table_name: str, shard_id: str, first: str, last: str, key: str, rollup: dict, ttl_days: int) -> dict:
+    # the UpdateItem request of one rollup
+    day, user_identity = key.split('|', 1)
+    names = {'#sequence': f'sequence:{shard_id}', '#ttl': 'ttl'}
+    values = {':first': first, ':last': last, ':ttl': int(day) + ttl_days * DAY}
+    assignments, additions = ['#sequence = :last', '#ttl = :ttl'], []
+    for counter in COUNTERS:
+        if rollup.get(counter):
+            additions.append(f'{counter} :{counter}')
+            values[f':{counter}'] = rollup[counter]
+    if rollup.get('ips'):
+        additions.append('ips :ips')
+        values[':ips'] = set(rollup['ips'])
+    if rollup.get('ipsTruncated'):
+        names['#truncated'] = 'ipsTruncated'
+        values[':truncated'] = True
+        assignments.append('#truncated = :truncated')
+    return {
+        'TableName': table_name,
+        'Key': {'id': rollup_id(user_identity), 'timestamp': int(day)},
+        'UpdateExpression': 'SET ' + ', '.join(assignments) + (' ADD ' + ', '.join(additions) if additions else ''),
+        'ConditionExpression': 'attribute_not_exists(#sequence) OR #sequence < :first',
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values
+    }
+
+
+def flush(table, shard_id: str, window: dict, ttl_days: int = DEFAULT_TTL_DAYS) -> tuple:
+    # applies the rollups of a window read from one shard, returns (applied, replayed).
+    # Rollups the window does not change are not written
+    changed = [(key, rollup) for key, rollup in sorted(window['rollups'].items())
+               if rollup.get('ips') or any(rollup.get(counter) for counter in COUNTERS)]
+    if not changed:
+        return 0, 0
+    client = table.meta.client
+
+    def apply(entry):
+        key, rollup = entry
+        try:
+            client.update_item(**update(table.name, shard_id, window['first'], window['last'], key, rollup, ttl_days))
+            return True
+        except ClientError as error:
+            code = error.response['Error']['Code']
+            if code == 'ConditionalCheckFailedException':
+                return False
+            if code == 'ValidationException' and rollup.get('ips'):
+                # the addresses of a user under a distributed attack outgrow the item,
+                # the counters go on without them
+                return apply((key, {**rollup, 'ips': [], 'ipsTruncated': True}))
+            raise
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(changed))) as executor:
+        results = list(executor.map(apply, changed))
+    return results.count(True), results.count(False)
+
+
+def size(window: dict) -> int:
+    # rollups and addresses held by a window, bounds the state Lambda passes along
+    return sum(1 + len(rollup.get('ips', ())) for rollup in window['rollups'].values())
+
+
+def daily(rollup: dict) -> dict:
+    # a rollup item or window entry as reported
+    report = {counter: int(rollup.get(counter, 0)) for counter in COUNTERS}
+    report['ips'] = sorted(rollup.get('ips') or [])
+    if rollup.get('ipsTruncated'):
+        report['ipsTruncated'] = True
+    return report
+
+
+def summarize(activities) -> dict:
+    # {day start: daily report} computed from the activities themselves
+    window = empty_window()
+    for activity in activities:
+        add(window, activity)
+    return {int(key.split('|', 1)[0]): daily(rollup) for key, rollup in window['rollups'].items()}
+
+
+def query(table, user_identity: str, since: int, until: int) -> dict:
+    # {day start: daily report} of the days in range with activities
+    condition = Key('id').eq(rollup_id(user_identity)) & Key('timestamp').between(day_start(since), day_start(until))
+    # not the sequence numbers of every shard
+    kwargs = {'KeyConditionExpression': condition, **projection(('timestamp',) + COUNTERS + ('ips', 'ipsTruncated'))}
+    reports = {}
+    while True:
+        response = table.query(**kwargs)
+        for item in response['Items']:
+            reports[int(item['timestamp'])] = daily(plain(item))
+        if 'LastEvaluatedKey' not in response:
+            return reports
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def date(day: int) -> str:
+    return datetime.fromtimestamp(day, timezone.utc).strftime('%Y-%m-%d')
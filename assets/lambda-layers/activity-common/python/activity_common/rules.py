@@ -0,0 +1,229 @@
+import json
+import operator
+import os
+
+
+# Alert rules as data (rules.json next to this module). Rules are evaluated in order and
+# the first matching one decides the alert. A rule matches when all its `conditions` hold
+# and, if it has one, its `threshold` on a metric computed for the event (e.g.
+# failedAttempts, by count-failed-sign-in-attempt). When the threshold is not reached the
+# next rules are evaluated. The same file is compiled into the Choice chain of the
+# sign-in state machine, see login/rules.py.
+#
+# Stateless rules (is_stateless) read nothing but the EventBridge event, so the state
+# machine decides them while the activity is being stored and alerts at once. The other
+# rules are decided on the stored activity; a matching stateless rule still ends their
+# evaluation, see Evaluator.alerts().
+#
+# A rule may list in `requires` what the deployment must provide for it to ever match.
+# load() leaves out the rules whose requirements are not provided(), so neither the state
+# machine nor the evaluator spends a state or a lookup on a rule that cannot fire.
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json')
+OPERATORS = {
+    'equals': operator.eq,
+    'notEquals': operator.ne,
+    'greaterThan': operator.gt,
+    'greaterThanEquals': operator.ge,
+    'lessThan': operator.lt,
+    'lessThanEquals': operator.le
+}
+# rules are indexed by the values they require for these fields
+INDEX_PATHS = ('$.eventName', '$.detail.userIdentity.type')
+# fields of the event as EventBridge delivers it, `eventName` is detail.eventName
+EVENT_PATH_PREFIX = '$.detail.'
+EVENT_PATHS = ('$.eventName',)
+RULE_ATTRIBUTES = ('reason', 'title', 'severity', 'channel', 'targets', 'conditions')
+# locations: the IP database locates countries (tools/ip_database.py --cities)
+REQUIREMENTS = ('locations',)
+_MISSING = object()
+
+
+def load(path: str = RULES_FILE, provides: set = None) -> list:
+    # the rules whose requirements are in `provides`, by default what this deployment provides
+    with open(path) as f:
+        rules = json.load(f)['rules']
+    for rule in rules:
+        missing = [name for name in RULE_ATTRIBUTES if name not in rule]
+        if missing:
+            raise ValueError(f'Rule {rule.get("reason")} misses {", ".join(missing)}')
+        unknown = [name for name in rule.get('requires', ()) if name not in REQUIREMENTS]
+        if unknown:
+            raise ValueError(f'Rule {rule["reason"]} requires unknown {", ".join(unknown)}')
+        for condition in rule['conditions'] + ([rule['threshold']] if 'threshold' in rule else []):
+            operator_of(condition)
+    if provides is None:
+        provides = provided()
+    return [rule for rule in rules if set(rule.get('requires', ())) <= provides]
+
+
+def provided(ip_database_path: str = None) -> set:
+    # the REQUIREMENTS met by the IP database the functions read, that of the common layer
+    # unless IP_DATABASE_PATH is set
+    from activity_common import ip_database
+    try:
+        database = ip_database.IpDatabase(ip_database_path or os.getenv('IP_DATABASE_PATH', ip_database.DEFAULT_PATH))
+    except (OSError, ValueError):
+        return set()
+    try:
+        return {'locations'} if database.locations else set()
+    finally:
+        database.close()
+
+
+def operator_of(condition: dict):
+    # (name, expected value) of the only operator of a condition
+    operators = [name for name in condition if name in OPERATORS]
+    if len(operators) != 1:
+        raise ValueError(f'Condition {condition} must have exactly one of {", ".join(OPERATORS)}')
+    return operators[0], condition[operators[0]]
+
+
+def is_stateless(rule: dict) -> bool:
+    # no metric to compute and no field derived by store-sign-in-activity
+    return 'threshold' not in rule and all(
+        condition['path'] in EVENT_PATHS or condition['path'].startswith(EVENT_PATH_PREFIX) for condition in rule['conditions'])
+
+
+def getter(path: str):
+    # returns a function reading `path` ($.a.b) from an event, or _MISSING
+    keys = path[2:].split('.')
+
+    def get(event):
+        value = event
+        for key in keys:
+            if not isinstance(value, dict):
+                return _MISSING
+            value = value.get(key, _MISSING)
+            if value is _MISSING:
+                return _MISSING
+        return value
+    return get
+
+
+def predicate(path: str, condition: dict):
+    # a missing field never equals and always differs, numeric comparisons need a number
+    name, expected = operator_of(condition)
+    compare = OPERATORS[name]
+    get = getter(path)
+    if name == 'equals':
+        return lambda event: get(event) == expected
+    if name == 'notEquals':
+        return lambda event: get(event) != expected
+    return lambda event: _is_number(value := get(event)) and compare(value, expected)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _CompiledRule:
+    def __init__(self, rule: dict):
+        self.rule = rule
+        self.index = {}
+        self.predicates = []
+        for condition in rule['conditions']:
+            name, expected = operator_of(condition)
+            if name == 'equals' and condition['path'] in INDEX_PATHS:
+                self.index[condition['path']] = expected
+            else:
+                self.predicates.append(predicate(condition['path'], condition))
+        threshold = rule.get('threshold')
+        self.metric = threshold['metric'] if threshold else None
+        self.threshold = predicate(f'$.{self.metric}', threshold) if threshold else None
+        self.stateless = is_stateless(rule)
+
+    def applies_to(self, key: tuple) -> bool:
+        return all(self.index.get(path, value) == value for path, value in zip(INDEX_PATHS, key))
+
+    def matches(self, event: dict) -> bool:
+        for matches in self.predicates:
+            if not matches(event):
+                return False
+        return True
+
+
+class Evaluator:
+    # In-process evaluator of the rules. The rules that can apply to an event are looked
+    # up by its eventName and identity type, so classifying does not walk every rule.
+
+    def __init__(self, rules: list):
+        self.rules = rules
+        self._compiled = [_CompiledRule(rule) for rule in rules]
+        self._index_getters = [getter(path) for path in INDEX_PATHS]
+        self._candidates = {}
+
+    def candidates(self, event: dict) -> tuple:
+        key = tuple(get(event) for get in self._index_getters)
+        candidates = self._candidates.get(key)
+        if candidates is None:
+            candidates = self._candidates[key] = tuple(rule for rule in self._compiled if rule.applies_to(key))
+        return candidates
+
+    def evaluate(self, event: dict):
+        # the matching rule, or None. Metrics of threshold rules whose conditions hold must
+        # be in the event, see needs()
+        for compiled in self.candidates(event):
+            if not compiled.matches(event):
+                continue
+            if compiled.threshold is None:
+                return compiled.rule
+            if compiled.metric not in event:
+                raise KeyError(f'{compiled.rule["reason"]} needs {compiled.metric}')
+            if compiled.threshold(event):
+                return compiled.rule
+        return None
+
+    def classify(self, event: dict):
+        rule = self.evaluate(event)
+        return rule['reason'] if rule else None
+
+    def alerts(self, event: dict) -> list:
+        # the reasons alerted on when stateless rules are decided apart, as the parallel
+        # state machine does: the first matching stateless rule, and the first matching
+        # rule when it is not stateless. A stateful rule listed before a matching
+        # stateless one alerts as well
+        reasons = []
+        for compiled in self.candidates(event):
+            if compiled.stateless and compiled.matches(event):
+                reasons.append(compiled.rule['reason'])
+                break
+        rule = self.evaluate(event)
+        if rule and not is_stateless(rule):
+            reasons.append(rule['reason'])
+        return reasons
+
+    def needs(self, event: dict) -> set:
+        # the metrics evaluate() needs for this event
+        metrics = set()
+        for compiled in self.candidates(event):
+            if compiled.matches(event):
+                if compiled.threshold is None:
+                    break
+                metrics.add(compiled.metric)
+        return metrics
+
+    def paths(self) -> set:
+        # every field the rules read, conditions and threshold metrics
+        paths = set(INDEX_PATHS)
+        for rule in self.rules:
+            paths.update(condition['path'] for condition in rule['conditions'])
+            if 'threshold' in rule:
+                paths.add(f'$.{rule["threshold"]["metric"]}')
+        return paths
+
+    def rule(self, reason: str) -> dict:
+        for rule in self.rules:
+            if rule['reason'] == reason:
+                return rule
+        raise KeyError(reason)
+
+
+_default = None
+
+
+def default() -> Evaluator:
+    # the evaluator of the deployed rules, built once per container
+    global _default
+    if _default is None:
+        _default = Evaluator(load())
+    return _default
@@ -0,0 +1,98 @@
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Write sharding of hot users. Every activity of a user goes to one UserIdentityIndex
+# partition and every failure to one counter key, so a credential-stuffing attack on one
+# user throttles the index. A user whose failures cross the threshold is spread over
+# `shards` keys: the plain userIdentity (shard 0, which also holds everything written
+# before) and '<userIdentity>#<n>' for n in 1..shards-1. The shard of an activity
+# follows from its id, so a retried write lands on the same key. Readers fan out over
+# every shard of the user. The shard map is one item of the activity table:
+#   id = 'ShardMap', timestamp = 0, <userIdentity> = shards
+MAP_KEY = {'id': 'ShardMap', 'timestamp': 0}
+SEPARATOR = '#'
+# 1 turns promotion off, users already in the map stay sharded
+DEFAULT_SHARDS = 1
+# failed sign-ins per minute of one user
+DEFAULT_THRESHOLD = 600
+CACHE_SECONDS = 60
+
+
+def shard_keys(user_identity: str, shards: int) -> list:
+    return [user_identity] + [f'{user_identity}{SEPARATOR}{shard}' for shard in range(1, shards)]
+
+
+def shard_of(activity_id: str, shards: int) -> int:
+    return zlib.crc32(activity_id.encode('utf-8')) % shards if shards > 1 else 0
+
+
+def shard_key(user_identity: str, activity_id: str, shards: int) -> str:
+    return shard_keys(user_identity, shards)[shard_of(activity_id, shards)]
+
+
+def logical(user_identity: str) -> str:
+    # '<type>#<name>#<shard>' -> '<type>#<name>'. IAM names cannot contain '#'
+    head, _, shard = user_identity.rpartition(SEPARATOR)
+    return head if head.count(SEPARATOR) == 1 and shard.isdigit() else user_identity
+
+
+def fan_out(function, keys: list) -> list:
+    # `function` called for every shard key concurrently, results in the order of `keys`.
+    # Low-level clients are thread safe, resources are not: `function` should go through
+    # table.meta.client
+    if len(keys) == 1:
+        return [function(keys[0])]
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        return list(executor.map(function, keys))
+
+
+class ShardMap:
+    # The shard counts of the hot users, read from the table at most every `cache_seconds`.
+    # A container promoted elsewhere keeps reading the old count until its cache expires,
+    # at worst undercounting failures of a user that is already far over the threshold
+
+    def __init__(self, table, shards: int = DEFAULT_SHARDS, threshold: int = DEFAULT_THRESHOLD,
+                 cache_seconds: float = CACHE_SECONDS):
+        self.table = table
+        self.shards = shards
+        self.threshold = threshold
+        self.cache_seconds = cache_seconds
+        self._users = None
+        self._loaded_at = 0
+
+    def users(self) -> dict:
+        now = time.monotonic()
+        if self._users is None or now - self._loaded_at >= self.cache_seconds:
+            item = self.table.get_item(Key=MAP_KEY).get('Item') or {}
+            self._users = {name: int(value) for name, value in item.items() if name not in MAP_KEY}
+            self._loaded_at = now
+        return self._users
+
+    def shards_of(self, user_identity: str) -> int:
+        return self.users().get(user_identity, 1)
+
+    def key_of(self, user_identity: str, activity_id: str) -> str:
+        return shard_key(user_identity, activity_id, self.shards_of(user_identity))
+
+    def observe(self, user_identity: str, per_minute: int) -> bool:
+        # promotes a user writing `per_minute` failures over the threshold, True if it was
+        if self.shards <= 1 or per_minute < self.threshold or self.shards_of(user_identity) >= self.shards:
+            return False
+        client = self.table.meta.client
+        try:
+            # the count only grows, readers must keep covering shards written before
+            self.table.update_item(
+                Key=MAP_KEY,
+                UpdateExpression='SET #user = :shards',
+                ConditionExpression='attribute_not_exists(#user) OR #user < :shards',
+                ExpressionAttributeNames={'#user': user_identity},
+                ExpressionAttributeValues={':shards': self.shards}
+            )
+        except client.exceptions.ConditionalCheckFailedException:
+            # promoted by another container meanwhile
+            self._users = None
+            return False
+        self._users[user_identity] = self.shards
+        return True
@@ -0,0 +1,133 @@
+"""Activity export: items/second of the segmented Scan per number of segments.
+
+    python -m benchmarks.activity_export [--items 20000] [--segments 1 2 4 8 16] [--page-size 100] [--rtt-ms 20] [--moto]
+
+DynamoDB serves the segments of a Scan from its partitions in parallel; what a client
+waits for is a round trip per page. By default the Scan is answered in process by a
+simulated table (botocore's before-call event) that sleeps --rtt-ms per page, so
+everything on the client side is real: request building, deserialization,
+reporting.parallel_scan and the NDJSON writer. Speedup is relative to the first
+segment count. With --moto the table lives in a moto server in its own process
+instead; moto walks the whole table for every page on one CPU and serves one request
+at a time, so the server is the ceiling there, not the number of segments.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import time
+import zlib
+
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+from botocore.awsrequest import AWSResponse
+
+from tools import report
+from tools.events import generate
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.local_aws import create_activity_table, start_moto_server
+
+add_layers_to_path()
+from activity_common import item_format  # noqa: E402
+
+
+def workload(count):
+    build_item = load_handler('store-sign-in-activity').build_item
+    now = int(time.time())
+    return [item_format.encode(build_item(event)) for event in generate(count, now - 86400, duration=86400, users=200, seed=1)]
+
+
+def seed(table, items):
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+
+
+class SimulatedTable:
+    # answers Scan with the items of a segment in wire format, one round trip per page
+    def __init__(self, items, rtt_seconds):
+        serialize = TypeSerializer().serialize
+        self.items = [{name: serialize(value) for name, value in item.items()} for item in items]
+        self.rtt_seconds = rtt_seconds
+        self.segments = {}
+
+    def segment(self, segment, total_segments):
+        if total_segments not in self.segments:
+            segments = [[] for _ in range(total_segments)]
+            for item in self.items:
+                segments[zlib.crc32(item['id']['S'].encode()) % total_segments].append(item)
+            self.segments[total_segments] = segments
+        return self.segments[total_segments][segment]
+
+    def scan(self, params, **kwargs):
+        request = json.loads(params['body'])
+        items = self.segment(request.get('Segment', 0), request.get('TotalSegments', 1))
+        start = 0
+        if 'ExclusiveStartKey' in request:
+            start = next(i for i, item in enumerate(items) if item['id'] == request['ExclusiveStartKey']['id']) + 1
+        page = items[start:start + request.get('Limit', len(items))]
+        names = list(request.get('ExpressionAttributeNames', {}).values())
+        response = {
+            'Items': [{name: value for name, value in item.items() if not names or name in names}
+                      for item in page if 'eventName' in item],
+            'Count': len(page),
+            'ScannedCount': len(page)
+        }
+        if start + len(page) < len(items):
+            response['LastEvaluatedKey'] = {'id': page[-1]['id'], 'timestamp': page[-1]['timestamp']}
+        time.sleep(self.rtt_seconds)
+        return AWSResponse('', 200, {}, None), response
+
+
+def segment_tables(segments, rtt_seconds, simulated=None):
+    tables = report.segment_tables('bench-export', segments)
+    for table in tables:
+        if simulated:
+            table.meta.client.meta.events.register('before-call.dynamodb.Scan', simulated.scan)
+        elif rtt_seconds:
+            def wait(**kwargs):
+                time.sleep(rtt_seconds)
+            table.meta.client.meta.events.register('before-send.dynamodb.Scan', wait)
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--rtt-ms', type=float, default=20)
+    parser.add_argument('--moto', action='store_true', help='scan a moto server instead of the simulated table')
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    logging.disable(logging.WARNING)
+    items = workload(args.items)
+    server, simulated = None, None
+    if args.moto:
+        server, url = start_moto_server()
+        os.environ['AWS_ENDPOINT_URL'] = url
+        seed(create_activity_table(boto3.resource('dynamodb'), table_name='bench-export'), items)
+    else:
+        simulated = SimulatedTable(items, args.rtt_ms / 1000)
+    try:
+        print(f'{len(items)} items, pages of {args.page_size}, {args.rtt_ms:.0f} ms per page' + (' on moto' if args.moto else ''))
+        print(f'{"segments":>8} {"items":>7} {"seconds":>8} {"items/s":>9} {"speedup":>8}')
+        baseline = None
+        for segments in args.segments:
+            tables = segment_tables(segments, args.rtt_ms / 1000, simulated)
+            start = time.perf_counter()
+            exported = report.export(tables, io.StringIO(), page_size=args.page_size)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f'{segments:>8} {exported:>7} {elapsed:>8.2f} {exported / elapsed:>9.0f} {baseline / elapsed:>7.1f}x')
+    finally:
+        if server:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    main()
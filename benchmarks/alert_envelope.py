@@ -0,0 +1,116 @@
+"""Alert envelope: payload size and per-message latency, whole event vs slim envelope.
+
+    python -m benchmarks.alert_envelope [--alerts 2000] [--large-share 0.02] [--large-kb 300] [--repeat 3]
+
+A synthetic corpus of alerting sign-ins (failed, without MFA, root) as built by
+store-sign-in-activity, with a failure count, a baseline profile and IP enrichment.
+--large-share of them carry --large-kb of request parameters, as CloudTrail events with
+long session policies do. Size: the JSON the state passes between its states and
+publishes to SNS; Step Functions and SNS both reject payloads over 256 KB. Latency: per
+message, the SNS publish to moto and the notifier rendering it from the SNS record, and
+for the envelope also with the stored activity read back (when a field to render is
+missing).
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import time
+
+import boto3
+from moto import mock_aws
+
+from tools.events import event_of_kind
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.local_aws import create_activity_table
+
+add_layers_to_path()
+from activity_common import alerting, envelope, item_format  # noqa: E402
+
+KINDS = {'iam_failure': 'ManyFailedSignInAttempt', 'iam_no_mfa': 'NoMFAUsed', 'root': 'RootActivity'}
+LIMIT_BYTES = 256 * 1024
+
+
+def corpus(count: int, large_share: float, large_kb: int, seed: int = 5) -> list:
+    # (activity, reason)
+    rng = random.Random(seed)
+    build_item = load_handler('store-sign-in-activity').build_item
+    now = int(time.time())
+    alerts = []
+    for i in range(count):
+        kind = rng.choice(list(KINDS))
+        activity = build_item(event_of_kind(kind, now - i, user_name=f'user-{i % 50}', source_ip=f'203.0.113.{i % 250}'))
+        activity['failedAttempts'] = rng.randrange(3, 50)
+        activity['profile'] = {'newSourceIp': False, 'newUserAgent': False, 'distinctIps': rng.randrange(1, 20),
+                               'impossibleTravel': False}
+        activity['ipInfo'] = {'asn': 64500, 'org': 'Example Networks', 'country': 'NL'}
+        if rng.random() < large_share:
+            activity['detail']['requestParameters'] = {'policy': 'x' * (large_kb * 1024)}
+        alerts.append((activity, KINDS[kind]))
+    return alerts
+
+
+def percentile(values: list, share: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--alerts', type=int, default=2000)
+    parser.add_argument('--large-share', type=float, default=0.02)
+    parser.add_argument('--large-kb', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    alerts = corpus(args.alerts, args.large_share, args.large_kb)
+    rows = []
+    with mock_aws():
+        table = create_activity_table(boto3.resource('dynamodb'))
+        os.environ['DYNAMODB_TABLE_NAME'] = table.name
+        with table.batch_writer() as batch:
+            for activity, _ in alerts:
+                batch.put_item(Item=item_format.encode(activity))
+        sns = boto3.client('sns')
+        topic_arn = sns.create_topic(Name='aws-activity-notification')['TopicArn']
+        notifier = load_handler('slack-notification')
+
+        variants = [
+            ('whole event', lambda activity: activity, False),
+            ('envelope', envelope.slim, False),
+            ('envelope, read back', envelope.slim, True)
+        ]
+        for name, project, expand in variants:
+            sizes, samples, rejected = [], [], 0
+            for activity, reason in alerts:
+                message = project(activity)
+                body = json.dumps(message, default=str)
+                sizes.append(len(body.encode('utf-8')))
+                if sizes[-1] > LIMIT_BYTES:
+                    rejected += 1
+                    continue
+                record = {'Sns': {'MessageId': activity['id'], 'Message': body, 'MessageAttributes': {
+                    key: {'Type': 'String', 'Value': attribute['StringValue']}
+                    for key, attribute in alerting.message_attributes(reason).items()}}}
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    sns.publish(TopicArn=topic_arn, Message=body, MessageAttributes=alerting.message_attributes(reason))
+                    if expand:
+                        notifier.expand(json.loads(body))
+                    notifier.render(record)
+                    samples.append(time.perf_counter() - start)
+            rows.append((name, statistics.median(sizes), percentile(sizes, 0.99), max(sizes), rejected,
+                         statistics.median(samples) * 1000, percentile(samples, 0.99) * 1000))
+
+    print(f'{args.alerts} alerts, {args.large_share:.0%} with {args.large_kb} KB of request parameters')
+    print(f'{"payload":<22} {"p50 B":>7} {"p99 B":>8} {"max B":>8} {">256KB":>7} {"p50 ms":>7} {"p99 ms":>7}')
+    for name, p50, p99, largest, rejected, latency_p50, latency_p99 in rows:
+        print(f'{name:<22} {p50:>7.0f} {p99:>8} {largest:>8} {rejected:>7} {latency_p50:>7.2f} {latency_p99:>7.2f}')
+
+
+if __name__ == '__main__':
+    main()
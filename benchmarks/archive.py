@@ -0,0 +1,116 @@
+"""Activity archive: storage size and query time vs keeping every activity in DynamoDB.
+
+    python -m benchmarks.archive [--activities 20000] [--days 30] [--users 50] [--query-days 7] [--repeat 5]
+
+Synthetic activities over --days in the compact item format. Size: the table items and
+their UserIdentityIndex projections as DynamoDB bills them (tools/capacity.py, plus 100
+bytes of overhead per item and per index entry), vs the archive objects. Monthly storage
+at us-east-1 prices: $0.25 per GB for DynamoDB Standard, $0.023 for S3 Standard. Query:
+the activities of one user over the last --query-days, every page of the index from
+moto (hot attributes only) vs the whole events from the archive in a local directory and
+in moto S3, pruned to the user bucket of the days in range or to the days only.
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import boto3
+from moto import mock_aws
+
+from tools import capacity
+from tools.events import generate
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.local_aws import create_activity_table
+
+add_layers_to_path()
+from activity_common import archive, item_format, reporting  # noqa: E402
+
+DAY = 24 * 60 * 60
+# per item and per index entry, billed as storage
+ITEM_OVERHEAD_BYTES = 100
+DYNAMODB_GB_MONTH = 0.25
+S3_GB_MONTH = 0.023
+
+
+def timed(function, repeat: int) -> tuple:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, result
+
+
+def history(table, user: str, since: int, until: int) -> list:
+    items, cursor = [], None
+    while True:
+        page = reporting.history(table, user, since, until, limit=reporting.MAX_PAGE_SIZE, cursor=cursor)
+        items.extend(page['items'])
+        cursor = page['cursor']
+        if not cursor:
+            return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--activities', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--query-days', type=int, default=7)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    build_item = load_handler('store-sign-in-activity').build_item
+    now = int(time.time())
+    items = [item_format.encode(build_item(event))
+             for event in generate(args.activities, now - args.days * DAY, duration=args.days * DAY, users=args.users, seed=7)]
+    activities = [item_format.decode(item) for item in items]
+    user = activities[0]['userIdentity']
+    since = now - args.query_days * DAY
+
+    index_attributes = ('id', 'timestamp', 'userIdentity') + item_format.HOT_ATTRIBUTES
+    table_bytes = sum(capacity.item_size(item) + capacity.item_size(capacity.project(item, index_attributes))
+                      + 2 * ITEM_OVERHEAD_BYTES for item in items)
+    rows = []
+    with mock_aws(), tempfile.TemporaryDirectory() as directory:
+        table = create_activity_table(boto3.resource('dynamodb'))
+        with table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+        query_ms, found = timed(lambda: history(table, user, since, now), args.repeat)
+        rows.append(('dynamodb table + index', table_bytes, DYNAMODB_GB_MONTH, query_ms, '-', len(found)))
+
+        local = archive.LocalStore(directory)
+        keys = archive.write(local, activities)
+        archive_bytes = sum(os.path.getsize(os.path.join(directory, key)) for key in keys)
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket='aws-activity-archive')
+        remote = archive.S3Store(s3, 'aws-activity-archive')
+        archive.write(remote, activities)
+
+        queries = [
+            ('archive, local', local, lambda: list(archive.query(local, since, now, user))),
+            ('archive, moto S3', remote, lambda: list(archive.query(remote, since, now, user))),
+            # every user bucket of the days in range
+            ('archive, days only', remote,
+             lambda: [activity for activity in archive.query(remote, since, now) if activity['userIdentity'] == user])
+        ]
+        for name, store, query in queries:
+            reads = store.reads
+            query_ms, found = timed(query, args.repeat)
+            rows.append((name, archive_bytes, S3_GB_MONTH, query_ms, (store.reads - reads) // args.repeat, len(found)))
+
+    print(f'{args.activities} activities over {args.days} days, {len(keys)} archive objects, '
+          f'query of {user} over {args.query_days} days')
+    print(f'{"source":<24} {"MB":>8} {"$/month":>8} {"query ms":>9} {"objects":>7} {"found":>6}')
+    for name, size, price, query_ms, objects, found in rows:
+        print(f'{name:<24} {size / 1e6:>8.2f} {size / 1e9 * price:>8.5f} {query_ms:>9.1f} {objects:>7} {found:>6}')
+
+
+if __name__ == '__main__':
+    main()
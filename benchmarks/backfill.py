@@ -0,0 +1,98 @@
+"""CloudTrail archive backfill: events/second of tools/backfill.py per number of workers.
+
+    python -m benchmarks.backfill [--size-mb 2048] [--sign-in-ratio 0.02] [--workers 1 2 4] [--archive DIR]
+
+A synthetic archive of gzipped log files (mostly unrelated API calls, like a real trail)
+is generated once, then backfilled into a fresh table of a moto server running in its
+own process. Absolute numbers reflect moto, compare rows with each other.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+import boto3
+
+from tools import backfill
+from tools.events import api_call_record, sign_in_event
+from tools.local_aws import create_activity_table, start_moto_server
+
+
+FILE_SIZE = 16 * 1024 * 1024
+
+
+def generate_archive(directory, size_mb, sign_in_ratio, seed=42):
+    # returns the number of sign-in events written
+    rng = random.Random(seed)
+    now = int(time.time())
+    # unrelated records are repeated, only sign-ins need unique keys
+    noise = [json.dumps(api_call_record(now - i, user_name=f'user-{i % 500}')) for i in range(1000)]
+    sign_ins = 0
+    written = 0
+    index = 0
+    while written < size_mb * 1024 * 1024:
+        records, size = [], 0
+        while size < FILE_SIZE:
+            if rng.random() < sign_in_ratio:
+                record = sign_in_event(now - rng.randrange(86400), user_name=f'user-{rng.randrange(500)}',
+                                       success=rng.random() > 0.1, mfa=rng.random() > 0.05)['detail']
+                record['eventID'] = str(uuid.UUID(int=rng.getrandbits(128)))
+                records.append(json.dumps(record))
+                sign_ins += 1
+            else:
+                records.append(rng.choice(noise))
+            size += len(records[-1]) + 1
+        path = os.path.join(directory, f'{index:06d}.json.gz')
+        with gzip.open(path, 'wt', compresslevel=1) as log:
+            log.write('{"Records":[' + ','.join(records) + ']}')
+        written += size
+        index += 1
+    return sign_ins
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=2048, help='uncompressed size of the archive')
+    parser.add_argument('--sign-in-ratio', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--archive', help='reuse or keep the generated archive in this directory')
+    args = parser.parse_args()
+
+    archive = args.archive or tempfile.mkdtemp(prefix='cloudtrail-')
+    os.makedirs(archive, exist_ok=True)
+    if not os.listdir(archive):
+        start = time.perf_counter()
+        sign_ins = generate_archive(archive, args.size_mb, args.sign_in_ratio)
+        print(f'generated {args.size_mb} MB, {sign_ins} sign-in events in {time.perf_counter() - start:.0f}s')
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    logging.disable(logging.WARNING)
+    server, url = start_moto_server()
+    os.environ['AWS_ENDPOINT_URL'] = url
+    try:
+        print(f'{"workers":>7} {"records/s":>10} {"events/s":>9} {"MB/s":>6}')
+        for workers in args.workers:
+            table_name = f'bench-backfill-{workers}'
+            create_activity_table(boto3.resource('dynamodb'), table_name=table_name)
+            start = time.perf_counter()
+            totals = backfill.run(archive, {'table_name': table_name}, workers=workers)
+            elapsed = time.perf_counter() - start
+            assert not totals['failed'], totals
+            print(f'{workers:>7} {totals["records"] / elapsed:>10.0f} {totals["events"] / elapsed:>9.0f} '
+                  f'{args.size_mb / elapsed:>6.1f}')
+    finally:
+        server.terminate()
+        if not args.archive:
+            shutil.rmtree(archive)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Buffered ingestion: items/second of store-sign-in-activity per SQS batch size.
+
+    python -m benchmarks.buffered_ingestion [--events 2000] [--batch-sizes 1 10 100 1000]
+
+The "single" row is the state machine path: one invocation and one put_item per event.
+Runs against moto, so absolute numbers are only comparable with each other.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import boto3
+from moto import mock_aws
+
+from tools.events import sign_in_event
+from tools.lambdas import load_handler
+from tools.local_aws import create_activity_table
+
+
+def workload(count, now):
+    # mostly successful MFA logins with a few failures, no-MFA and Root logins
+    events = []
+    for i in range(count):
+        kind = i % 20
+        events.append(sign_in_event(
+            now - i % 3000,
+            user_name=f'user-{i % 50}',
+            identity_type='Root' if kind == 0 else 'IAMUser',
+            success=kind not in (1, 2),
+            mfa=kind != 3
+        ))
+    return events
+
+
+def run(events, batch_size):
+    with mock_aws():
+        table_name = f'bench-{batch_size}'
+        create_activity_table(boto3.resource('dynamodb'), table_name=table_name)
+        os.environ['DYNAMODB_TABLE_NAME'] = table_name
+        os.environ['SNS_TOPIC_ARN'] = boto3.client('sns').create_topic(Name='aws-activity-notification')['TopicArn']
+        # the first alert of each window schedules its digest
+        os.environ['DIGEST_QUEUE_URL'] = boto3.client('sqs').create_queue(QueueName='alert-digest')['QueueUrl']
+        store = load_handler('store-sign-in-activity')
+
+        start = time.perf_counter()
+        if batch_size is None:
+            for event in events:
+                store.handler(event, None)
+        else:
+            for offset in range(0, len(events), batch_size):
+                records = [
+                    {'messageId': str(i), 'body': json.dumps(event), 'eventSource': 'aws:sqs'}
+                    for i, event in enumerate(events[offset:offset + batch_size], start=offset)
+                ]
+                result = store.handler({'Records': records}, None)
+                assert not result['batchItemFailures'], result
+        return len(events) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    # handler logging would dominate the measurement
+    logging.disable(logging.WARNING)
+    events = workload(args.events, int(time.time()))
+    print(f'{"batch size":>10} {"items/s":>9}')
+    print(f'{"single":>10} {run(events, None):>9.0f}')
+    for batch_size in args.batch_sizes:
+        print(f'{batch_size:>10} {run(events, batch_size):>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Failed sign-in counting: legacy GSI query loop vs minute-bucket counters.
+
+    python -m benchmarks.failed_sign_in_count [--sizes 10 1000 10000]
+
+Consumed capacity is estimated from DynamoDB's sizing rules (see tools/capacity.py),
+latency is measured against moto.
+"""
+import argparse
+import os
+import statistics
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Key, Attr
+from moto import mock_aws
+
+from tools import capacity
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path
+from tools.local_aws import create_activity_table
+
+add_layers_to_path()
+from activity_common import failure_counter  # noqa: E402
+
+
+USER = 'IAMUser#alice'
+# UserIdentityIndex before the compact item format, the legacy loop filters on `detail`
+LEGACY_INDEX_ATTRIBUTES = ['id', 'eventName', 'detail']
+GSI_ATTRIBUTES = {'timestamp', 'userIdentity', *LEGACY_INDEX_ATTRIBUTES}
+
+
+def legacy_count(table, user_identity, now):
+    # the query loop count-failed-sign-in-attempt used before the counters
+    query = {
+        'IndexName': 'UserIdentityIndex',
+        'KeyConditionExpression': Key('userIdentity').eq(user_identity) & Key('timestamp').between(now - 60 * 60, now),
+        'FilterExpression': Attr('eventName').eq('ConsoleLogin') & Attr('detail.responseElements.ConsoleLogin').eq('Failure'),
+        'ScanIndexForward': False
+    }
+    results = []
+    while True:
+        response = table.query(**query)
+        results.extend(response['Items'])
+        if not response.get('LastEvaluatedKey'):
+            return len(results)
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def seed(table, failures, noise, now):
+    # `failures` failed logins plus `noise` other logins per failure for the same user,
+    # spread over the last hour; counters are aggregated the way store-sign-in-activity does.
+    # The oldest, partial minute is left out: the counters only resolve the window to a minute
+    items, buckets = [], {}
+    total = failures * (1 + noise)
+    span = failure_counter.WINDOW_SECONDS - failure_counter.BUCKET_SECONDS
+    for i in range(total):
+        timestamp = now - (i * span // total)
+        failed = i % (1 + noise) == 0
+        event = sign_in_event(timestamp, success=not failed)
+        items.append({**event, 'eventName': 'ConsoleLogin', 'userIdentity': USER, 'timestamp': timestamp, 'ttl': now + 3600})
+        if failed:
+            bucket = failure_counter.bucket_of(timestamp)
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+        for bucket, count in buckets.items():
+            batch.put_item(Item={'id': failure_counter.counter_key(USER), 'timestamp': bucket, 'count': count, 'ttl': now + 7200})
+    return items, buckets
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return result, statistics.median(samples) * 1000
+
+
+def run(failures, noise, repeat):
+    with mock_aws():
+        table = create_activity_table(boto3.resource('dynamodb'), table_name=f'bench-{failures}',
+                                      index_attributes=LEGACY_INDEX_ATTRIBUTES)
+        now = int(time.time())
+        items, buckets = seed(table, failures, noise, now)
+
+        legacy, legacy_ms = timed(lambda: legacy_count(table, USER, now), repeat)
+        counted, counter_ms = timed(lambda: failure_counter.count_failures(table, USER, now), repeat)
+
+    # every item in the key range is read (and billed) before FilterExpression runs
+    index_sizes = sorted((item['timestamp'], capacity.item_size(capacity.project(item, GSI_ATTRIBUTES))) for item in items)
+    legacy_rcu = capacity.read_units(sum(size for _, size in index_sizes))
+    counter_rcu = capacity.read_units(sum(capacity.item_size({'id': failure_counter.counter_key(USER), 'timestamp': b, 'count': c, 'ttl': 0}) for b, c in buckets.items()), consistent=True)
+
+    # during a burst each failure triggers one count over everything stored before it
+    legacy_burst, running = 0.0, 0
+    for _, size in index_sizes:
+        running += size
+        legacy_burst += capacity.read_units(running)
+    failed = sum(buckets.values())
+    counter_burst = failed * counter_rcu
+
+    return {
+        'failures': failed, 'items': len(items), 'legacy': legacy, 'counted': counted,
+        'legacy_ms': legacy_ms, 'counter_ms': counter_ms,
+        'legacy_rcu': legacy_rcu, 'counter_rcu': counter_rcu,
+        'legacy_burst_rcu': legacy_burst, 'counter_burst_rcu': counter_burst
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--noise', type=int, default=1, help='non-failure logins stored per failure')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    print(f'{"failures":>9} {"items":>7} {"legacy ms":>10} {"counter ms":>11} {"legacy RCU":>11} {"counter RCU":>12} {"burst legacy RCU":>17} {"burst counter RCU":>18}')
+    for size in args.sizes:
+        r = run(size, args.noise, args.repeat)
+        assert r['legacy'] == r['counted'] == r['failures'], r
+        print(f'{r["failures"]:>9} {r["items"]:>7} {r["legacy_ms"]:>10.1f} {r["counter_ms"]:>11.1f} {r["legacy_rcu"]:>11.1f} '
+              f'{r["counter_rcu"]:>12.1f} {r["legacy_burst_rcu"]:>17.1f} {r["counter_burst_rcu"]:>18.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Cold import, first invoke and warm invoke time of every Lambda handler.
+
+    python -m benchmarks.handler_startup [--warm 50] [--save | --check] [--tolerance 0.5]
+
+Each handler is measured in a fresh interpreter so imports are really cold. DynamoDB
+and SNS are moto, Slack is a local webhook stub. --save records the results in
+benchmarks/baselines/handler_startup.json, --check fails when a measurement is slower
+than the recorded baseline by more than --tolerance (a fraction).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'handler_startup.json')
+HANDLERS = ['store-sign-in-activity', 'count-failed-sign-in-attempt', 'slack-notification']
+
+
+def measure(function_name: str, warm: int) -> dict:
+    # runs in the child interpreter
+    import logging
+    import statistics
+    import time
+
+    start = time.perf_counter()
+    from tools.lambdas import load_handler
+    module = load_handler(function_name)
+    cold_import = time.perf_counter() - start
+
+    import boto3
+    from moto import mock_aws
+    from tools.events import sign_in_event
+    from tools.local_aws import create_activity_table
+    from tools.webhook_stub import WebhookStub
+
+    logging.disable(logging.WARNING)
+    now = int(time.time())
+    with mock_aws(), WebhookStub() as webhook:
+        create_activity_table(boto3.resource('dynamodb'))
+        if function_name == 'slack-notification':
+            module.SLACK_CHANNELS['alarm-aws'] = webhook.url
+            event = {'Records': [{'Sns': {
+                'Message': json.dumps({**sign_in_event(now), 'failedAttempts': 3}),
+                'MessageAttributes': {
+                    'reason': {'Type': 'String', 'Value': 'ManyFailedSignInAttempt'},
+                    'severity': {'Type': 'String', 'Value': 'High'},
+                    'channel': {'Type': 'String', 'Value': 'alarm-aws'}
+                }
+            }}]}
+            make_event = lambda: event  # noqa: E731
+        elif function_name == 'count-failed-sign-in-attempt':
+            make_event = lambda: {'userIdentity': 'IAMUser#alice'}  # noqa: E731
+        else:
+            make_event = lambda: sign_in_event(now, success=False)  # noqa: E731
+
+        start = time.perf_counter()
+        module.handler(make_event(), None)
+        first_invoke = time.perf_counter() - start
+
+        samples = []
+        for _ in range(warm):
+            event = make_event()
+            start = time.perf_counter()
+            module.handler(event, None)
+            samples.append(time.perf_counter() - start)
+
+    return {
+        'cold_import_ms': cold_import * 1000,
+        'first_invoke_ms': first_invoke * 1000,
+        'warm_invoke_ms': statistics.median(samples) * 1000
+    }
+
+
+def run(function_name: str, warm: int) -> dict:
+    env = {
+        **os.environ,
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'DYNAMODB_TABLE_NAME': 'aws-activity'
+    }
+    code = f'import json; from benchmarks.handler_startup import measure; print(json.dumps(measure({function_name!r}, {warm})))'
+    output = subprocess.run([sys.executable, '-c', code], env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--warm', type=int, default=50, help='warm invocations per handler')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--save', action='store_true', help='record the results as the baseline')
+    group.add_argument('--check', action='store_true', help='fail on a regression against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = {name: run(name, args.warm) for name in HANDLERS}
+
+    print(f'{"handler":<30} {"cold import ms":>15} {"first invoke ms":>16} {"warm invoke ms":>15}')
+    for name, result in results.items():
+        print(f'{name:<30} {result["cold_import_ms"]:>15.1f} {result["first_invoke_ms"]:>16.1f} {result["warm_invoke_ms"]:>15.2f}')
+
+    if args.save:
+        os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+        with open(BASELINE, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    elif args.check:
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+        regressions = [
+            f'{name} {metric}: {value:.1f} ms > {baseline[name][metric]:.1f} ms'
+            for name, result in results.items() if name in baseline
+            for metric, value in result.items()
+            if value > baseline[name][metric] * (1 + args.tolerance)
+        ]
+        if regressions:
+            sys.exit('Regressions against baseline:\n' + '\n'.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""IP enrichment: load time and lookups/second of the memory-mapped range table.
+
+    python -m benchmarks.ip_enrichment [--ranges 1000000] [--lookups 200000]
+
+A synthetic iptoasn.com file of disjoint IPv4 ranges is built into a database. Load
+compares parsing the file (what a Lambda would do on every cold start without the
+database) with opening the map. Lookups are random addresses, and an attack mix where
+most lookups come from a few hundred addresses, with and without the LRU cache.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from tools import ip_database as ip_database_tool
+from tools.lambdas import add_layers_to_path
+
+add_layers_to_path()
+from activity_common import ip_database  # noqa: E402
+
+
+def write_ranges(path: str, count: int, seed: int = 1):
+    rng = random.Random(seed)
+    # split the IPv4 space into `count` consecutive ranges of random size
+    bounds = sorted(rng.sample(range(1, 2 ** 32), count - 1))
+    with open(path, 'w') as file:
+        first = 0
+        for last in bounds + [2 ** 32]:
+            asn = rng.randrange(1, 400000)
+            file.write(f'{ip_string(first)}\t{ip_string(last - 1)}\t{asn}\tUS\tAS{asn}-NETWORK\n')
+            first = last
+
+
+def ip_string(value: int) -> str:
+    return '.'.join(str(value >> shift & 0xFF) for shift in (24, 16, 8, 0))
+
+
+def parse(path: str):
+    # the database an enrichment would load from the source file
+    firsts, lasts, records = [], [], []
+    for first, last, asn, country, org in ip_database_tool.read_asn_ranges(path):
+        firsts.append(int.from_bytes(bytes(int(part) for part in first.split('.')), 'big'))
+        lasts.append(int.from_bytes(bytes(int(part) for part in last.split('.')), 'big'))
+        records.append((asn, country, org))
+    return firsts, lasts, records
+
+
+def lookups_per_second(database, addresses) -> float:
+    lookup = database.lookup
+    start = time.perf_counter()
+    for address in addresses:
+        lookup(address)
+    return len(addresses) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ranges', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    args = parser.parse_args()
+
+    rng = random.Random(2)
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'ip2asn-v4.tsv')
+        path = os.path.join(directory, 'ip_ranges.db')
+        write_ranges(source, args.ranges)
+        start = time.perf_counter()
+        ip_database.build(path, ip_database_tool.read_asn_ranges(source))
+        print(f'built {args.ranges} ranges in {time.perf_counter() - start:.1f}s, '
+              f'{os.path.getsize(source) / 2 ** 20:.1f} MiB source, {os.path.getsize(path) / 2 ** 20:.1f} MiB database')
+
+        print(f'{"load":<14} {"ms":>10}')
+        start = time.perf_counter()
+        parse(source)
+        print(f'{"parse source":<14} {(time.perf_counter() - start) * 1000:>10.1f}')
+        start = time.perf_counter()
+        database = ip_database.IpDatabase(path)
+        print(f'{"open map":<14} {(time.perf_counter() - start) * 1000:>10.3f}')
+
+        random_addresses = [ip_string(rng.randrange(2 ** 32)) for _ in range(args.lookups)]
+        attackers = [ip_string(rng.randrange(2 ** 32)) for _ in range(300)]
+        attack = [rng.choice(attackers) if rng.random() < 0.95 else ip_string(rng.randrange(2 ** 32))
+                  for _ in range(args.lookups)]
+
+        print(f'\n{"lookups":<14} {"cache":<6} {"lookups/s":>12}')
+        for name, addresses in (('random', random_addresses), ('attack', attack)):
+            for cache_size in (0, ip_database.CACHE_SIZE):
+                database = ip_database.IpDatabase(path, cache_size=cache_size)
+                rate = lookups_per_second(database, addresses)
+                print(f'{name:<14} {cache_size:<6} {rate:>12,.0f}')
+                database.close()
+
+
+if __name__ == '__main__':
+    main()
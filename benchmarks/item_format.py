@@ -0,0 +1,79 @@
+"""Stored item size and write cost: full event items vs the compact item format.
+
+    python -m benchmarks.item_format [--events 10000]
+
+Sizes follow DynamoDB's item sizing rules (tools/capacity.py). Every write is billed
+for the base table and again for the UserIdentityIndex projection.
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+
+from tools import capacity
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+
+add_layers_to_path()
+from activity_common import item_format  # noqa: E402
+
+
+LEGACY_PROJECTION = {'id', 'timestamp', 'userIdentity', 'eventName', 'detail'}
+COMPACT_PROJECTION = {'id', 'timestamp', 'userIdentity', *item_format.HOT_ATTRIBUTES}
+USER_AGENTS = [
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.4 Safari/605.1.15',
+    'aws-internal/3 aws-sdk-java/1.12.200 Linux/5.4 OpenJDK_64-Bit_Server_VM/25.322 java/1.8.0_322 vendor/Oracle_Corporation',
+    'AWS Console Mobile/1.15.0 (iPhone; iOS 15.4)'
+]
+
+
+def corpus(count, seed=42):
+    rng = random.Random(seed)
+    now = int(time.time())
+    store = load_handler('store-sign-in-activity')
+    for i in range(count):
+        identity_type = rng.choices(['IAMUser', 'Root', 'AssumedRole'], [0.85, 0.02, 0.13])[0]
+        event = sign_in_event(
+            now - rng.randrange(86400),
+            user_name=f'user-{rng.randrange(500)}.{rng.choice(["ops", "dev", "sec"])}',
+            identity_type=identity_type,
+            success=rng.random() > 0.1,
+            mfa=rng.random() > 0.05,
+            source_ip=f'{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}'
+        )
+        event['detail']['userAgent'] = rng.choice(USER_AGENTS)
+        yield store.build_item(event)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=10000)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    rows = {'legacy': [], 'compact': []}
+    encode_seconds, decode_seconds = [], []
+    for event in corpus(args.events):
+        start = time.perf_counter()
+        compact = item_format.encode(event)
+        encode_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        item_format.decode(compact)
+        decode_seconds.append(time.perf_counter() - start)
+
+        for name, item, projection in (('legacy', event, LEGACY_PROJECTION), ('compact', compact, COMPACT_PROJECTION)):
+            index_item = capacity.project(item, projection)
+            rows[name].append((capacity.item_size(item), capacity.item_size(index_item),
+                               capacity.write_units(item) + capacity.write_units(index_item)))
+
+    print(f'{"format":<8} {"avg item B":>11} {"avg index B":>12} {"WCU/write":>10} {"total WCU":>10}')
+    for name, values in rows.items():
+        print(f'{name:<8} {statistics.mean(v[0] for v in values):>11.0f} {statistics.mean(v[1] for v in values):>12.0f} '
+              f'{statistics.mean(v[2] for v in values):>10.2f} {sum(v[2] for v in values):>10}')
+    print(f'encode {statistics.median(encode_seconds) * 1e6:.0f} us, decode {statistics.median(decode_seconds) * 1e6:.0f} us per item (median)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Notification fan-out: end-to-end alert latency as the number of targets grows.
+
+    python -m benchmarks.notification_fanout [--targets 1 2 4 8 16] [--latency 0.05] [--slow 1.0] [--repeat 5]
+
+One alert goes to N targets, taken in turn from Slack webhooks, generic webhooks and
+email recipients (local stubs, each answering after --latency). "sequential" delivers
+to one target after the other, "concurrent" is the handler, every target at once.
+With one slow target (answering after --slow) the alert takes as long as that target,
+"others ms" is when the last of the other targets was notified.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import statistics
+import time
+
+from tools.events import sign_in_event
+from tools.lambdas import load_handler
+from tools.smtp_stub import SmtpStub
+from tools.webhook_stub import WebhookStub
+
+TYPES = ['slack', 'webhook', 'email']
+
+
+def alert_event():
+    message = load_handler('store-sign-in-activity').build_item(sign_in_event(int(time.time()), identity_type='Root'))
+    return {'Records': [{'Sns': {
+        'MessageId': 'message-0',
+        'Message': json.dumps(message),
+        'MessageAttributes': {
+            'reason': {'Type': 'String', 'Value': 'RootActivity'},
+            'severity': {'Type': 'String', 'Value': 'Critical'},
+            'channel': {'Type': 'String', 'Value': 'alarm-aws'},
+            'targets': {'Type': 'String.Array', 'Value': json.dumps(['Slack', 'Webhook', 'Email'])}
+        }
+    }}]}
+
+
+def configure(stack, count: int, latency: float, slow: float = None):
+    # a fresh notification function with `count` targets, the first one slow if `slow`
+    module = load_handler('slack-notification')
+    module.SLACK_CHANNELS['alarm-aws'] = None
+    smtp = stack.enter_context(SmtpStub(latency=latency))
+    module.SMTP_SETTINGS = smtp.settings
+    targets = {'slack': [], 'webhook': [], 'email': []}
+    for i in range(count):
+        target_type = TYPES[i % len(TYPES)]
+        if target_type == 'email':
+            targets['email'].append(f'security-{i}@example.com')
+        else:
+            webhook = stack.enter_context(WebhookStub(latency=slow if slow and i == 0 else latency))
+            targets[target_type].append(webhook.url)
+    module.NOTIFICATION_TARGETS = {'alarm-aws': targets}
+    module.DEFAULT_BUDGET_SECONDS = 600
+    return module
+
+
+def timed(module, event) -> tuple:
+    # handler seconds, and when each target was notified since the start
+    done = {}
+    send = module.send
+
+    async def timed_send(target, *args):
+        await send(target, *args)
+        done[target] = time.perf_counter() - start
+    module.send = timed_send
+    start = time.perf_counter()
+    module.handler(event, None)
+    module.send = send
+    return time.perf_counter() - start, done
+
+
+def sequential(module, event) -> float:
+    record = event['Records'][0]
+    notification = module.render(record)
+    targets = module.route(record)
+    deadline = time.monotonic() + module.DEFAULT_BUDGET_SECONDS
+
+    async def one_after_another():
+        for target in targets:
+            await module.send(target, notification, record, deadline)
+    start = time.perf_counter()
+    module.get_dispatcher().run(one_after_another())
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--targets', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--latency', type=float, default=0.05, help='response time of a target in seconds')
+    parser.add_argument('--slow', type=float, default=1.0, help='response time of the slow target in seconds')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    event = alert_event()
+    print(f'{"targets":>7} {"sequential ms":>13} {"concurrent ms":>13} {"with slow ms":>12} {"others ms":>9}')
+    for count in args.targets:
+        with contextlib.ExitStack() as stack:
+            module = configure(stack, count, args.latency)
+            sequential_ms = statistics.median(sequential(module, event) for _ in range(args.repeat)) * 1000
+            concurrent_ms = statistics.median(timed(module, event)[0] for _ in range(args.repeat)) * 1000
+        with contextlib.ExitStack() as stack:
+            module = configure(stack, count, args.latency, slow=args.slow)
+            slow_target = module.route(event['Records'][0])[0]
+            elapsed, done = timed(module, event)
+            others = [seconds for target, seconds in done.items() if target != slow_target]
+        others_ms = f'{max(others) * 1000:>9.1f}' if others else f'{"-":>9}'
+        print(f'{count:>7} {sequential_ms:>13.1f} {concurrent_ms:>13.1f} {elapsed * 1000:>12.1f} {others_ms}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""End-to-end pipeline: per-stage latency, estimated capacity and alerts of a synthetic load.
+
+    python -m benchmarks.pipeline [--events 2000] [--mix root=0.01 ...] [--bursts 5] [--save | --check] [--tolerance 0.5]
+
+Events come from tools.events.generate and are driven through tools/harness.py: the
+synthesized state machine with the real handlers on moto, Slack is a local webhook
+stub. --save records the results in benchmarks/baselines/pipeline.json, --check fails
+when a latency or capacity is higher than the baseline by more than --tolerance.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from tools.events import DEFAULT_MIX, generate
+from tools.harness import Harness
+from tools.workflow_cost import parse_mix, synth_definition
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'pipeline.json')
+METRICS = ['p50_ms', 'p99_ms', 'rcu', 'wcu']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--mix', nargs='*', metavar='KIND=SHARE', help=f'event mix, default {DEFAULT_MIX}')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--bursts', type=int, default=5, help='brute-force bursts of failed logins')
+    parser.add_argument('--burst-size', type=int, default=10)
+    parser.add_argument('--webhook-latency', type=float, default=0.0, help='Slack response time in seconds')
+    parser.add_argument('--seed', type=int, default=42)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--save', action='store_true', help='record the results as the baseline')
+    group.add_argument('--check', action='store_true', help='fail on a regression against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    definition = synth_definition()
+    now = int(time.time())
+    events = generate(args.events, now - 3600, mix=parse_mix(args.mix), users=args.users, bursts=args.bursts,
+                      burst_size=args.burst_size, seed=args.seed)
+    with Harness(definition, webhook_latency=args.webhook_latency) as harness:
+        report = harness.run(events)
+
+    print(f'{"stage":<10} {"calls":>6} {"p50 ms":>8} {"p99 ms":>8} {"RCU":>8} {"WCU":>8}')
+    for stage, result in report['stages'].items():
+        print(f'{stage:<10} {result["count"]:>6} {result["p50_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+              f'{result["rcu"]:>8.1f} {result["wcu"]:>8.1f}')
+    print(f'{report["events"]} events, {sum(report["failed_executions"].values())} failed executions, '
+          f'alerts {json.dumps(report["alerts"], sort_keys=True)}, {report["coalesced"]} coalesced, '
+          f'{report["notified"]} Slack notifications')
+
+    if args.save:
+        os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+        with open(BASELINE, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+    elif args.check:
+        with open(BASELINE) as f:
+            baseline = json.load(f)['stages']
+        regressions = [
+            f'{stage} {metric}: {result[metric]:.2f} > {baseline[stage][metric]:.2f}'
+            for stage, result in report['stages'].items() if stage in baseline
+            for metric in METRICS
+            if result[metric] > baseline[stage][metric] * (1 + args.tolerance)
+        ]
+        if regressions:
+            sys.exit('Regressions against baseline:\n' + '\n'.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Daily rollups: read cost and latency of a per-user report vs querying every activity.
+
+    python -m benchmarks.rollups [--activities 10000] [--days 90] [--users 5] [--window 60] [--repeat 3]
+
+Synthetic activities over --days are stored in moto and streamed through the rollup
+function in tumbling windows of --window seconds of activity time, as one shard. The
+report is the daily sign-ins, failures, sign-ins without MFA and source addresses of one
+user over the --days: every activity of the user from UserIdentityIndex (hot attributes
+only, pages of 1000) vs one Query of the rollup items. Read units are estimated with
+tools/capacity.py from what DynamoDB bills: the index entries read, and the whole rollup
+items (a projection does not make them cheaper). Maintenance: the UpdateItem calls of
+the windows and their write units, at the final size of each rollup item.
+"""
+import argparse
+import logging
+import os
+import statistics
+import time
+
+import boto3
+from moto import mock_aws
+
+from tools import capacity, report
+from tools.events import generate
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.local_aws import create_activity_table
+
+add_layers_to_path()
+from activity_common import item_format, reporting, rollups  # noqa: E402
+
+DAY = 24 * 60 * 60
+SHARD = 'shardId-00000001650000000000-0a1b2c3d'
+
+
+def timed(function, repeat: int) -> tuple:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, result
+
+
+def stream(table, items: list, window_seconds: int) -> dict:
+    # applies the rollups of every window, returns the UpdateItem calls per rollup key
+    updates, window, window_end = {}, rollups.empty_window(), None
+
+    def flush():
+        rollups.flush(table, SHARD, window)
+        for key in window['rollups']:
+            day, user_identity = key.split('|', 1)
+            rollup_key = (rollups.rollup_id(user_identity), int(day))
+            updates[rollup_key] = updates.get(rollup_key, 0) + 1
+
+    for sequence, item in enumerate(items, 100000000000000000000):
+        if window_end is not None and item['timestamp'] >= window_end:
+            flush()
+            window = rollups.empty_window()
+        if not window['rollups']:
+            window_end = item['timestamp'] - item['timestamp'] % window_seconds + window_seconds
+        rollups.add(window, item, 1, str(sequence))
+    flush()
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--activities', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--window', type=int, default=60, help='tumbling window, seconds')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    build_item = load_handler('store-sign-in-activity').build_item
+    now = int(time.time())
+    since = now - (args.days - 1) * DAY
+    items = [item_format.encode(build_item(event))
+             for event in generate(args.activities, rollups.day_start(since), duration=now - rollups.day_start(since),
+                                   users=args.users, seed=11)]
+    user = items[0]['userIdentity']
+    index_attributes = ('id', 'timestamp', 'userIdentity') + item_format.HOT_ATTRIBUTES
+
+    with mock_aws():
+        table = create_activity_table(boto3.resource('dynamodb'))
+        with table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+        start = time.perf_counter()
+        updates = stream(table, items, args.window)
+        stream_s = time.perf_counter() - start
+        rollup_items = {}
+        response = table.scan()
+        while True:
+            rollup_items.update({(item['id'], int(item['timestamp'])): item for item in response['Items']
+                                 if item['id'].startswith(rollups.PREFIX)})
+            if 'LastEvaluatedKey' not in response:
+                break
+            response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+
+        raw_ms, from_activities = timed(lambda: report.daily(table, user, since, now, from_activities=True), args.repeat)
+        rollup_ms, from_rollups = timed(lambda: report.daily(table, user, since, now), args.repeat)
+    assert from_rollups == from_activities, 'rollups differ from the activities'
+
+    activities = [item for item in items if item['userIdentity'] == user]
+    pages = [activities[i:i + reporting.MAX_PAGE_SIZE] for i in range(0, len(activities), reporting.MAX_PAGE_SIZE)]
+    raw_rcu = sum(capacity.read_units(sum(capacity.item_size(capacity.project(item, index_attributes)) for item in page))
+                  for page in pages)
+    user_rollups = [item for (key, _), item in rollup_items.items() if key == rollups.rollup_id(user)]
+    rollup_rcu = capacity.read_units(sum(capacity.item_size(item) for item in user_rollups))
+    # every update of a rollup billed at the final size of its item, an upper bound
+    maintenance_wcu = sum(count * capacity.write_units(rollup_items[key]) for key, count in updates.items())
+
+    print(f'{args.activities} activities of {args.users} users over {args.days} days, '
+          f'report of {user}: {len(activities)} activities on {len(from_rollups)} days')
+    print(f'{"source":<20} {"items":>7} {"pages":>6} {"RCU":>7} {"ms":>8}')
+    print(f'{"activities (index)":<20} {len(activities):>7} {max(1, len(pages)):>6} {raw_rcu:>7.1f} {raw_ms:>8.1f}')
+    print(f'{"rollups":<20} {len(user_rollups):>7} {1:>6} {rollup_rcu:>7.1f} {rollup_ms:>8.1f}')
+    print(f'maintenance: {sum(updates.values())} UpdateItem calls for {args.activities} activities in {args.window}s windows, '
+          f'at most {maintenance_wcu} WCU; largest rollup item {max(capacity.item_size(item) for item in rollup_items.values())} '
+          f'bytes; streamed in {stream_s:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Slack notifier throughput: alerts/second through a slow, rate-limited webhook.
+
+    python -m benchmarks.slack_throughput [--alerts 200] [--latency 0.05] [--rate-limit 50]
+
+"sequential" is the previous behaviour: one requests.post per alert without a session,
+responses ignored, so rate-limited alerts are lost. The handler rows send every
+record concurrently over pooled connections and retry 429s after Retry-After.
+"""
+import argparse
+import json
+import logging
+import time
+
+import requests
+
+from tools.events import sign_in_event
+from tools.lambdas import load_handler
+from tools.webhook_stub import WebhookStub
+
+
+def sns_event(count):
+    message = load_handler('store-sign-in-activity').build_item(sign_in_event(int(time.time()), success=False))
+    message['failedAttempts'] = 3
+    return {'Records': [{'Sns': {
+        'MessageId': str(i),
+        'Message': json.dumps(message),
+        'MessageAttributes': {
+            'reason': {'Type': 'String', 'Value': 'ManyFailedSignInAttempt'},
+            'severity': {'Type': 'String', 'Value': 'High'},
+            'channel': {'Type': 'String', 'Value': 'alarm-aws'}
+        }
+    }} for i in range(count)]}
+
+
+def sequential(module, event):
+    for record in event['Records']:
+        payload = module.render(record)
+        requests.post(module.SLACK_CHANNELS['alarm-aws'], data=json.dumps({'text': payload['title']}),
+                      headers={'Content-Type': 'application/json'})
+
+
+def run(alerts, latency, rate_limit, workers):
+    event = sns_event(alerts)
+    with WebhookStub(latency=latency, rate_limit=rate_limit) as webhook:
+        module = load_handler('slack-notification')
+        module.SLACK_CHANNELS['alarm-aws'] = webhook.url
+        start = time.perf_counter()
+        if workers is None:
+            sequential(module, event)
+        else:
+            module.MAX_WORKERS = workers
+            module.DEFAULT_BUDGET_SECONDS = 600
+            module.handler(event, None)
+        elapsed = time.perf_counter() - start
+        return len(webhook.requests), webhook.rate_limited, len(webhook.connections), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--alerts', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='webhook response time in seconds')
+    parser.add_argument('--rate-limit', type=float, default=50, help='webhook requests per second before 429')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 16])
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    print(f'{"mode":<12} {"delivered":>9} {"429s":>6} {"connections":>11} {"seconds":>8} {"delivered/s":>11}')
+    for workers in [None] + args.workers:
+        delivered, limited, connections, elapsed = run(args.alerts, args.latency, args.rate_limit, workers)
+        mode = 'sequential' if workers is None else f'{workers} workers'
+        print(f'{mode:<12} {delivered:>9} {limited:>6} {connections:>11} {elapsed:>8.2f} {delivered / elapsed:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
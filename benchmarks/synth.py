@@ -0,0 +1,52 @@
+"""cdk synth wall time with local, cached bundling of the function dependencies.
+
+    python -m benchmarks.synth [--cache-dir DIR]
+
+Runs app.py as `cdk synth` does, three times: with an empty wheel cache (PyPI is
+reached once), with a warm cache into a fresh cdk.out as on a CI runner restoring the
+cache, and into the same cdk.out again, where the staged assets are reused as they are.
+The cold run is what every synth into a fresh cdk.out cost before the local bundling:
+the Docker bundling installed the requirements from PyPI each time, on top of starting
+its container.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from tools.lambdas import ROOT_DIR
+
+
+def synth(outdir: str, cache_dir: str) -> float:
+    environment = {
+        **os.environ,
+        'CDK_OUTDIR': outdir,
+        'BUNDLING_CACHE_DIR': cache_dir,
+        'CDK_DEFAULT_REGION': os.getenv('CDK_DEFAULT_REGION', 'us-east-1'),
+        'SLACK_WEBHOOK_ALARM_AWS': os.getenv('SLACK_WEBHOOK_ALARM_AWS', 'https://hooks.slack.com/services/placeholder'),
+        'JSII_SILENCE_WARNING_DEPRECATED_NODE_VERSION': '1'
+    }
+    start = time.perf_counter()
+    subprocess.run([sys.executable, 'app.py'], cwd=ROOT_DIR, env=environment, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cache-dir', help='existing bundling cache, skips the cold run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache_dir = args.cache_dir or os.path.join(directory, 'cache')
+        runs = [] if args.cache_dir else [('cold cache', os.path.join(directory, 'cold'))]
+        runs += [('warm cache', os.path.join(directory, 'warm')), ('reused cdk.out', os.path.join(directory, 'warm'))]
+        print(f'{"synth":<16} {"seconds":>8}')
+        for name, outdir in runs:
+            print(f'{name:<16} {synth(outdir, cache_dir):>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
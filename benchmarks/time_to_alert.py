@@ -0,0 +1,98 @@
+"""Time to alert: when the alert of each reason is published, sequential vs parallel state machine.
+
+    python -m benchmarks.time_to_alert [--transition-ms 40] [--measure] [--events 300]
+
+Both graphs (parallel_alerts=False and True) are synthesized and walked with tools/asl.py
+for an event of each alert reason, on its simulated clock: a latency per task, plus
+--transition-ms per state entered (40 assumed for STANDARD, 10 for EXPRESS). Time to
+alert is when the SNS publish of the alert finishes, from the start of the execution.
+Scenarios: warm functions; a cold start of the store function; the table throttling the
+store function, its writes retried with backoff. Task latencies default to those of
+tools/workflow_cost.py; with --measure they are the p50 of the real handlers over
+--events on moto (tools/harness.py). Transitions are what STANDARD bills per execution.
+"""
+import argparse
+import logging
+import time
+
+from tools import asl, harness, workflow_cost
+from tools.events import generate, sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+
+add_layers_to_path()
+from login.rules import load_rules  # noqa: E402
+
+# extra milliseconds of the store step
+SCENARIOS = {'warm': 0, 'cold store': 900, 'throttled store': 1500}
+REASONS = {
+    'RootActivity': ({'identity_type': 'Root'}, None),
+    'NoMFAUsed': ({'mfa': False}, None),
+    'ManyFailedSignInAttempt': ({'success': False}, None),
+    'ImpossibleTravel': ({}, {'newSourceIp': False, 'impossibleTravel': True}),
+    'NewSourceIP': ({}, {'newSourceIp': True, 'impossibleTravel': False})
+}
+
+
+def measured_stage_ms(definition: dict, events: int) -> dict:
+    # p50 per stage of the real handlers, one container each
+    with harness.Harness(definition) as run:
+        stages = run.run(list(generate(events, int(time.time()) - 3600, seed=13)))['stages']
+    return {stage: stages[stage]['p50_ms'] for stage in ('store', 'count', 'coalesce', 'publish')}
+
+
+def time_to_alert(definition: dict, reason: str, stage_ms: dict, store_extra_ms: float, transition_ms: float) -> tuple:
+    # (ms until the alert of `reason` is published, transitions)
+    machine = asl.StateMachine(definition)
+    event_kwargs, profile = REASONS[reason]
+    event = sign_in_event(int(time.time()), **event_kwargs)
+    build_item = load_handler('store-sign-in-activity').build_item
+
+    def store(payload):
+        item = build_item(payload['event'])
+        return {**item, 'profile': profile} if profile else item
+
+    durations, handlers = {}, {'Store activity': store}
+    for name, state in asl.states(definition):
+        stage = harness.stage_of(name, state)
+        if stage:
+            durations[name] = stage_ms[stage] + (store_extra_ms if stage == 'store' else 0)
+        if name.startswith('Count'):
+            handlers[name] = lambda payload: {**payload, 'failedAttempts': 3}
+        elif name.startswith('Coalesce'):
+            handlers[name] = lambda payload: {'first': True, 'count': 1, 'envelope': {}}
+    execution = machine.run(event, handlers=handlers, durations=durations, transition_ms=transition_ms)
+    title = next(rule['title'] for rule in load_rules() if rule['reason'] == reason)
+    return execution.finished(f'Alert on {title}'), execution.transitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transition-ms', type=float, default=workflow_cost.DEFAULT_TRANSITION_MS['STANDARD'])
+    parser.add_argument('--measure', action='store_true', help='task latencies of the handlers on moto')
+    parser.add_argument('--events', type=int, default=300)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    graphs = {graph: workflow_cost.synth_definition(parallel_alerts=graph == 'parallel') for graph in ('sequential', 'parallel')}
+    task_ms = workflow_cost.DEFAULT_TASK_MS
+    stage_ms = {'store': task_ms['lambda'], 'count': task_ms['lambda'], 'coalesce': task_ms['lambda'], 'publish': task_ms['sns']}
+    if args.measure:
+        stage_ms = measured_stage_ms(graphs['parallel'], args.events)
+
+    print('task ms: ' + ', '.join(f'{stage} {ms:.1f}' for stage, ms in stage_ms.items()) +
+          f', {args.transition_ms:.0f} ms per transition' + (' (measured on moto)' if args.measure else ''))
+    print(f'{"reason":<24} {"scenario":<16} {"sequential ms":>13} {"parallel ms":>11} {"saved ms":>8} {"transitions":>11}')
+    # ImpossibleTravel only with an IP database that locates countries, see rules.json
+    deployed = {rule['reason'] for rule in load_rules()}
+    for reason in (reason for reason in REASONS if reason in deployed):
+        for scenario, store_extra_ms in SCENARIOS.items():
+            (sequential, sequential_transitions), (parallel, parallel_transitions) = [
+                time_to_alert(graphs[graph], reason, stage_ms, store_extra_ms, args.transition_ms)
+                for graph in ('sequential', 'parallel')
+            ]
+            print(f'{reason:<24} {scenario:<16} {sequential:>13.0f} {parallel:>11.0f} {sequential - parallel:>8.0f} '
+                  f'{f"{sequential_transitions} -> {parallel_transitions}":>11}')
+
+
+if __name__ == '__main__':
+    main()
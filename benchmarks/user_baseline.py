@@ -0,0 +1,137 @@
+"""User baseline: accuracy and latency of the profile item vs querying the whole history.
+
+    python -m benchmarks.user_baseline [--sizes 10 100 1000 10000] [--repeat 20]
+
+A synthetic history of sign-ins per size is drawn from a pool of source IPs (a quarter
+of the sign-ins, most from a few addresses) and user agents. Accuracy: the share of
+unseen IPs the Bloom filters wrongly know (missed new IPs), the share of the last 100
+IPs wrongly reported new after filter rotations, and the error of the HyperLogLog
+distinct IP count. Latency is measured against moto: the profile read and write of one
+sign-in, vs the UserIdentityIndex query a sign-in would need to know the IPs of the
+user without a profile. Units are estimated with tools/capacity.py.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from moto import mock_aws
+
+from tools import capacity
+from tools.lambdas import add_layers_to_path
+from tools.local_aws import create_activity_table
+
+add_layers_to_path()
+from activity_common import baseline, item_format  # noqa: E402
+
+USER = 'IAMUser#alice'
+AGENTS = [f'Mozilla/5.0 agent-{i}' for i in range(5)]
+PROBES = 2000
+
+
+def history(size: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    pool = [f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}' for i in range(max(5, size // 4))]
+    start = int(time.time()) - size * 600
+    # a few addresses sign in most of the time
+    return [(pool[min(int(rng.paretovariate(1.2)) - 1, len(pool) - 1) if rng.random() < 0.5 else rng.randrange(len(pool))],
+             rng.choice(AGENTS), start + i * 600) for i in range(size)]
+
+
+def accuracy(sign_ins: list) -> dict:
+    profile = baseline.Profile(USER)
+    start = time.perf_counter()
+    for ip, agent, timestamp in sign_ins:
+        profile.observe(ip, agent, timestamp)
+    observe_us = (time.perf_counter() - start) / len(sign_ins) * 1e6
+
+    unseen = [f'172.16.{i // 256}.{i % 256}' for i in range(PROBES)]
+    missed = sum(profile._known(f'ip:{ip}') for ip in unseen) / PROBES
+    recent = list(dict.fromkeys(ip for ip, _, _ in reversed(sign_ins)))[:100]
+    forgotten = sum(not profile._known(f'ip:{ip}') for ip in recent) / len(recent)
+    distinct = len({ip for ip, _, _ in sign_ins})
+    return {
+        'profile': profile,
+        'observe_us': observe_us,
+        'missed': missed,
+        'forgotten': forgotten,
+        'distinct': distinct,
+        'hll_error': abs(profile.ips.count() - distinct) / distinct
+    }
+
+
+def timed(function, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def latency(sign_ins: list, profile, repeat: int) -> dict:
+    with mock_aws():
+        table = create_activity_table(boto3.resource('dynamodb'), table_name=f'bench-{len(sign_ins)}')
+        baseline.save(table, profile)
+        items = []
+        with table.batch_writer() as batch:
+            for i, (ip, agent, timestamp) in enumerate(sign_ins):
+                item = {'id': f'event-{i}', 'timestamp': timestamp, 'userIdentity': USER, 'eventName': 'ConsoleLogin',
+                        'sourceIPAddress': ip, 'userAgent': agent}
+                items.append(item)
+                batch.put_item(Item=item)
+
+        ip, agent, timestamp = sign_ins[-1]
+        sign_in = {'ip': '198.51.100.1', 'userAgent': agent, 'timestamp': timestamp + 60}
+        profile_ms = timed(lambda: baseline.update(table, USER, [sign_in]), repeat)
+
+        def query_history():
+            query = {
+                'IndexName': 'UserIdentityIndex',
+                'KeyConditionExpression': Key('userIdentity').eq(USER),
+                'ProjectionExpression': 'sourceIPAddress, userAgent'
+            }
+            seen = set()
+            while True:
+                response = table.query(**query)
+                seen.update(item['sourceIPAddress'] for item in response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    return seen
+                query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        query_ms = timed(query_history, max(1, repeat // 4))
+
+    index_attributes = ('id', 'timestamp', 'userIdentity') + item_format.HOT_ATTRIBUTES
+    profile_size = capacity.item_size(profile.item())
+    return {
+        'profile_ms': profile_ms,
+        'query_ms': query_ms,
+        'profile_bytes': profile_size,
+        'profile_rcu': capacity.read_units(profile_size, consistent=True),
+        'profile_wcu': capacity.write_units(profile.item()),
+        'query_rcu': capacity.read_units(sum(capacity.item_size(capacity.project(item, index_attributes)) for item in items))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    print(f'{"sign-ins":>8} {"IPs":>6} {"missed new":>10} {"forgotten":>9} {"HLL err":>7} {"observe us":>10} '
+          f'{"bytes":>6} {"profile ms":>10} {"RCU+WCU":>8} {"query ms":>9} {"query RCU":>9}')
+    for size in args.sizes:
+        sign_ins = history(size)
+        a = accuracy(sign_ins)
+        r = latency(sign_ins, a['profile'], args.repeat)
+        print(f'{size:>8} {a["distinct"]:>6} {a["missed"]:>10.2%} {a["forgotten"]:>9.2%} {a["hll_error"]:>7.1%} '
+              f'{a["observe_us"]:>10.1f} {r["profile_bytes"]:>6} {r["profile_ms"]:>10.2f} '
+              f'{r["profile_rcu"] + r["profile_wcu"]:>8.1f} {r["query_ms"]:>9.1f} {r["query_rcu"]:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
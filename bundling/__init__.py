@@ -0,0 +1 @@
+from .infra import dependencies_layer, layers
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import aws_cdk as cdk
+import jsii
+from aws_cdk import aws_lambda as lambda_
+from constructs import Construct
+
+
+# Dependencies of every function (the union of their requirements.txt) are bundled once
+# into a shared layer, on the machine running `cdk synth` instead of in Docker. Wheels
+# come from a local cache, filled from PyPI only with what it misses, and the bundled
+# layer is kept in the cache under a hash of the requirements and target platform, so
+# an unchanged layer is copied instead of installed again. Docker only runs if pip is
+# unusable here.
+PYTHON_VERSION = '3.9'
+PLATFORM = 'manylinux2014_x86_64'
+RUNTIME = lambda_.Runtime.PYTHON_3_9
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'lambda-functions')
+COMMON_LAYER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'lambda-layers', 'activity-common')
+CACHE_DIR = os.getenv('BUNDLING_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'aws-activity-tracking'))
+
+
+def requirements(functions_dir: str = FUNCTIONS_DIR) -> list:
+    lines = set()
+    for function in sorted(os.listdir(functions_dir)):
+        path = os.path.join(functions_dir, function, 'requirements.txt')
+        if os.path.isfile(path):
+            with open(path) as file:
+                lines.update(line.split('#', 1)[0].strip() for line in file)
+    return sorted(line for line in lines if line)
+
+
+def dependencies_hash(requirement_lines: list) -> str:
+    digest = hashlib.sha256()
+    for part in [PLATFORM, PYTHON_VERSION] + requirement_lines:
+        digest.update(part.encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
+
+def install(requirement_lines: list, output_dir: str, cache_dir: str = CACHE_DIR) -> str:
+    # copies the bundled dependencies into `output_dir`/python, installing them into the
+    # cache first if needed. Returns 'cached' or 'installed'
+    bundle = os.path.join(cache_dir, 'layers', dependencies_hash(requirement_lines))
+    state = 'cached'
+    if not os.path.isdir(bundle):
+        state = 'installed'
+        wheels = os.path.join(cache_dir, 'wheels')
+        os.makedirs(wheels, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=os.path.dirname(wheels))
+        try:
+            requirements_file = os.path.join(staging, 'requirements.txt')
+            with open(requirements_file, 'w') as file:
+                file.write(''.join(f'{line}\n' for line in requirement_lines))
+            pip = [sys.executable, '-m', 'pip', '--disable-pip-version-check', '--quiet']
+            # Lambda wheels whatever the platform of this machine
+            target = ['--platform', PLATFORM, '--python-version', PYTHON_VERSION, '--implementation', 'cp',
+                      '--only-binary=:all:', '-r', requirements_file]
+            install_command = pip + ['install', '--no-index', '--no-warn-conflicts', '--find-links', wheels,
+                                     '--target', os.path.join(staging, 'python')] + target
+            environment = {**os.environ, 'PIP_ROOT_USER_ACTION': 'ignore'}
+            if requirement_lines and subprocess.run(install_command, env=environment, stdout=subprocess.DEVNULL,
+                                                    stderr=subprocess.DEVNULL).returncode:
+                # offline first, then download what the wheel cache misses
+                subprocess.run(pip + ['download', '--dest', wheels] + target, env=environment, check=True)
+                subprocess.run(install_command, env=environment, check=True)
+            os.makedirs(os.path.join(staging, 'python'), exist_ok=True)
+            os.remove(requirements_file)
+            os.makedirs(os.path.dirname(bundle), exist_ok=True)
+            try:
+                os.rename(staging, bundle)
+            except OSError:
+                # bundled concurrently by another synth, theirs is used
+                pass
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+    shutil.copytree(bundle, output_dir, dirs_exist_ok=True)
+    return state
+
+
+@jsii.implements(cdk.ILocalBundling)
+class LocalDependencies:
+    def __init__(self, requirement_lines: list, cache_dir: str = CACHE_DIR):
+        self.requirement_lines = requirement_lines
+        self.cache_dir = cache_dir
+
+    def try_bundle(self, output_dir, *args, **kwargs) -> bool:
+        try:
+            install(self.requirement_lines, output_dir, self.cache_dir)
+        except (OSError, subprocess.CalledProcessError) as error:
+            print(f'Local bundling failed, falling back to Docker: {error}', file=sys.stderr)
+            return False
+        return True
+
+
+def dependencies_layer(scope: Construct, id: str, **kwargs) -> lambda_.LayerVersion:
+    requirement_lines = requirements()
+    return lambda_.LayerVersion(scope, id,
+        description='Third-party dependencies of AWS activity functions',
+        code=lambda_.Code.from_asset(
+            path=FUNCTIONS_DIR,
+            # known before bundling: an asset already staged under this hash is reused
+            asset_hash_type=cdk.AssetHashType.CUSTOM,
+            asset_hash=dependencies_hash(requirement_lines),
+            bundling=cdk.BundlingOptions(
+                image=RUNTIME.bundling_image,
+                command=['bash', '-c', 'cat */requirements.txt | sort -u > /tmp/requirements.txt && '
+                                       'pip install -r /tmp/requirements.txt -t /asset-output/python'],
+                local=LocalDependencies(requirement_lines)
+            )
+        ),
+        compatible_runtimes=[RUNTIME],
+        **kwargs
+    )
+
+
+def layers(scope: Construct, name: str, dependencies: bool = True) -> list:
+    # the layers of the functions of a stack: the code shared by AWS activity functions
+    # and, unless the functions only need the runtime's boto3, their third-party dependencies
+    function_layers = [lambda_.LayerVersion(scope, 'CommonLayer',
+        layer_version_name=f'{name}-common',
+        description='Code shared by AWS activity functions',
+        code=lambda_.Code.from_asset(path=COMMON_LAYER_DIR),
+        compatible_runtimes=[RUNTIME]
+    )]
+    if dependencies:
+        function_layers.append(dependencies_layer(scope, 'DependenciesLayer', layer_version_name=f'{name}-dependencies'))
+    return function_layers
@@ -6,7 +6,7 @@ from constructs import Construct
 
 
 class AwsActivityDatabaseStack(Stack):
-    def __init__(self, scope: Construct, id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, id: str, stream: bool = False, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
         # dynamodb
@@ -15,14 +15,19 @@ class AwsActivityDatabaseStack(Stack):
             partition_key=dynamodb.Attribute(name='id', type=dynamodb.AttributeType.STRING),
             sort_key=dynamodb.Attribute(name='timestamp', type=dynamodb.AttributeType.NUMBER),
             time_to_live_attribute='ttl',
-            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            # changes are streamed to the archive and rollup functions, see archive/infra.py and
+            # rollups/infra.py. Rollups need the removed items
+            stream=dynamodb.StreamViewType.NEW_AND_OLD_IMAGES if stream else None
         )
 
         # DynamoDB GSI
+        # only the hot scalars of the compact item format are projected, not the compressed
+        # raw event (activity_common.item_format.HOT_ATTRIBUTES)
         self.table.add_global_secondary_index(
             index_name='UserIdentityIndex',
             partition_key=dynamodb.Attribute(name='userIdentity', type=dynamodb.AttributeType.STRING),
             sort_key=dynamodb.Attribute(name='timestamp', type=dynamodb.AttributeType.NUMBER),
-            non_key_attributes=['id', 'eventName', 'detail'],
+            non_key_attributes=['eventName', 'identityType', 'userName', 'consoleLogin', 'mfaUsed', 'sourceIPAddress', 'userAgent'],
             projection_type=dynamodb.ProjectionType.INCLUDE
         )
@@ -10,21 +10,29 @@ from aws_cdk import (
     aws_iam as iam,
     aws_events as events,
     aws_events_targets as events_targets,
-    aws_sns as sns
+    aws_lambda_event_sources as event_sources,
+    aws_sns as sns,
+    aws_sqs as sqs,
+    aws_cloudwatch as cloudwatch
 )
 from constructs import Construct
 
+from bundling import layers
+from .rules import compile_rules, is_stateless, load_rules
+
 
 class AwsSignInActivityStack(Stack):
-    def __init__(self, scope: Construct, id: str, dynamodb_table: dynamodb.ITable, notification_topic: sns.ITopic, **kwargs) -> None:
+    def __init__(self, scope: Construct, id: str, dynamodb_table: dynamodb.ITable, notification_topic: sns.ITopic,
+                 buffered: bool = False, buffer_batch_size: int = 100, buffer_window: Duration = Duration.seconds(5),
+                 state_machine_type: sfn.StateMachineType = sfn.StateMachineType.STANDARD,
+                 alert_window: Duration = Duration.minutes(15), write_shards: int = 1,
+                 write_shard_threshold: int = 600, activity_ttl: Duration = Duration.days(365),
+                 parallel_alerts: bool = True, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
-        # Cloudwatch log
-        log_group = logs.LogGroup(self, 'CloudWatchLogGroup',
-            log_group_name='aws-sign-in-activity',
-            retention=logs.RetentionDays.ONE_MONTH,
-            removal_policy=RemovalPolicy.DESTROY
-        )
+        # the digest of a window is scheduled with SQS DelaySeconds, at most 15 minutes
+        if not 0 < alert_window.to_seconds() <= 15 * 60:
+            raise ValueError('alert_window must be between 1 second and 15 minutes')
 
         # IAM role
         role = iam.Role(self, 'Role',
@@ -49,7 +57,7 @@ class AwsSignInActivityStack(Stack):
                 'DynamoDBWrite': iam.PolicyDocument(statements=[
                     iam.PolicyStatement(
                         effect=iam.Effect.ALLOW,
-                        actions=['dynamodb:BatchWriteItem', 'dynamodb:PutItem', 'dynamodb:UpdateItem'],
+                        actions=['dynamodb:BatchWriteItem', 'dynamodb:PutItem', 'dynamodb:UpdateItem', 'dynamodb:DeleteItem'],
                         resources=[dynamodb_table.table_arn]
                     )
                 ]),
@@ -63,30 +71,78 @@ class AwsSignInActivityStack(Stack):
             }
         )
 
-        # Step function
-        store_job = tasks.LambdaInvoke(self, 'Store activity',
-            lambda_function=lambda_.Function(self, 'StoreActivityFunction',
-                function_name='store-aws-sign-in-activity',
-                handler='index.handler',
-                runtime=lambda_.Runtime.PYTHON_3_9,
-                description='Store AWS sign-in activities into DynamoDB',
-                code=lambda_.Code.from_asset(
-                    path='assets/lambda-functions/store-sign-in-activity'
-                ),
-                environment={
-                    'DYNAMODB_TABLE_NAME': dynamodb_table.table_name
-                },
-                timeout=Duration.seconds(15),
-                memory_size=128,
-                role=role
+        # Lambda layers shared by the functions below, the third-party requirements are
+        # bundled locally (see bundling/infra.py)
+        function_layers = layers(self, 'aws-activity')
+
+        # alert coalescing: the first alert per (user, reason, window) is published, repeats
+        # are counted and summarized in one digest when the window closes
+        digest_queue = sqs.Queue(self, 'AlertDigestQueue',
+            queue_name='aws-sign-in-activity-alert-digest',
+            visibility_timeout=Duration.minutes(1)
+        )
+        digest_queue.grant_send_messages(role)
+        notification_topic.grant_publish(role)
+
+        coalesce_function = lambda_.Function(self, 'CoalesceAlertFunction',
+            function_name='coalesce-aws-sign-in-alert',
+            handler='index.handler',
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            description='Coalesce repeated AWS sign-in alerts into digests',
+            code=lambda_.Code.from_asset(
+                path='assets/lambda-functions/coalesce-alert'
             ),
-            output_path='$.Payload'
+            environment={
+                'DYNAMODB_TABLE_NAME': dynamodb_table.table_name,
+                'SNS_TOPIC_ARN': notification_topic.topic_arn,
+                'DIGEST_QUEUE_URL': digest_queue.queue_url,
+                'ALERT_WINDOW_SECONDS': str(int(alert_window.to_seconds())),
+                'LOG_LEVEL': 'INFO'
+            },
+            timeout=Duration.seconds(15),
+            memory_size=128,
+            role=role,
+            layers=function_layers
         )
+        coalesce_function.add_event_source(event_sources.SqsEventSource(digest_queue,
+            batch_size=10,
+            report_batch_item_failures=True
+        ))
 
-        succeed_job = sfn.Succeed(self, 'Do nothing')
+        store_function = lambda_.Function(self, 'StoreActivityFunction',
+            function_name='store-aws-sign-in-activity',
+            handler='index.handler',
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            description='Store AWS sign-in activities into DynamoDB',
+            code=lambda_.Code.from_asset(
+                path='assets/lambda-functions/store-sign-in-activity'
+            ),
+            environment={
+                'DYNAMODB_TABLE_NAME': dynamodb_table.table_name,
+                'SNS_TOPIC_ARN': notification_topic.topic_arn,
+                'DIGEST_QUEUE_URL': digest_queue.queue_url,
+                'ALERT_WINDOW_SECONDS': str(int(alert_window.to_seconds())),
+                # users over the threshold of failed sign-ins per minute are spread over
+                # `write_shards` UserIdentityIndex keys, 1 turns sharding off
+                'WRITE_SHARDS': str(write_shards),
+                'WRITE_SHARD_THRESHOLD': str(write_shard_threshold),
+                # days an activity stays in the table, fewer when it is archived (archive/infra.py)
+                'ACTIVITY_TTL_DAYS': str(int(activity_ttl.to_days())),
+                'LOG_LEVEL': 'INFO',
+                # 1% of the invocations log whole events at DEBUG
+                'LOG_SAMPLE_RATE': '0.01'
+            },
+            # a whole SQS batch is written and alerted on in buffered mode
+            timeout=Duration.seconds(60 if buffered else 15),
+            memory_size=128,
+            role=role,
+            layers=function_layers
+        )
 
-        count_failed_sign_in_job = tasks.LambdaInvoke(self, 'Count failed sign-in attempt',
-            lambda_function=lambda_.Function(self, 'CountFailedSignInFunction',
+        # functions adding the metric a rule threshold is evaluated on, the buffered store
+        # function counts failed sign-ins itself
+        metric_functions = {} if buffered else {
+            'failedAttempts': lambda_.Function(self, 'CountFailedSignInFunction',
                 function_name='count-failed-sign-in-attempt',
                 handler='index.handler',
                 runtime=lambda_.Runtime.PYTHON_3_9,
@@ -95,97 +151,268 @@ class AwsSignInActivityStack(Stack):
                     path='assets/lambda-functions/count-failed-sign-in-attempt'
                 ),
                 environment={
-                    'DYNAMODB_TABLE_NAME': dynamodb_table.table_name
+                    'DYNAMODB_TABLE_NAME': dynamodb_table.table_name,
+                    'LOG_LEVEL': 'INFO',
+                    'LOG_SAMPLE_RATE': '0.01'
                 },
-                timeout=Duration.minutes(3),
+                timeout=Duration.seconds(15),
                 memory_size=128,
-                role=role
+                role=role,
+                layers=function_layers
+            )
+        }
+
+        # event bridge
+        if buffered:
+            # buffered mode: events are queued and stored in batches by the store function,
+            # which applies the alerting decision tree to every record itself
+            dead_letter_queue = sqs.Queue(self, 'DeadLetterQueue',
+                queue_name='aws-sign-in-activity-dlq',
+                retention_period=Duration.days(14)
+            )
+            queue = sqs.Queue(self, 'Queue',
+                queue_name='aws-sign-in-activity',
+                # at least 6 times the function timeout, as recommended for SQS event sources
+                visibility_timeout=Duration.minutes(6),
+                dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=dead_letter_queue)
+            )
+            store_function.add_event_source(event_sources.SqsEventSource(queue,
+                batch_size=buffer_batch_size,
+                max_batching_window=buffer_window,
+                report_batch_item_failures=True
+            ))
+            target = events_targets.SqsQueue(queue=queue, retry_attempts=3)
+        else:
+            target = events_targets.SfnStateMachine(
+                machine=self._state_machine(store_function, coalesce_function, metric_functions, notification_topic,
+                                            state_machine_type, parallel_alerts),
+                retry_attempts=3
+            )
+
+        # hot-path metrics written by the functions as EMF, see activity_common/instrumentation.py
+        def metric(function: lambda_.IFunction, name: str, statistic: str = 'Sum'):
+            return cloudwatch.Metric(
+                namespace='AwsActivityTracking',
+                metric_name=name,
+                dimensions_map={'FunctionName': function.function_name},
+                statistic=statistic,
+                period=Duration.minutes(5)
+            )
+
+        # no count function in buffered mode
+        count_function = metric_functions.get('failedAttempts')
+        functions = [function for function in (store_function, count_function, coalesce_function) if function]
+        cloudwatch.Dashboard(self, 'Dashboard',
+            dashboard_name='aws-sign-in-activity',
+            widgets=[
+                [
+                    cloudwatch.GraphWidget(
+                        title='Store phases p99 (ms)',
+                        left=[metric(store_function, f'{phase}Duration', 'p99')
+                              for phase in ('Build', 'Store', 'CountFailure', 'Profile', 'Alerting', 'Invocation')],
+                        width=12
+                    )
+                ] + ([
+                    cloudwatch.GraphWidget(
+                        title='Count failed sign-ins p99 (ms) and query pages',
+                        left=[metric(count_function, 'CountFailuresDuration', 'p99'), metric(count_function, 'InvocationDuration', 'p99')],
+                        right=[metric(count_function, 'QueryPages')],
+                        width=12
+                    )
+                ] if count_function else []),
+                [
+                    cloudwatch.GraphWidget(
+                        title='DynamoDB consumed capacity units',
+                        left=[metric(function, name) for function in functions
+                              for name in ('ReadCapacityUnits', 'WriteCapacityUnits')],
+                        width=12
+                    ),
+                    cloudwatch.GraphWidget(
+                        title='Activities, duplicates, batch write retries and dateutil fallbacks',
+                        left=[metric(store_function, 'Activities'), metric(store_function, 'Duplicates')],
+                        right=[metric(store_function, 'BatchWriteRetries'), metric(store_function, 'TimestampFallbacks')],
+                        width=12
+                    )
+                ],
+                [
+                    cloudwatch.GraphWidget(
+                        title='Coalesce alerts and digests p99 (ms)',
+                        left=[metric(coalesce_function, f'{phase}Duration', 'p99') for phase in ('Coalesce', 'BuildDigest', 'Invocation')],
+                        width=12
+                    )
+                ]
+            ]
+        )
+        cloudwatch.Alarm(self, 'StoreLatencyAlarm',
+            alarm_name='aws-sign-in-activity-store-latency',
+            alarm_description='p99 of store-sign-in-activity over 1 second',
+            metric=metric(store_function, 'InvocationDuration', 'p99'),
+            threshold=1000,
+            evaluation_periods=3,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+        )
+        cloudwatch.Alarm(self, 'StoreThrottlingAlarm',
+            alarm_name='aws-sign-in-activity-store-throttling',
+            alarm_description='Batch writes retried, the table or UserIdentityIndex throttles',
+            metric=metric(store_function, 'BatchWriteRetries'),
+            threshold=10,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+        )
+        if count_function:
+            cloudwatch.Alarm(self, 'CountLatencyAlarm',
+                alarm_name='aws-sign-in-activity-count-latency',
+                alarm_description='p99 of count-failed-sign-in-attempt over 1 second',
+                metric=metric(count_function, 'InvocationDuration', 'p99'),
+                threshold=1000,
+                evaluation_periods=3,
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+            )
+
+        events.Rule(self, 'EventBridgeRule',
+            rule_name='aws-sign-in-activity',
+            description='Rule of AWS sign-in activities',
+            event_pattern=events.EventPattern(
+                detail_type=[
+                    'AWS API Call via CloudTrail',
+                    'AWS Console Sign In via CloudTrail'
+                ],
+                source=['aws.signin']
             ),
-            output_path='$.Payload'
-        ).next(
-            sfn.Choice(self, 'More than 2 attempts?').when(
-                condition=sfn.Condition.number_greater_than('$.failedAttempts', 2),
-                next=tasks.SnsPublish(self, 'Alert on many failed sign-in attempts',
-                    topic=notification_topic,
-                    message=sfn.TaskInput.from_json_path_at('$'),
-                    message_attributes={
-                        'severity': tasks.MessageAttribute(value='High'),
-                        'reason': tasks.MessageAttribute(value='ManyFailedSignInAttempt'),
-                        'targets': tasks.MessageAttribute(value=['Slack']),
-                        'channel': tasks.MessageAttribute(value='alarm-aws')
-                    }
-                )
-            ).otherwise(succeed_job)
+            targets=[target]
         )
 
-        check_mfa = sfn.Choice(self, 'MFA used?').when(
-            condition=sfn.Condition.string_equals('$.detail.additionalEventData.MFAUsed', 'Yes'),
-            next=succeed_job
-        ).otherwise(
-            tasks.SnsPublish(self, 'Alert on no MFA',
-                topic=notification_topic,
-                message=sfn.TaskInput.from_json_path_at('$'),
-                message_attributes={
-                    'severity': tasks.MessageAttribute(value='Medium'),
-                    'reason': tasks.MessageAttribute(value='NoMFAUsed'),
-                    'targets': tasks.MessageAttribute(value=['Slack']),
-                    'channel': tasks.MessageAttribute(value='alarm-aws')
-                }
-            )
+    def _state_machine(self, store_function: lambda_.IFunction, coalesce_function: lambda_.IFunction,
+                       metric_functions: dict, notification_topic: sns.ITopic,
+                       state_machine_type: sfn.StateMachineType, parallel_alerts: bool) -> sfn.StateMachine:
+        # the Step Functions graph of the alert rules. Not deployed in buffered mode, where
+        # the store function applies them to every record of a batch itself
+        # Cloudwatch log of the executions
+        log_group = logs.LogGroup(self, 'CloudWatchLogGroup',
+            log_group_name='aws-sign-in-activity',
+            retention=logs.RetentionDays.ONE_MONTH,
+            removal_policy=RemovalPolicy.DESTROY
         )
 
-        check_login = sfn.Choice(self, 'Login failed?').when(
-            condition=sfn.Condition.string_equals('$.detail.responseElements.ConsoleLogin', 'Failure'),
-            next=count_failed_sign_in_job
-        ).otherwise(check_mfa)
+        # a retry of the task in the same execution resumes instead of being a duplicate,
+        # e.g. from the failure count after a failed counter update, see store-sign-in-activity
+        store_job = tasks.LambdaInvoke(self, 'Store activity',
+            lambda_function=store_function,
+            payload=sfn.TaskInput.from_object({
+                'event': sfn.JsonPath.entire_payload,
+                'executionId': sfn.JsonPath.string_at('$$.Execution.Id')
+            }),
+            output_path='$.Payload'
+        ).add_retry(errors=['States.TaskFailed'], max_attempts=2)
+
+        succeed_job = sfn.Succeed(self, 'Do nothing')
 
-        sign_in_activity = sfn.Choice(self, 'Sign-in activity?').when(
-            sfn.Condition.string_equals('$.eventName', 'ConsoleLogin'),
-            next=check_login
-        ).otherwise(succeed_job)
+        def catch(task, failed):
+            # in the parallel graph a failed task ends its branch in `failed` instead of
+            # cancelling the other branch, see below
+            return task.add_catch(failed, result_path='$.error') if failed else task
 
-        check_root_user = sfn.Choice(self, 'Root user?').when(
-            condition=sfn.Condition.string_equals('$.detail.userIdentity.type', 'Root'), 
-            next=tasks.SnsPublish(self, 'Alert on Root activity',
+        def alert_on(rule: dict, failed: sfn.IChainable = None, on_event: bool = False, done: sfn.IChainable = succeed_job):
+            title = rule['title']
+            # `$` is the slim envelope store-sign-in-activity returns, not the whole event.
+            # Alerting on the event, the coalesce function builds the envelope
+            publish = catch(tasks.SnsPublish(self, f'Alert on {title}',
                 topic=notification_topic,
-                message=sfn.TaskInput.from_json_path_at('$'),
+                message=sfn.TaskInput.from_json_path_at('$.alert.envelope' if on_event else '$'),
                 message_attributes={
-                    'severity': tasks.MessageAttribute(value='Critical'),
-                    'reason': tasks.MessageAttribute(value='RootActivity'),
-                    'targets': tasks.MessageAttribute(value=['Slack']),
-                    'channel': tasks.MessageAttribute(value='alarm-aws')
+                    'severity': tasks.MessageAttribute(value=rule['severity']),
+                    'reason': tasks.MessageAttribute(value=rule['reason']),
+                    'targets': tasks.MessageAttribute(value=rule['targets']),
+                    'channel': tasks.MessageAttribute(value=rule['channel'])
                 }
+            # the retry of the first alert of a window is still the first, see activity_common/coalescing.py
+            ).add_retry(max_attempts=3), failed)
+            result_selector = {'first.$': '$.Payload.first', 'count.$': '$.Payload.count'}
+            if on_event:
+                result_selector['envelope.$'] = '$.Payload.envelope'
+            return catch(tasks.LambdaInvoke(self, f'Coalesce {title} alert',
+                lambda_function=coalesce_function,
+                payload=sfn.TaskInput.from_object({
+                    'event': sfn.JsonPath.entire_payload,
+                    'reason': rule['reason']
+                }),
+                result_selector=result_selector,
+                result_path='$.alert'
+            ).add_retry(errors=['States.TaskFailed'], max_attempts=2), failed).next(
+                sfn.Choice(self, f'First {title} alert in window?').when(
+                    condition=sfn.Condition.boolean_equals('$.alert.first', True),
+                    next=publish
+                ).otherwise(done)
             )
-        ).when(
-            sfn.Condition.string_equals('$.detail.userIdentity.type', 'IAMUser'), 
-            sign_in_activity
-        )
 
-        definition = store_job.next(check_root_user)
+        def measure(rule: dict, failed: sfn.IChainable = None):
+            return catch(tasks.LambdaInvoke(self, f'Count {rule["title"]}',
+                lambda_function=metric_functions[rule['threshold']['metric']],
+                output_path='$.Payload'
+            ), failed)
+
+        def unless_duplicate(check_rules: sfn.IChainable):
+            # retried and duplicated deliveries of a stored event stop here, see activity_common/idempotency.py
+            return sfn.Choice(self, 'Duplicate event?').when(
+                condition=sfn.Condition.and_(
+                    sfn.Condition.is_present('$.duplicate'),
+                    sfn.Condition.boolean_equals('$.duplicate', True)
+                ),
+                next=succeed_job
+            ).otherwise(check_rules)
+
+        # the alert rules are data shared with the in-process evaluator of the common layer
+        rules = load_rules()
+        if not parallel_alerts:
+            definition = store_job.next(unless_duplicate(compile_rules(self, rules, alert_on, measure, succeed_job)))
+        else:
+            # stateless rules (Root activity, no MFA) read nothing the store step adds: they
+            # are decided on the event and alerted on while it is being stored. The rules on
+            # stored data wait for the write, the failure count reads the counter the store
+            # step has written strongly consistent (activity_common/failure_counter.py)
+            event_failed = sfn.Pass(self, 'Alerting on the event failed')
+            no_event_alert = sfn.Succeed(self, 'No alert on the event')
+            on_event = sfn.Pass(self, 'Name event',
+                input_path='$.detail.eventName',
+                result_path='$.eventName'
+            ).next(compile_rules(self, [rule for rule in rules if is_stateless(rule)],
+                lambda rule: alert_on(rule, event_failed, on_event=True, done=no_event_alert),
+                measure, no_event_alert, prefix='Event rule '
+            ))
+
+            # a matching stateless rule ends the rules on stored data as it ends the sequential
+            # chain, its alert is that of the other branch (activity_common/rules.py)
+            stored_failed = sfn.Pass(self, 'Storing or alerting failed')
+            alerted_on_event = sfn.Succeed(self, 'Alerted on the event')
+            on_stored = catch(store_job, stored_failed).next(unless_duplicate(compile_rules(self, rules,
+                lambda rule: alerted_on_event if is_stateless(rule) else alert_on(rule, stored_failed),
+                lambda rule: measure(rule, stored_failed), succeed_job
+            )))
 
-        state_machine = sfn.StateMachine(self, 'StepFunction',
+            # the branches only fail into `$.error`, the execution fails once both are done
+            definition = sfn.Parallel(self, 'Store and alert',
+                result_selector={'event.$': '$[0]', 'stored.$': '$[1]'}
+            ).branch(on_event).branch(on_stored).next(
+                sfn.Choice(self, 'Branch failed?').when(
+                    condition=sfn.Condition.or_(
+                        sfn.Condition.is_present('$.event.error'),
+                        sfn.Condition.is_present('$.stored.error')
+                    ),
+                    next=sfn.Fail(self, 'Failed', error='BranchFailed', cause='A branch of Store and alert failed')
+                ).otherwise(sfn.Succeed(self, 'Done'))
+            )
+
+        # the same definition, logging and task retries deploy as either type: STANDARD is billed
+        # per state transition, EXPRESS per request and duration (see tools/workflow_cost.py)
+        return sfn.StateMachine(self, 'StepFunction',
             state_machine_name='aws-sign-in-activity',
-            state_machine_type=sfn.StateMachineType.STANDARD,
+            state_machine_type=state_machine_type,
             definition=definition,
             logs=sfn.LogOptions(
                 destination=log_group,
                 level=sfn.LogLevel.ERROR
             )
         )
-
-        # event bridge
-        events.Rule(self, 'EventBridgeRule',
-            rule_name='aws-sign-in-activity',
-            description='Rule of AWS sign-in activities',
-            event_pattern=events.EventPattern(
-                detail_type=[
-                    'AWS API Call via CloudTrail',
-                    'AWS Console Sign In via CloudTrail'
-                ],
-                source=['aws.signin']
-            ),
-            targets=[events_targets.SfnStateMachine(
-                machine=state_machine,
-                retry_attempts=3
-            )]
-        )
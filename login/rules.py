@@ -0,0 +1,58 @@
+from aws_cdk import aws_stepfunctions as sfn
+from constructs import Construct
+
+# the rules, their operators and is_stateless() are those of the common layer, which the
+# in-process evaluator uses (activity_common/rules.py documents the format). The layers are
+# importable as in Lambda, see tools.lambdas.add_layers_to_path()
+from activity_common.rules import RULES_FILE, is_stateless, load as load_rules, operator_of  # noqa: F401
+
+# compiles the alert rules into a chain of Choice states, one per rule in evaluation order
+
+
+def _equals(path: str, value) -> sfn.Condition:
+    if isinstance(value, bool):
+        return sfn.Condition.boolean_equals(path, value)
+    if isinstance(value, (int, float)):
+        return sfn.Condition.number_equals(path, value)
+    return sfn.Condition.string_equals(path, value)
+
+
+def condition(path: str, spec: dict) -> sfn.Condition:
+    # a missing field never equals and always differs, like the in-process evaluator.
+    # Without the IsPresent guards the execution would fail on it
+    name, value = operator_of(spec)
+    if name == 'equals':
+        return sfn.Condition.and_(sfn.Condition.is_present(path), _equals(path, value))
+    if name == 'notEquals':
+        return sfn.Condition.or_(sfn.Condition.is_not_present(path), sfn.Condition.not_(_equals(path, value)))
+    compare = {
+        'greaterThan': sfn.Condition.number_greater_than,
+        'greaterThanEquals': sfn.Condition.number_greater_than_equals,
+        'lessThan': sfn.Condition.number_less_than,
+        'lessThanEquals': sfn.Condition.number_less_than_equals
+    }[name]
+    return sfn.Condition.and_(sfn.Condition.is_numeric(path), compare(path, value))
+
+
+def compile_rules(scope: Construct, rules: list, alert_on, measure, otherwise: sfn.IChainable,
+                  prefix: str = 'Rule ') -> sfn.IChainable:
+    # alert_on(rule) returns the states alerting on a matched rule, measure(rule) the task
+    # adding the metric of a rule threshold to the input. `prefix` names the Choice states
+    # of the rules, unique per chain. Returns the first state
+    next_state = otherwise
+    for rule in reversed(rules):
+        matched = alert_on(rule)
+        if 'threshold' in rule:
+            threshold = rule['threshold']
+            matched = measure(rule).next(
+                sfn.Choice(scope, f'Over {rule["title"]} threshold?').when(
+                    condition=condition(f'$.{threshold["metric"]}', threshold),
+                    next=matched
+                ).otherwise(next_state)
+            )
+        conditions = [condition(spec['path'], spec) for spec in rule['conditions']]
+        next_state = sfn.Choice(scope, f'{prefix}{rule["title"]}?').when(
+            condition=conditions[0] if len(conditions) == 1 else sfn.Condition.and_(*conditions),
+            next=matched
+        ).otherwise(next_state)
+    return next_state
@@ -1,18 +1,25 @@
 from aws_cdk import (
+    Annotations,
     Duration,
     Stack,
+    aws_dynamodb as dynamodb,
     aws_sns as sns,
     aws_sns_subscriptions as subscriptions,
     aws_lambda as lambda_,
-    aws_lambda_python_alpha as lambda_python,
-    aws_iam as iam
+    aws_iam as iam,
+    aws_cloudwatch as cloudwatch,
+    aws_secretsmanager as secretsmanager
 )
 from constructs import Construct
+import json
 import os
 
+from bundling import layers
+
 
 class AwsActivityNotificationStack(Stack):
-    def __init__(self, scope: Construct, id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, id: str, dynamodb_table: dynamodb.ITable = None,
+                 notification_targets: dict = None, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
         # IAM role
@@ -38,17 +45,113 @@ class AwsActivityNotificationStack(Stack):
             }
         )
 
-        slack_notify_function=lambda_python.PythonFunction(self, 'SlackNotifyFunction',
+        # SNS messages already sent to a target are recorded in the activity table, so a
+        # redelivered message or a retried invocation does not notify it twice. Alerts are
+        # slim envelopes of the stored activity, read when a field to render is missing
+        environment = {}
+        if dynamodb_table is not None:
+            role.add_to_policy(iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=['dynamodb:GetItem', 'dynamodb:PutItem', 'dynamodb:UpdateItem', 'dynamodb:DeleteItem'],
+                resources=[dynamodb_table.table_arn]
+            ))
+            environment['DYNAMODB_TABLE_NAME'] = dynamodb_table.table_name
+
+        # instrumentation shared with the sign-in activity functions, dependencies bundled
+        # locally instead of in Docker (see bundling/infra.py)
+        function_layers = layers(self, 'aws-activity-notification')
+
+        # more targets per channel, {channel: {"slack": [url], "webhook": [url], "email": [address]}},
+        # and the SMTP relay of email targets from the environment of the deployment
+        if notification_targets:
+            environment['NOTIFICATION_TARGETS'] = json.dumps(notification_targets)
+        for name in ('SMTP_HOST', 'SMTP_PORT', 'SMTP_SENDER', 'SMTP_STARTTLS'):
+            if os.environ.get(name):
+                environment[name] = os.environ[name]
+        # the relay's credentials stay out of the template: the function reads them from the
+        # Secrets Manager secret named by SMTP_CREDENTIALS_SECRET, {"username": ..., "password": ...}
+        if os.environ.get('SMTP_CREDENTIALS_SECRET'):
+            secret_id = os.environ['SMTP_CREDENTIALS_SECRET']
+            if secret_id.startswith('arn:'):
+                smtp_secret = secretsmanager.Secret.from_secret_complete_arn(self, 'SmtpCredentials', secret_id)
+            else:
+                smtp_secret = secretsmanager.Secret.from_secret_name_v2(self, 'SmtpCredentials', secret_id)
+            smtp_secret.grant_read(role)
+            environment['SMTP_CREDENTIALS_SECRET'] = secret_id
+        if os.environ.get('SMTP_USERNAME') or os.environ.get('SMTP_PASSWORD'):
+            Annotations.of(self).add_warning('SMTP_USERNAME and SMTP_PASSWORD are not deployed, '
+                                             'store them in a secret named by SMTP_CREDENTIALS_SECRET')
+
+        slack_notify_function=lambda_.Function(self, 'SlackNotifyFunction',
             function_name='aws-activity-slack-notifier',
-            entry='assets/lambda-functions/slack-notification',
+            handler='index.handler',
             runtime=lambda_.Runtime.PYTHON_3_9,
-            description='Notify to Slack for AWS activities',
+            code=lambda_.Code.from_asset(
+                path='assets/lambda-functions/slack-notification'
+            ),
+            description='Notify to Slack, webhooks and email for AWS activities',
             environment={
-                'SLACK_WEBHOOK_ALARM_AWS': os.environ.get('SLACK_WEBHOOK_ALARM_AWS')
+                **environment,
+                'SLACK_WEBHOOK_ALARM_AWS': os.environ.get('SLACK_WEBHOOK_ALARM_AWS'),
+                'LOG_LEVEL': 'INFO',
+                'LOG_SAMPLE_RATE': '0.01'
             },
             timeout=Duration.minutes(2),
             memory_size=128,
-            role=role
+            role=role,
+            layers=function_layers
+        )
+
+        # latency and status per target type written by the function as EMF
+        def metric(name: str, statistic: str = 'Sum'):
+            return cloudwatch.Metric(
+                namespace='AwsActivityTracking',
+                metric_name=name,
+                dimensions_map={'FunctionName': slack_notify_function.function_name},
+                statistic=statistic,
+                period=Duration.minutes(5)
+            )
+
+        cloudwatch.Dashboard(self, 'Dashboard',
+            dashboard_name='aws-activity-notification',
+            widgets=[[
+                cloudwatch.GraphWidget(
+                    title='Target latency p99 (ms)',
+                    left=[metric(f'{label}Duration', 'p99') for label in ('Slack', 'Webhook', 'Email')],
+                    width=8
+                ),
+                cloudwatch.GraphWidget(
+                    title='Target errors',
+                    left=[metric(f'{label}{name}') for label in ('Slack', 'Webhook', 'Email')
+                          for name in ('Status4xx', 'Status5xx', 'ConnectionErrors')],
+                    right=[metric('SlackRateLimited'), metric('WebhookRateLimited')],
+                    width=8
+                ),
+                cloudwatch.GraphWidget(
+                    title='Notifications',
+                    left=[metric('Notifications'), metric('DuplicateNotifications')],
+                    right=[metric('NotificationFailures')],
+                    width=8
+                )
+            ]]
+        )
+        cloudwatch.Alarm(self, 'NotificationFailureAlarm',
+            alarm_name='aws-activity-notification-failures',
+            alarm_description='Alerts could not be delivered to one of their targets',
+            metric=metric('NotificationFailures'),
+            threshold=0,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+        )
+        cloudwatch.Alarm(self, 'SlackLatencyAlarm',
+            alarm_name='aws-activity-notification-slack-latency',
+            alarm_description='p99 of Slack webhook calls over 5 seconds',
+            metric=metric('SlackDuration', 'p99'),
+            threshold=5000,
+            evaluation_periods=3,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
         )
 
         self.topic = sns.Topic(self, 'SnsTopic', 
@@ -56,13 +159,13 @@ class AwsActivityNotificationStack(Stack):
         )
 
         # Lambda should receive only message matching the following conditions on attributes:
-        # target: 'Slack' or 'slack' or begins with 'bl'
+        # targets: any of the target types the function delivers to
         # channel: attribute must be present
         self.topic.add_subscription(subscriptions.LambdaSubscription(
             fn=slack_notify_function,
             filter_policy={
                 "targets": sns.SubscriptionFilter.string_filter(
-                    allowlist=["Slack", "slack"]
+                    allowlist=["Slack", "slack", "Webhook", "webhook", "Email", "email"]
                 ),
                 "channel": sns.SubscriptionFilter.exists_filter()
             }
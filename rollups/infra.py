@@ -0,0 +1,109 @@
+from aws_cdk import (
+    Duration,
+    Stack,
+    aws_dynamodb as dynamodb,
+    aws_lambda as lambda_,
+    aws_lambda_event_sources as event_sources,
+    aws_iam as iam,
+    aws_sqs as sqs,
+    aws_cloudwatch as cloudwatch
+)
+from constructs import Construct
+
+from bundling import layers
+
+
+class AwsActivityRollupStack(Stack):
+    def __init__(self, scope: Construct, id: str, dynamodb_table: dynamodb.ITable,
+                 window: Duration = Duration.minutes(1), batch_size: int = 1000,
+                 rollup_ttl: Duration = Duration.days(400), **kwargs) -> None:
+        super().__init__(scope, id, **kwargs)
+
+        if not dynamodb_table.table_stream_arn:
+            raise ValueError('the activity table must have a stream, AwsActivityDatabaseStack(stream=True)')
+        # Lambda tumbling windows last at most 15 minutes
+        if not 0 < window.to_seconds() <= 15 * 60:
+            raise ValueError('window must be between 1 second and 15 minutes')
+
+        # IAM role
+        role = iam.Role(self, 'Role',
+            role_name='aws-activity-rollup',
+            description='Role for functions related to aws-activity-rollup',
+            assumed_by=iam.ServicePrincipal('lambda.amazonaws.com'),
+            inline_policies={
+                'CloudwatchLog': iam.PolicyDocument(statements=[
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=[
+                            'logs:CreateLogGroup'
+                        ],
+                        resources=[f'arn:aws:logs:{self.region}:{self.account}:*']
+                    ),
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=['logs:CreateLogStream', 'logs:PutLogEvents'],
+                        resources=[f'arn:aws:logs:{self.region}:{self.account}:log-group:/aws/lambda/*:*']
+                    )
+                ]),
+                'DynamoDBWrite': iam.PolicyDocument(statements=[
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=['dynamodb:UpdateItem'],
+                        resources=[dynamodb_table.table_arn]
+                    )
+                ])
+            }
+        )
+
+        rollup_function = lambda_.Function(self, 'RollupActivityFunction',
+            function_name='rollup-aws-activity',
+            handler='index.handler',
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            description='Maintain per-user daily rollups of AWS activities from the DynamoDB stream',
+            code=lambda_.Code.from_asset(
+                path='assets/lambda-functions/rollup-activity'
+            ),
+            environment={
+                'DYNAMODB_TABLE_NAME': dynamodb_table.table_name,
+                'ROLLUP_TTL_DAYS': str(int(rollup_ttl.to_days())),
+                'LOG_LEVEL': 'INFO'
+            },
+            timeout=Duration.minutes(1),
+            memory_size=256,
+            role=role,
+            layers=layers(self, 'aws-activity-rollup', dependencies=False)
+        )
+
+        # the rollups of a window are applied once, when it closes, conditional on the stream
+        # sequence numbers of its shard (activity_common/rollups.py). That needs the records
+        # of a shard in order: one batch per shard at a time, no parallelization factor
+        dead_letter_queue = sqs.Queue(self, 'DeadLetterQueue',
+            queue_name='aws-activity-rollup-dlq',
+            retention_period=Duration.days(14)
+        )
+        rollup_function.add_event_source(event_sources.DynamoEventSource(dynamodb_table,
+            starting_position=lambda_.StartingPosition.TRIM_HORIZON,
+            batch_size=batch_size,
+            tumbling_window=window,
+            retry_attempts=10,
+            on_failure=event_sources.SqsDlq(dead_letter_queue)
+        ))
+
+        cloudwatch.Alarm(self, 'IteratorAgeAlarm',
+            alarm_name='aws-activity-rollup-iterator-age',
+            alarm_description='Rollups lag the activity table stream by over 1 hour',
+            metric=rollup_function.metric('IteratorAge', statistic='Maximum', period=Duration.minutes(5)),
+            threshold=60 * 60 * 1000,
+            evaluation_periods=3,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+        )
+        cloudwatch.Alarm(self, 'DeadLetterAlarm',
+            alarm_name='aws-activity-rollup-dead-letters',
+            alarm_description='Stream records are missing from the daily rollups',
+            metric=dead_letter_queue.metric_approximate_number_of_messages_visible(),
+            threshold=0,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+        )
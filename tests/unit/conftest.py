@@ -0,0 +1,49 @@
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from tools.local_aws import TABLE_NAME, create_activity_table
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('DYNAMODB_TABLE_NAME', TABLE_NAME)
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def table(aws):
+    return create_activity_table(boto3.resource('dynamodb'))
+
+
+@pytest.fixture
+def alerts(aws, monkeypatch):
+    # every SNS publish is captured through a subscribed queue, digests are scheduled on another
+    sns = boto3.client('sns')
+    sqs = boto3.client('sqs')
+    topic_arn = sns.create_topic(Name='aws-activity-notification')['TopicArn']
+    queue_url = sqs.create_queue(QueueName='alerts')['QueueUrl']
+    queue_arn = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+    sns.subscribe(TopicArn=topic_arn, Protocol='sqs', Endpoint=queue_arn)
+    monkeypatch.setenv('SNS_TOPIC_ARN', topic_arn)
+    monkeypatch.setenv('DIGEST_QUEUE_URL', sqs.create_queue(QueueName='alert-digest')['QueueUrl'])
+
+    def received():
+        # [{'reason': ..., 'attributes': {...}, 'message': {...}}] published since the last call
+        published = []
+        while True:
+            messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10).get('Messages', [])
+            if not messages:
+                return published
+            for message in messages:
+                body = json.loads(message['Body'])
+                attributes = {name: value['Value'] for name, value in body['MessageAttributes'].items()}
+                published.append({'reason': attributes['reason'], 'attributes': attributes, 'message': json.loads(body['Message'])})
+                sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle'])
+    return received
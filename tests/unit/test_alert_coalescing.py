@@ -0,0 +1,132 @@
+import json
+import time
+
+import boto3
+import pytest
+
+from tools.events import sign_in_event
+from tools.lambdas import load_handler
+from tools.webhook_stub import WebhookStub
+
+
+WINDOW = 15 * 60
+
+
+def digest_requests():
+    sqs = boto3.client('sqs')
+    queue_url = sqs.get_queue_url(QueueName='alert-digest')['QueueUrl']
+    messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10).get('Messages', [])
+    return [{'messageId': message['MessageId'], 'body': message['Body']} for message in messages]
+
+
+def test_repeats_in_a_window_become_one_digest(table, alerts):
+    store = load_handler('store-sign-in-activity')
+    coalesce = load_handler('coalesce-alert')
+    # a closed window, so the digest is due right away
+    start = int(time.time()) // WINDOW * WINDOW - 2 * WINDOW
+
+    results = [
+        coalesce.handler({'event': store.build_item(sign_in_event(start + i * 60, success=False)), 'reason': 'ManyFailedSignInAttempt'}, None)
+        for i in range(10)
+    ]
+
+    assert [result['first'] for result in results] == [True] + [False] * 9
+    requests = digest_requests()
+    assert len(requests) == 1
+
+    assert coalesce.handler({'Records': requests}, None) == {'batchItemFailures': []}
+    [digest] = alerts()
+    assert digest['attributes']['digest'] == 'true'
+    assert digest['message'] == {
+        'userIdentity': 'IAMUser#alice',
+        'reason': 'ManyFailedSignInAttempt',
+        'count': 10,
+        'suppressed': 9,
+        'firstSeen': start,
+        'lastSeen': start + 9 * 60,
+        'windowStart': start,
+        'windowEnd': start + WINDOW
+    }
+
+
+def test_keys_are_per_user_reason_and_window(table, alerts):
+    store = load_handler('store-sign-in-activity')
+    coalesce = load_handler('coalesce-alert')
+    start = int(time.time()) // WINDOW * WINDOW - 3 * WINDOW
+
+    def first(reason, timestamp, **identity):
+        event = store.build_item(sign_in_event(timestamp, **identity))
+        return coalesce.handler({'event': event, 'reason': reason}, None)['first']
+
+    assert first('NoMFAUsed', start)
+    assert first('NoMFAUsed', start, user_name='bob')
+    assert first('RootActivity', start, identity_type='Root')
+    assert not first('NoMFAUsed', start + 60)
+    assert first('NoMFAUsed', start + WINDOW)
+
+
+def test_single_alert_has_no_digest(table, alerts):
+    store = load_handler('store-sign-in-activity')
+    coalesce = load_handler('coalesce-alert')
+    start = int(time.time()) // WINDOW * WINDOW - 2 * WINDOW
+
+    coalesce.handler({'event': store.build_item(sign_in_event(start, identity_type='Root')), 'reason': 'RootActivity'}, None)
+    coalesce.handler({'Records': digest_requests()}, None)
+
+    assert alerts() == []
+
+
+def test_digest_is_rendered_in_slack():
+    slack = load_handler('slack-notification')
+    digest = {
+        'userIdentity': 'IAMUser#alice', 'reason': 'ManyFailedSignInAttempt', 'count': 40, 'suppressed': 39,
+        'firstSeen': 1650448800, 'lastSeen': 1650449640, 'windowStart': 1650448800, 'windowEnd': 1650449700
+    }
+    record = {'Sns': {'MessageId': '1', 'Message': json.dumps(digest), 'MessageAttributes': {
+        'reason': {'Type': 'String', 'Value': 'ManyFailedSignInAttempt'},
+        'severity': {'Type': 'String', 'Value': 'High'},
+        'channel': {'Type': 'String', 'Value': 'alarm-aws'},
+        'digest': {'Type': 'String', 'Value': 'true'}
+    }}}
+
+    with WebhookStub() as webhook:
+        slack.SLACK_CHANNELS['alarm-aws'] = webhook.url
+        slack.handler({'Records': [record]}, None)
+
+    [attachment] = webhook.requests[0]['attachments']
+    assert attachment['title'] == '39 more ManyFailedSignInAttempt alerts were suppressed'
+    assert {'title': 'Last seen', 'value': '2022-04-20 10:14:00 UTC', 'short': True} in attachment['fields']
+
+
+def test_a_repeated_event_is_coalesced_once(table, alerts):
+    coalesce = load_handler('coalesce-alert')
+    start = int(time.time()) // WINDOW * WINDOW - 2 * WINDOW
+    # as the stateless branch of the state machine passes it, twice delivered
+    event = sign_in_event(start, identity_type='Root')
+
+    results = [coalesce.handler({'event': event, 'reason': 'RootActivity'}, None) for _ in range(2)]
+
+    assert [result['first'] for result in results] == [True, False]
+    assert results[1]['duplicate']
+    assert coalesce.handler({'Records': digest_requests()}, None) == {'batchItemFailures': []}
+    assert alerts() == []
+
+
+def test_a_retried_first_alert_is_still_first_and_digested_once(table, alerts):
+    store = load_handler('store-sign-in-activity')
+    coalesce = load_handler('coalesce-alert')
+    start = int(time.time()) // WINDOW * WINDOW - 2 * WINDOW
+    first, repeat = (store.build_item(sign_in_event(start + i, identity_type='Root')) for i in range(2))
+
+    results = [coalesce.handler({'event': first, 'reason': 'RootActivity'}, None)]
+    # its SNS publish failed, the alert is coalesced again on retry
+    coalesce.coalescing.forget(coalesce.get_table(), 'RootActivity', first['id'])
+    results += [coalesce.handler({'event': event, 'reason': 'RootActivity'}, None) for event in (first, repeat)]
+
+    assert [result['first'] for result in results] == [True, True, False]
+    assert results[-1]['count'] == 2
+    requests = digest_requests()
+    assert len(requests) == 2
+    assert coalesce.handler({'Records': requests}, None) == {'batchItemFailures': []}
+    [digest] = alerts()
+    assert digest['message']['suppressed'] == 1
@@ -0,0 +1,78 @@
+import json
+import time
+
+from tools import asl
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.workflow_cost import synth_definition
+
+from .test_alert_rules import corpus, state_machine_handlers
+from .test_buffered_ingestion import sqs_records
+
+add_layers_to_path()
+from activity_common import envelope, item_format  # noqa: E402
+
+
+def sns_record(message: dict, reason: str) -> dict:
+    return {'Sns': {
+        'MessageId': 'message-0',
+        'Message': json.dumps(message),
+        'MessageAttributes': {
+            'reason': {'Type': 'String', 'Value': reason},
+            'severity': {'Type': 'String', 'Value': 'High'},
+            'channel': {'Type': 'String', 'Value': 'alarm-aws'}
+        }
+    }}
+
+
+def test_state_machine_publishes_envelopes_rendered_as_events():
+    machine = asl.StateMachine(synth_definition())
+    build_item = load_handler('store-sign-in-activity').build_item
+    render = load_handler('slack-notification').render
+
+    alerts = 0
+    for event in corpus():
+        published = []
+        handlers = state_machine_handlers(machine, lambda payload: envelope.slim(build_item(payload['event'])), 3)
+        for name, _ in asl.states(machine.definition):
+            if name.startswith('Alert on '):
+                handlers[name] = lambda parameters: published.append(
+                    (json.loads(json.dumps(parameters['Message'])), parameters['MessageAttributes']['reason']['StringValue']))
+        machine.run(json.loads(json.dumps(event)), handlers=handlers)
+
+        # on the event or on the stored activity, the same alert
+        full = {**build_item(json.loads(json.dumps(event))), 'failedAttempts': 3}
+        for message, reason in published:
+            alerts += 1
+            assert message['envelope'] == envelope.FORMAT
+            assert 'userAgent' not in message['detail']
+            assert len(json.dumps(message)) < len(json.dumps(full)) / 2
+            assert render(sns_record(message, reason)) == render(sns_record(full, reason))
+    assert alerts > 50
+
+
+def test_batches_publish_envelopes(table, alerts):
+    events = [sign_in_event(int(time.time()) - i, mfa=False) for i in range(3)]
+    load_handler('store-sign-in-activity').handler(sqs_records(events), None)
+
+    published = alerts()
+    assert [alert['reason'] for alert in published] == ['NoMFAUsed']
+    message = published[0]['message']
+    assert envelope.is_slim(message)
+    assert message['detail']['additionalEventData'] == {'MFAUsed': 'No'}
+    assert 'raw' not in message and 'ttl' not in message
+
+
+def test_missing_fields_are_read_from_the_stored_activity(table, alerts):
+    event = sign_in_event(int(time.time()), user_name='bob', success=False)
+    store = load_handler('store-sign-in-activity')
+    message = store.handler(json.loads(json.dumps(event)), None)
+    # e.g. published by a publisher that projected fewer fields
+    del message['detail']['userIdentity']['userName']
+    notifier = load_handler('slack-notification')
+
+    notification = notifier.render(sns_record({**message, 'failedAttempts': 3}, 'ManyFailedSignInAttempt'))
+
+    assert {field['title']: field['value'] for field in notification['fields']}['User'] == 'bob'
+    stored = item_format.decode(table.get_item(Key={'id': message['id'], 'timestamp': message['timestamp']})['Item'])
+    assert envelope.expand(table, message)['detail'] == stored['detail']
@@ -0,0 +1,110 @@
+import json
+import time
+
+import pytest
+
+from tools import asl
+from tools.events import generate, sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.rule_replay import replay
+from tools.workflow_cost import synth_definition
+
+add_layers_to_path()
+from activity_common import envelope, rules  # noqa: E402
+
+
+def corpus():
+    now = int(time.time())
+    events = list(generate(300, now - 3600, mix={'iam_mfa': 1, 'iam_no_mfa': 1, 'iam_failure': 2, 'root': 1, 'assumed_role': 1}, seed=3))
+    check_mfa = sign_in_event(now, event_name='CheckMfa')
+    no_mfa_data = sign_in_event(now)
+    del no_mfa_data['detail']['additionalEventData']
+    no_response = sign_in_event(now, mfa=False)
+    no_response['detail']['responseElements'] = None
+    return events + [check_mfa, no_mfa_data, no_response]
+
+
+def state_machine_handlers(machine, store, failed_attempts=None):
+    # the store step, and the count and coalesce functions without a table: every alert
+    # is the first of its window
+    from_event = load_handler('coalesce-alert').from_event
+
+    def coalesce(payload):
+        activity = payload['event'] if 'userIdentity' in payload['event'] else from_event(payload['event'], int(time.time()))
+        return {'first': True, 'count': 1, 'envelope': envelope.slim(activity)}
+
+    handlers = {'Store activity': store}
+    for name, _ in asl.states(machine.definition):
+        if name.startswith('Count'):
+            handlers[name] = lambda payload: {**payload, 'failedAttempts': failed_attempts}
+        elif name.startswith('Coalesce'):
+            handlers[name] = coalesce
+    return handlers
+
+
+def alerted(execution, titles) -> list:
+    return [titles[name[len('Alert on '):]] for name, *_ in execution.states if name.startswith('Alert on ')]
+
+
+def run_state_machine(machine, titles, event, failed_attempts):
+    build_item = load_handler('store-sign-in-activity').build_item
+    handlers = state_machine_handlers(machine, lambda payload: build_item(payload['event']), failed_attempts)
+    return alerted(machine.run(event, handlers=handlers), titles)
+
+
+def test_state_machine_and_evaluator_agree():
+    machine = asl.StateMachine(synth_definition())
+    evaluator = rules.Evaluator(rules.load())
+    titles = {rule['title']: rule['reason'] for rule in evaluator.rules}
+    build_item = load_handler('store-sign-in-activity').build_item
+
+    reasons = set()
+    for event in corpus():
+        for failed_attempts in (1, 3):
+            item = build_item(json.loads(json.dumps(event)))
+            if evaluator.needs(item):
+                item['failedAttempts'] = failed_attempts
+            expected = run_state_machine(machine, titles, event, failed_attempts)
+            assert evaluator.alerts(item) == expected, event
+            reasons.update(expected or [None])
+    assert reasons == {None, 'RootActivity', 'ManyFailedSignInAttempt', 'NoMFAUsed'}
+
+
+def test_candidates_are_indexed():
+    evaluator = rules.Evaluator(rules.load())
+    build_item = load_handler('store-sign-in-activity').build_item
+
+    root = evaluator.candidates(build_item(sign_in_event(0, identity_type='Root')))
+    assumed_role = evaluator.candidates(build_item(sign_in_event(0, identity_type='AssumedRole', user_name='admin')))
+
+    assert [compiled.rule['reason'] for compiled in root] == ['RootActivity']
+    assert assumed_role == ()
+
+
+def test_failed_attempts_are_needed_before_the_threshold():
+    evaluator = rules.Evaluator(rules.load())
+    failure = load_handler('store-sign-in-activity').build_item(sign_in_event(0, success=False))
+
+    assert evaluator.needs(failure) == {'failedAttempts'}
+    with pytest.raises(KeyError):
+        evaluator.classify(failure)
+    assert evaluator.classify({**failure, 'failedAttempts': 3}) == 'ManyFailedSignInAttempt'
+
+
+def test_invalid_rules_are_rejected(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps({'rules': [{
+        'reason': 'Bad', 'title': 'bad', 'severity': 'Low', 'channel': 'alarm-aws', 'targets': [],
+        'conditions': [{'path': '$.eventName', 'contains': 'Login'}]
+    }]}))
+
+    with pytest.raises(ValueError):
+        rules.load(str(path))
+
+
+def test_replay_counts_failed_attempts_in_process():
+    build_item = load_handler('store-sign-in-activity').build_item
+    now = int(time.time())
+    events = [build_item(sign_in_event(now + i, success=False)) for i in range(4)] + [build_item(sign_in_event(now, identity_type='Root'))]
+
+    assert replay(events, rules.Evaluator(rules.load())) == {'ManyFailedSignInAttempt': 2, 'RootActivity': 1}
@@ -0,0 +1,131 @@
+import base64
+import time
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+
+from archive import AwsActivityArchiveStack
+from database import AwsActivityDatabaseStack
+from tools import archive as archive_tool
+from tools.events import generate, sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+
+from .test_buffered_ingestion import sqs_records
+
+add_layers_to_path()
+from activity_common import archive, item_format  # noqa: E402
+
+DAY = 24 * 60 * 60
+
+
+def stream_records(items, event_name='INSERT', sequence=100000000000000000000):
+    # stream records as delivered to Lambda: DynamoDB JSON with base64 binaries, the
+    # sequence numbers of one shard from `sequence` on
+    serializer = TypeSerializer()
+
+    def image(item):
+        encoded = {name: serializer.serialize(value) for name, value in item.items()}
+        for value in encoded.values():
+            if 'B' in value:
+                value['B'] = base64.b64encode(bytes(value['B'])).decode('ascii')
+        return encoded
+    image_name = 'OldImage' if event_name == 'REMOVE' else 'NewImage'
+    return {'Records': [{'eventName': event_name, 'dynamodb': {image_name: image(item), 'SequenceNumber': str(sequence + i)}}
+                        for i, item in enumerate(items)]}
+
+
+def scan(table):
+    items, kwargs = [], {}
+    while True:
+        response = table.scan(**kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def raw_items(table):
+    # Binary attributes as the bytes Lambda streams carry
+    return [{name: getattr(value, 'value', value) for name, value in item.items()} for item in scan(table)]
+
+
+def test_stream_is_archived_by_day_and_user(table, monkeypatch):
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket='aws-activity-archive')
+    monkeypatch.setenv('ARCHIVE_BUCKET_NAME', 'aws-activity-archive')
+    now = int(time.time())
+    events = [sign_in_event(now - day * DAY - i, user_name=user, success=i % 3 != 0)
+              for day in range(3) for i in range(4) for user in ('alice', 'bob')]
+    load_handler('store-sign-in-activity').handler(sqs_records(events), None)
+
+    items = raw_items(table)
+    result = load_handler('archive-activity').handler(stream_records(items), None)
+
+    # counters and profiles are not archived, one object per (day, user bucket)
+    activities = [item_format.decode(item) for item in items if 'eventName' in item]
+    assert result['archived'] == len(activities) == len(events)
+    assert result['objects'] == len({(archive.day_of(a['timestamp']), archive.bucket_of(a['userIdentity'])) for a in activities})
+
+    store = archive.S3Store(s3, 'aws-activity-archive')
+    found = list(archive.query(store, now - DAY, now, 'IAMUser#alice'))
+    assert sorted(activity['id'] for activity in found) == sorted(
+        a['id'] for a in activities if a['userIdentity'] == 'IAMUser#alice' and a['timestamp'] >= now - DAY)
+    # the event is archived whole, without the table TTL
+    assert found[0]['detail']['userIdentity']['userName'] == 'alice'
+    assert 'ttl' not in found[0]
+
+
+def test_queries_read_only_the_partitions_in_range(tmp_path):
+    store = archive.LocalStore(str(tmp_path))
+    build_item = load_handler('store-sign-in-activity').build_item
+    start = int(time.time()) - 10 * DAY
+    activities = [item_format.decode(item_format.encode(build_item(event)))
+                  for event in generate(2000, start, duration=10 * DAY, users=20, seed=4)]
+    archive.write(store, activities[:1500])
+    # a stream batch retried with other records
+    archive.write(store, activities[1000:])
+
+    since, until = start + 3 * DAY, start + 5 * DAY
+    user = activities[0]['userIdentity']
+    found = list(archive.query(store, since, until, user))
+
+    expected = {a['id'] for a in activities if a['userIdentity'] == user and since <= a['timestamp'] <= until}
+    assert sorted(activity['id'] for activity in found) == sorted(expected)
+    # one bucket of 3 days, two writes per partition at most
+    assert 0 < store.reads <= 3 * 2
+    assert len(list(archive.query(store, start, start + 10 * DAY))) == len(activities)
+
+
+def test_export_archives_the_table(table, tmp_path):
+    now = int(time.time())
+    events = [sign_in_event(now - i * 3600, user_name=f'user-{i % 5}') for i in range(30)]
+    load_handler('store-sign-in-activity').handler(sqs_records(events), None)
+
+    store = archive.LocalStore(str(tmp_path))
+    exported, objects = archive_tool.export([table, table], store, flush_every=10)
+
+    assert exported == len(events)
+    assert objects >= 3
+    assert len(list(archive.query(store, now - 30 * 3600, now))) == len(events)
+
+
+def test_archive_stack_consumes_the_table_stream():
+    app = core.App()
+    database = AwsActivityDatabaseStack(app, 'aws-activity-db', stream=True)
+    template = assertions.Template.from_stack(AwsActivityArchiveStack(app, 'aws-activity-archive', dynamodb_table=database.table))
+
+    assertions.Template.from_stack(database).has_resource_properties('AWS::DynamoDB::Table', {
+        'StreamSpecification': {'StreamViewType': 'NEW_AND_OLD_IMAGES'}
+    })
+    template.has_resource_properties('AWS::Lambda::EventSourceMapping', {
+        'BatchSize': 1000,
+        'MaximumBatchingWindowInSeconds': 300,
+        'BisectBatchOnFunctionError': True,
+        'StartingPosition': 'TRIM_HORIZON'
+    })
+    template.has_resource_properties('AWS::Lambda::Function', {
+        'FunctionName': 'archive-aws-activity',
+        'Environment': {'Variables': assertions.Match.object_like({'ARCHIVE_BUCKET_NAME': assertions.Match.any_value()})}
+    })
@@ -0,0 +1,94 @@
+import gzip
+import io
+import json
+import os
+import time
+
+import boto3
+
+from tools import backfill
+from tools.events import api_call_record, cloudtrail_log, sign_in_event
+from tools.lambdas import load_handler
+from tools.local_aws import TABLE_NAME
+
+
+def write_archive(directory, files):
+    # files: [[record, ...], ...] written as <directory>/<n>.json.gz
+    for i, records in enumerate(files):
+        (directory / f'{i:04d}.json.gz').write_bytes(cloudtrail_log(records))
+    (directory / 'CloudTrail-Digest.json.gz').write_bytes(gzip.compress(b'{}'))
+
+
+def stored(table):
+    return table.scan(FilterExpression='attribute_exists(eventName)')['Items']
+
+
+def test_records_are_streamed_across_chunks():
+    records = [api_call_record(1650448800 + i, user_name=f'user-{i}') for i in range(20)]
+    pretty = json.dumps({'Records': records}, indent=2).encode('utf-8')
+
+    assert list(backfill.iter_records(io.BytesIO(pretty), chunk_size=7)) == records
+    assert list(backfill.iter_records(io.BytesIO(b'{"Records": []}'), chunk_size=3)) == []
+
+
+def test_sign_in_events_are_stored_like_the_live_pipeline(table, tmp_path):
+    now = int(time.time())
+    logins = [sign_in_event(now - i, user_name=f'user-{i}')['detail'] for i in range(30)]
+    write_archive(tmp_path, [logins[:10] + [api_call_record(now)], logins[10:]])
+
+    totals = backfill.run(str(tmp_path), {'table_name': TABLE_NAME}, workers=1)
+
+    assert totals['files'] == 2
+    assert totals['records'] == 31
+    assert totals['written'] == 30
+    items = {item['id']: item for item in stored(table)}
+    assert set(items) == {login['eventID'] for login in logins}
+    expected = load_handler('store-sign-in-activity').build_item(backfill.to_event(logins[3]))
+    assert items[logins[3]['eventID']]['userIdentity'] == expected['userIdentity'] == 'IAMUser#user-3'
+    assert items[logins[3]['eventID']]['timestamp'] == expected['timestamp']
+
+
+def test_checkpoint_resumes_after_finished_files(table, tmp_path):
+    now = int(time.time())
+    archive = tmp_path / 'archive'
+    archive.mkdir()
+    write_archive(archive, [[sign_in_event(now - i)['detail']] for i in range(3)])
+    checkpoint = str(tmp_path / 'backfill.ckpt')
+    with open(checkpoint, 'w') as log:
+        log.write(json.dumps({'file': str(archive / '0000.json.gz')}) + '\n')
+
+    totals = backfill.run(str(archive), {'table_name': TABLE_NAME}, workers=1, checkpoint=checkpoint)
+
+    assert (totals['skipped'], totals['files']) == (1, 2)
+    assert len(stored(table)) == 2
+    assert backfill.run(str(archive), {'table_name': TABLE_NAME}, workers=1, checkpoint=checkpoint)['files'] == 0
+
+
+def test_s3_prefix_is_backfilled(table):
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket='trail')
+    key = 'AWSLogs/123456789012/CloudTrail/us-east-1/2022/04/20/log.json.gz'
+    s3.put_object(Bucket='trail', Key=key, Body=cloudtrail_log([sign_in_event(int(time.time()))['detail']]))
+
+    totals = backfill.run('s3://trail/AWSLogs/', {'table_name': TABLE_NAME}, workers=1)
+
+    assert (totals['files'], totals['written']) == (1, 1)
+
+
+def test_replayed_archive_does_not_alert_twice(table, alerts, tmp_path):
+    now = int(time.time())
+    events = [sign_in_event(now - 60 + i, success=False) for i in range(4)] + [sign_in_event(now, identity_type='Root')]
+    write_archive(tmp_path, [[event['detail'] for event in events]])
+    options = {
+        'table_name': TABLE_NAME,
+        'alert': True,
+        'topic_arn': os.environ['SNS_TOPIC_ARN'],
+        'digest_queue_url': os.environ['DIGEST_QUEUE_URL']
+    }
+
+    first = backfill.run(str(tmp_path), options, workers=1)
+    replay = backfill.run(str(tmp_path), options, workers=1)
+
+    assert (first['written'], first['alerts']) == (5, 2)
+    assert (replay['written'], replay['existing'], replay['alerts']) == (0, 5, 0)
+    assert sorted(alert['reason'] for alert in alerts()) == ['ManyFailedSignInAttempt', 'RootActivity']
@@ -0,0 +1,113 @@
+import json
+import random
+import time
+
+import pytest
+
+from tools import asl
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.workflow_cost import synth_definition
+
+from .test_alert_rules import alerted, state_machine_handlers
+from .test_buffered_ingestion import sqs_records
+
+add_layers_to_path()
+from activity_common import alerting, baseline, ip_database, rules  # noqa: E402
+
+
+@pytest.fixture
+def database_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'ip_ranges.db')
+    ip_database.build(path, [
+        ('198.51.100.0', '198.51.100.255', 64497, 'US', 'Example Cloud'),
+        ('203.0.113.0', '203.0.113.255', 64498, 'DE', 'Example Hosting')
+    ], metadata={'locations': {'US': [38.79, -93.52], 'DE': [51.26, 9.64]}})
+    monkeypatch.setenv('IP_DATABASE_PATH', path)
+    # ImpossibleTravel is deployed with a database that has locations
+    monkeypatch.setattr(rules, '_default', None)
+    return path
+
+
+def test_sketches_are_accurate():
+    rng = random.Random(1)
+    addresses = [f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}' for _ in range(baseline.BLOOM_CAPACITY)]
+    seen = baseline.BloomFilter()
+    ips = baseline.HyperLogLog()
+    for address in addresses:
+        seen.add(address)
+        ips.add(address)
+
+    assert all(address in seen for address in addresses)
+    false_positives = sum(f'172.16.{i // 256}.{i % 256}' in seen for i in range(10000))
+    assert false_positives < 200
+    assert abs(seen.count() - len(set(addresses))) < 0.05 * len(addresses)
+    assert abs(ips.count() - len(set(addresses))) < 0.2 * len(addresses)
+
+
+def test_profile_size_is_bounded():
+    profile = baseline.Profile('IAMUser#alice')
+    for i in range(5 * baseline.BLOOM_CAPACITY):
+        profile.observe(f'10.0.{i // 256}.{i % 256}', 'Mozilla/5.0', i)
+
+    item = profile.item()
+    assert sum(len(value) for value in item.values() if isinstance(value, bytes)) <= 2 * baseline.BLOOM_BYTES + 256
+    # the last values are still known after the filters rotated
+    assert not profile.observe(f'10.0.{i // 256}.{i % 256}', 'Mozilla/5.0', i)['newSourceIp']
+    assert profile.observe('10.255.0.1', 'Mozilla/5.0', i)['newSourceIp']
+
+
+def test_new_source_ip_and_impossible_travel(table, database_path):
+    store = load_handler('store-sign-in-activity')
+    start = int(time.time()) - 3600
+
+    def sign_in(offset, ip):
+        return store.handler(sign_in_event(start + offset, source_ip=ip), None)
+
+    # the first sign-ins are learnt, not alerted on
+    learning = [sign_in(i * 60, '198.51.100.10') for i in range(baseline.LEARNING_SIGN_INS)]
+    assert not any(event['profile']['newSourceIp'] for event in learning)
+
+    known = sign_in(600, '198.51.100.10')
+    new_ip = sign_in(900, '198.51.100.20')
+    travelled = sign_in(1200, '203.0.113.5')
+
+    assert alerting.classify(known) is None
+    assert alerting.classify(new_ip) == 'NewSourceIP'
+    assert new_ip['profile']['distinctIps'] == 2
+    assert alerting.classify(travelled) == 'ImpossibleTravel'
+    assert travelled['profile']['previousCountry'] == 'US'
+    assert travelled['profile']['travelSpeed'] > baseline.MAX_SPEED_KMH
+    # one item per user
+    profile = table.get_item(Key=baseline.profile_key('IAMUser#alice'))['Item']
+    assert profile['signIns'] == baseline.LEARNING_SIGN_INS + 3
+
+
+def test_batch_updates_each_profile_once(table, alerts, database_path):
+    store = load_handler('store-sign-in-activity')
+    now = int(time.time())
+    events = [sign_in_event(now - 100 + i, user_name=user, source_ip=f'198.51.100.{i}')
+              for i in range(12) for user in ('alice', 'bob')]
+
+    assert store.handler(sqs_records(events), None) == {'batchItemFailures': []}
+
+    for user in ('alice', 'bob'):
+        profile = baseline.load(table, f'IAMUser#{user}')
+        assert profile.version == 1
+        assert profile.sign_ins == 12
+    # the sign-ins after the learning ones come from new addresses
+    assert sorted({alert['reason'] for alert in alerts()}) == ['NewSourceIP']
+
+
+def test_state_machine_and_evaluator_agree_on_profiles():
+    machine = asl.StateMachine(synth_definition())
+    evaluator = rules.Evaluator(rules.load())
+    titles = {rule['title']: rule['reason'] for rule in evaluator.rules}
+    build_item = load_handler('store-sign-in-activity').build_item
+    now = int(time.time())
+
+    for profile in ({'newSourceIp': True}, {'newSourceIp': False, 'impossibleTravel': True}, {'impossibleTravel': False}, {}):
+        for event in (sign_in_event(now), sign_in_event(now, mfa=False), sign_in_event(now, identity_type='AssumedRole', user_name='admin')):
+            item = {**build_item(json.loads(json.dumps(event))), 'profile': profile}
+            execution = machine.run(event, handlers=state_machine_handlers(machine, lambda payload: item))
+            assert evaluator.alerts(item) == alerted(execution, titles)
@@ -0,0 +1,62 @@
+import json
+import time
+
+from tools.events import sign_in_event
+from tools.lambdas import load_handler
+
+
+def sqs_records(events):
+    return {'Records': [
+        {'messageId': f'message-{i}', 'body': body if isinstance(body, str) else json.dumps(body), 'eventSource': 'aws:sqs'}
+        for i, body in enumerate(events)
+    ]}
+
+
+def test_batch_is_stored_and_alerted_per_record(table, alerts):
+    store = load_handler('store-sign-in-activity')
+    now = int(time.time())
+    events = [sign_in_event(now - i, success=False) for i in range(4)] + [
+        sign_in_event(now, identity_type='Root'),
+        sign_in_event(now, user_name='bob', mfa=False),
+        sign_in_event(now, user_name='carol')
+    ]
+
+    result = store.handler(sqs_records(events), None)
+
+    assert result == {'batchItemFailures': []}
+    assert table.scan(Select='COUNT', FilterExpression='attribute_exists(eventName)')['Count'] == 7
+    # the 3rd failure alerts like one execution per event would, the 4th is coalesced into its digest
+    assert sorted(alert['reason'] for alert in alerts()) == ['ManyFailedSignInAttempt', 'NoMFAUsed', 'RootActivity']
+
+
+def test_only_failed_records_are_reported(table, alerts):
+    store = load_handler('store-sign-in-activity')
+    now = int(time.time())
+
+    result = store.handler(sqs_records([sign_in_event(now), 'not json', sign_in_event(now)]), None)
+
+    assert result == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+
+
+def test_unprocessed_items_are_retried(table, monkeypatch):
+    store = load_handler('store-sign-in-activity')
+    monkeypatch.setattr(store, 'BATCH_WRITE_BASE_DELAY', 0)
+    client = table.meta.client
+    batch_write_item = client.batch_write_item
+    calls = []
+
+    def throttled(RequestItems):
+        # the first attempt leaves its last item unprocessed
+        calls.append(RequestItems)
+        if len(calls) == 1:
+            requests = RequestItems[table.name]
+            batch_write_item(RequestItems={table.name: requests[:-1]})
+            return {'UnprocessedItems': {table.name: requests[-1:]}}
+        return batch_write_item(RequestItems=RequestItems)
+    monkeypatch.setattr(client, 'batch_write_item', throttled)
+
+    items = [store.build_item(sign_in_event(int(time.time()))) for _ in range(3)]
+
+    assert store.batch_put(table, items) == []
+    assert len(calls) == 2
+    assert table.scan(Select='COUNT')['Count'] == 3
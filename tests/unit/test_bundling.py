@@ -0,0 +1,26 @@
+import os
+
+from bundling import infra as bundling
+
+
+def test_requirements_are_the_union_of_the_functions(tmp_path):
+    for function, lines in (('a', 'requests==2.26.0\n# pinned\n'), ('b', 'requests==2.26.0\nurllib3  # transitive\n')):
+        os.makedirs(tmp_path / function)
+        (tmp_path / function / 'requirements.txt').write_text(lines)
+    os.makedirs(tmp_path / 'c')
+
+    requirement_lines = bundling.requirements(str(tmp_path))
+
+    assert requirement_lines == ['requests==2.26.0', 'urllib3']
+    assert bundling.dependencies_hash(requirement_lines) == bundling.dependencies_hash(list(requirement_lines))
+    assert bundling.dependencies_hash(requirement_lines) != bundling.dependencies_hash(['requests==2.27.0'])
+
+
+def test_layer_is_bundled_once_then_copied(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+
+    assert bundling.install([], str(tmp_path / 'first'), cache_dir) == 'installed'
+    assert bundling.install([], str(tmp_path / 'second'), cache_dir) == 'cached'
+    assert os.path.isdir(tmp_path / 'second' / 'python')
+    # nothing is left behind by the staging
+    assert sorted(os.listdir(cache_dir)) == ['layers', 'wheels']
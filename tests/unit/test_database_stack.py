@@ -0,0 +1,26 @@
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+
+from database import AwsActivityDatabaseStack
+from tools.lambdas import add_layers_to_path
+
+add_layers_to_path()
+from activity_common import item_format  # noqa: E402
+
+
+def test_table_and_user_identity_index():
+    app = core.App()
+    template = assertions.Template.from_stack(AwsActivityDatabaseStack(app, 'aws-activity-db'))
+
+    template.has_resource_properties('AWS::DynamoDB::Table', {
+        'TableName': 'aws-activity',
+        'KeySchema': [
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+        ],
+        'TimeToLiveSpecification': {'AttributeName': 'ttl', 'Enabled': True},
+        'GlobalSecondaryIndexes': [assertions.Match.object_like({
+            'IndexName': 'UserIdentityIndex',
+            'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': list(item_format.HOT_ATTRIBUTES)}
+        })]
+    })
@@ -0,0 +1,37 @@
+import time
+
+from tools.events import sign_in_event
+from tools.lambdas import load_handler
+
+
+def test_counts_only_failed_console_logins_in_last_hour(table):
+    store = load_handler('store-sign-in-activity')
+    count = load_handler('count-failed-sign-in-attempt')
+    now = int(time.time())
+
+    for offset in range(0, 50 * 60, 10 * 60):
+        store.handler(sign_in_event(now - offset, success=False), None)
+    store.handler(sign_in_event(now, success=True), None)
+    store.handler(sign_in_event(now, success=False, user_name='bob'), None)
+    # older than the 1 hour window
+    store.handler(sign_in_event(now - 2 * 60 * 60, success=False), None)
+
+    result = count.handler({'userIdentity': 'IAMUser#alice'}, None)
+
+    assert result['failedAttempts'] == 5
+
+
+def test_failures_share_minute_buckets(table):
+    store = load_handler('store-sign-in-activity')
+    count = load_handler('count-failed-sign-in-attempt')
+    now = int(time.time())
+
+    for _ in range(25):
+        store.handler(sign_in_event(now, success=False), None)
+
+    counters = table.query(
+        KeyConditionExpression='id = :id',
+        ExpressionAttributeValues={':id': 'FailedSignIn#IAMUser#alice'}
+    )['Items']
+    assert len(counters) == 1
+    assert count.handler({'userIdentity': 'IAMUser#alice'}, None)['failedAttempts'] == 25
@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+from tools.events import generate
+from tools.harness import Harness
+from tools.workflow_cost import synth_definition
+
+
+@pytest.fixture(scope='module')
+def definition():
+    return synth_definition()
+
+
+def test_generated_mix_and_bursts():
+    now = int(time.time())
+    events = list(generate(200, now - 3600, mix={'root': 1, 'assumed_role': 1}, bursts=2, burst_size=5, seed=1))
+
+    assert len(events) == 210
+    assert [event['time'] for event in events] == sorted(event['time'] for event in events)
+    assert {event['detail']['userIdentity']['type'] for event in events} == {'Root', 'AssumedRole', 'IAMUser'}
+    bursts = [event for event in events if event['detail']['userIdentity'].get('userName', '').startswith('brute-force-')]
+    assert len(bursts) == 10
+    assert all(event['detail']['responseElements']['ConsoleLogin'] == 'Failure' for event in bursts)
+
+
+def test_pipeline_report(definition):
+    now = int(time.time())
+    events = generate(100, now - 600, duration=600, users=5, bursts=1, burst_size=5, seed=7)
+
+    with Harness(definition) as harness:
+        report = harness.run(events)
+
+    assert report['events'] == 105
+    assert report['failed_executions'] == {}
+    assert report['stages']['store']['count'] == 105
+    assert report['stages']['store']['wcu'] >= 2 * 105
+    assert report['stages']['count']['rcu'] > 0
+    # one burst of 5 failures alerts once, the rest of its window is coalesced
+    assert report['alerts']['ManyFailedSignInAttempt'] >= 1
+    assert report['notified'] == sum(report['alerts'].values())
+    assert report['stages']['notify']['count'] == report['notified']
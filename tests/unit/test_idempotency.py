@@ -0,0 +1,124 @@
+import time
+
+import pytest
+from boto3.dynamodb.conditions import Attr
+
+from tools.events import generate, sign_in_event
+from tools.harness import Harness
+from tools.lambdas import load_handler
+from tools.webhook_stub import WebhookStub
+from tools.workflow_cost import synth_definition
+
+from .test_buffered_ingestion import sqs_records
+from .test_slack_notification import Context, slack, sns_event
+
+
+def activities(table):
+    return table.scan(Select='COUNT', FilterExpression=Attr('eventName').exists())['Count']
+
+
+def failures_counted(table):
+    counters = table.scan(FilterExpression=Attr('id').begins_with('FailedSignIn#'))['Items']
+    return sum(int(counter['count']) for counter in counters)
+
+
+def test_replayed_executions_write_and_alert_once():
+    # every event delivered 3 times, twice to the same container and once to a new one
+    now = int(time.time())
+    events = list(generate(40, now - 600, duration=600, users=3, bursts=1, burst_size=5, seed=3))
+    definition = synth_definition()
+
+    with Harness(definition) as once:
+        expected = once.run(events)
+    with Harness(definition) as harness:
+        report = harness.run([event for event in events for _ in range(2)])
+        harness.store = load_handler('store-sign-in-activity')
+        replayed = harness.run(events)
+        table = harness.store.get_table()
+
+        assert activities(table) == len(events)
+        assert failures_counted(table) == sum(event['detail']['responseElements']['ConsoleLogin'] == 'Failure'
+                                              for event in events)
+
+    assert report['failed_executions'] == replayed['failed_executions'] == {}
+    assert report['alerts'] == expected['alerts'] and replayed['alerts'] == {}
+    assert report['notified'] == expected['notified']
+    assert report['stages']['count']['count'] == expected['stages']['count']['count']
+
+
+def test_failure_counted_once_the_retry_succeeds(table, monkeypatch):
+    store = load_handler('store-sign-in-activity')
+    task = {'event': sign_in_event(int(time.time()), success=False), 'executionId': 'execution-1'}
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError('unavailable')
+    # the counter update fails, then what follows it: each retry resumes from the count
+    for target, name in ((store.get_table(), 'update_item'), (store, 'observe')):
+        with monkeypatch.context() as patch:
+            patch.setattr(target, name, unavailable)
+            with pytest.raises(RuntimeError):
+                store.handler(task, None)
+
+    assert 'duplicate' not in store.handler(task, None)
+    assert store.handler({**task, 'executionId': 'execution-2'}, None)['duplicate']
+    assert activities(table) == 1
+    assert failures_counted(table) == 1
+
+
+def test_a_redelivered_failure_is_counted_once(table, alerts, monkeypatch):
+    store = load_handler('store-sign-in-activity')
+    records = sqs_records([sign_in_event(int(time.time()), identity_type='Root', success=False)])
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError('unavailable')
+    with monkeypatch.context() as patch:
+        patch.setattr(store.alerting, 'publish', unavailable)
+        assert store.handler(records, None)['batchItemFailures']
+    assert store.handler(records, None) == {'batchItemFailures': []}
+
+    assert activities(table) == 1
+    assert failures_counted(table) == 1
+    assert [alert['reason'] for alert in alerts()] == ['RootActivity']
+
+
+def test_a_task_retried_in_its_execution_is_not_a_duplicate(table):
+    store = load_handler('store-sign-in-activity')
+    event = sign_in_event(int(time.time()))
+    first = store.handler({'event': event, 'executionId': 'execution-1'}, None)
+
+    # in the same container, and in another one after the response was lost
+    for store in (store, load_handler('store-sign-in-activity')):
+        retried = store.handler({'event': event, 'executionId': 'execution-1'}, None)
+        assert 'duplicate' not in retried
+        assert retried['profile'] == first['profile']
+        assert store.handler({'event': event, 'executionId': 'execution-2'}, None)['duplicate']
+    assert activities(table) == 1
+
+
+def test_redelivered_messages_are_acknowledged(table, alerts):
+    store = load_handler('store-sign-in-activity')
+    now = int(time.time())
+    events = [sign_in_event(now - i, success=False) for i in range(3)] + [sign_in_event(now, identity_type='Root')]
+
+    assert store.handler(sqs_records(events + events[:1]), None) == {'batchItemFailures': []}
+    # redelivered by SQS or retried by EventBridge into another batch
+    assert store.handler(sqs_records(events[1:]), None) == {'batchItemFailures': []}
+
+    assert activities(table) == 4
+    assert failures_counted(table) == 3
+    assert sorted(alert['reason'] for alert in alerts()) == ['ManyFailedSignInAttempt', 'RootActivity']
+
+
+def test_slack_sends_each_message_once(table):
+    with WebhookStub(responses=[(400, {})]) as webhook:
+        module = slack(webhook, MAX_WORKERS=1)
+        event = sns_event(3)
+        # the failed message fails the invocation, which Lambda retries as a whole
+        with pytest.raises(module.NotificationError):
+            module.handler(event, Context(10000))
+        module.handler(event, Context(10000))
+        # SNS delivers a message again
+        module.handler({'Records': event['Records'][:1]}, Context(10000))
+
+    # one accepted post per message
+    assert len(webhook.requests) == 3
@@ -0,0 +1,94 @@
+import json
+import logging
+import time
+
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.webhook_stub import WebhookStub
+
+from .test_slack_notification import Context, slack, sns_event
+
+add_layers_to_path()
+from activity_common import instrumentation  # noqa: E402
+
+
+def emf_documents(output):
+    # the EMF lines of captured stdout, checked against the specification
+    documents = [json.loads(line) for line in output.splitlines() if line.startswith('{"_aws"')]
+    for document in documents:
+        directive, = document['_aws']['CloudWatchMetrics']
+        assert directive['Namespace'] == instrumentation.NAMESPACE
+        assert directive['Dimensions'] == [['FunctionName']]
+        assert isinstance(document['_aws']['Timestamp'], int)
+        for metric in directive['Metrics']:
+            assert metric['Name'] in document
+            assert metric['Unit'] in ('Count', 'Milliseconds')
+    return documents
+
+
+def test_store_and_count_emit_phases_and_capacity(table, monkeypatch, capsys):
+    store = load_handler('store-sign-in-activity')
+    count = load_handler('count-failed-sign-in-attempt')
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'store-aws-sign-in-activity')
+
+    store.handler(sign_in_event(int(time.time()), success=False), None)
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'count-failed-sign-in-attempt')
+    count.handler({'userIdentity': 'IAMUser#alice'}, None)
+
+    stored, counted = emf_documents(capsys.readouterr().out)
+    assert stored['FunctionName'] == 'store-aws-sign-in-activity'
+    assert {'BuildDuration', 'StoreDuration', 'CountFailureDuration', 'InvocationDuration'} <= set(stored)
+    assert stored['Activities'] == 1
+    # the activity and its failure counter, the shard map read (as moto accounts them)
+    assert stored['WriteCapacityUnits'] > 1
+    assert stored['ReadCapacityUnits'] > 0
+    assert counted['QueryPages'] == 1
+    assert counted['ReadCapacityUnits'] > 0
+    assert counted['CountFailuresDuration'] <= counted['InvocationDuration']
+
+
+def test_slack_latency_and_status(monkeypatch, capsys):
+    with WebhookStub(responses=[(500, {}), (429, {'Retry-After': '0'})]) as webhook:
+        module = slack(webhook)
+        monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'aws-activity-slack-notifier')
+        module.handler(sns_event(2), Context(10000))
+
+    document, = emf_documents(capsys.readouterr().out)
+    assert document['Notifications'] == 2
+    assert document['NotificationFailures'] == 0
+    assert document['SlackStatus5xx'] == 1
+    assert document['SlackRateLimited'] == document['SlackStatus4xx'] == 1
+    assert document['SlackStatus2xx'] == 2
+    assert len(document['SlackDuration']) == 4
+
+
+def test_nothing_is_written_outside_lambda(table, monkeypatch, capsys):
+    monkeypatch.delenv('AWS_LAMBDA_FUNCTION_NAME', raising=False)
+    store = load_handler('store-sign-in-activity')
+
+    store.handler(sign_in_event(int(time.time())), None)
+
+    assert emf_documents(capsys.readouterr().out) == []
+    # and the values do not pile up for the next invocation
+    assert store.metrics.document('store-aws-sign-in-activity') is None
+
+
+def test_sampled_structured_logging(monkeypatch):
+    logger = logging.getLogger('sampled')
+    monkeypatch.setenv('LOG_LEVEL', 'WARNING')
+    monkeypatch.setenv('LOG_SAMPLE_RATE', '0')
+    instrumentation.configure_logging(logger)
+    instrumentation.sample(logger)
+    assert not logger.isEnabledFor(logging.INFO)
+
+    monkeypatch.setenv('LOG_SAMPLE_RATE', '1')
+    instrumentation.configure_logging(logger)
+    instrumentation.sample(logger)
+    assert logger.isEnabledFor(logging.DEBUG)
+
+    record = logger.makeRecord('sampled', logging.DEBUG, __file__, 1, 'Activity built', (), None,
+                               extra={'activity': {'id': 'event-id', 'timestamp': 1}})
+    assert json.loads(instrumentation.JsonFormatter().format(record)) == {
+        'level': 'DEBUG', 'logger': 'sampled', 'message': 'Activity built',
+        'activity': {'id': 'event-id', 'timestamp': 1}
+    }
@@ -0,0 +1,77 @@
+import json
+import time
+
+import pytest
+
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+
+add_layers_to_path()
+from activity_common import ip_database, item_format  # noqa: E402
+
+
+@pytest.fixture
+def database_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'ip_ranges.db')
+    ip_database.build(path, [
+        ('192.0.2.0', '192.0.2.255', 64496, 'NL', 'Example Hosting'),
+        ('198.51.100.0', '198.51.100.127', 64497, 'US', 'Example Cloud'),
+        ('2001:db8::', '2001:db8::ffff', 64498, 'DE', 'Example IPv6'),
+        ('10.0.255.0', '10.1.0.255', 64499, '', 'Across prefixes')
+    ], {
+        'drop': ['192.0.2.128/25', '203.0.113.0/24'],
+        'tor-exit': ['192.0.2.200', '198.51.100.10/32']
+    })
+    monkeypatch.setenv('IP_DATABASE_PATH', path)
+    return path
+
+
+def test_lookup_splits_overlapping_ranges(database_path):
+    database = ip_database.IpDatabase(database_path)
+
+    assert database.lookup('192.0.2.0') == {'asn': 64496, 'org': 'Example Hosting', 'country': 'NL'}
+    assert database.lookup('192.0.2.127') == database.lookup('192.0.2.1')
+    assert database.lookup('192.0.2.128')['lists'] == ['drop']
+    assert database.lookup('192.0.2.200') == {'asn': 64496, 'org': 'Example Hosting', 'country': 'NL', 'lists': ['drop', 'tor-exit']}
+    assert database.lookup('192.0.2.201')['lists'] == ['drop']
+    # a list entry outside every network
+    assert database.lookup('203.0.113.7') == {'lists': ['drop']}
+    assert database.lookup('198.51.100.10')['lists'] == ['tor-exit']
+    assert database.lookup('198.51.100.128') is None
+    # found from the /16 prefix of the address although the range starts in the previous one
+    assert database.lookup('10.1.0.5') == {'asn': 64499, 'org': 'Across prefixes'}
+    assert database.lookup('10.1.1.0') is None
+    assert database.lookup('2001:db8::1')['org'] == 'Example IPv6'
+    assert database.lookup('2001:db8::1:0') is None
+    assert database.lookup('AWS Internal') is None
+    assert database.lookup(None) is None
+    assert len(database) == 10
+    # attacks reuse addresses, repeats are served from the cache
+    assert database.lookup('192.0.2.200') is database.lookup('192.0.2.200')
+    assert database.lookup.cache_info().hits == 2
+
+
+def test_stored_activity_and_alert_are_enriched(table, database_path):
+    store = load_handler('store-sign-in-activity')
+    slack = load_handler('slack-notification')
+    event = sign_in_event(int(time.time()), identity_type='Root', source_ip='198.51.100.10')
+
+    result = store.handler(event, None)
+
+    info = {'asn': 64497, 'org': 'Example Cloud', 'country': 'US', 'lists': ['tor-exit']}
+    assert result['ipInfo'] == info
+    item = table.get_item(Key={'id': event['id'], 'timestamp': result['timestamp']})['Item']
+    assert item['ipInfo'] == info
+    assert item_format.decode(item)['ipInfo'] == info
+    fields = slack.render({'Sns': {'Message': json.dumps(result), 'MessageAttributes': {
+        'reason': {'Value': 'RootActivity'}, 'severity': {'Value': 'Critical'}, 'channel': {'Value': 'alarm-aws'}
+    }}})['fields']
+    assert {'title': 'Network', 'value': 'AS64497 Example Cloud (US)', 'short': True} in fields
+    assert {'title': 'Known bad', 'value': 'tor-exit', 'short': True} in fields
+
+
+def test_missing_database_leaves_activities_as_they_are(table, monkeypatch, tmp_path):
+    monkeypatch.setenv('IP_DATABASE_PATH', str(tmp_path / 'missing.db'))
+    store = load_handler('store-sign-in-activity')
+
+    assert 'ipInfo' not in store.handler(sign_in_event(int(time.time())), None)
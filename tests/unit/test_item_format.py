@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+
+add_layers_to_path()
+from activity_common import item_format  # noqa: E402
+
+
+@pytest.mark.parametrize('identity', [
+    {'identity_type': 'IAMUser', 'success': False},
+    {'identity_type': 'Root'},
+    {'identity_type': 'AssumedRole', 'user_name': 'admin', 'mfa': False}
+])
+def test_both_formats_read_back_as_the_stored_activity(table, identity):
+    store = load_handler('store-sign-in-activity')
+    event = store.build_item(sign_in_event(int(time.time()), **identity))
+    key = {'id': event['id'], 'timestamp': event['timestamp']}
+
+    table.put_item(Item=item_format.encode(event))
+    compact = table.get_item(Key=key)['Item']
+    table.put_item(Item=event)
+    legacy = table.get_item(Key=key)['Item']
+
+    assert item_format.is_compact(compact) and not item_format.is_compact(legacy)
+    assert item_format.decode(compact) == event
+    assert item_format.decode(legacy) == event
+
+
+def test_hot_fields_are_top_level_and_projected(table):
+    store = load_handler('store-sign-in-activity')
+    event = sign_in_event(int(time.time()), success=False, mfa=False, source_ip='203.0.113.7')
+
+    store.handler(event, None)
+
+    [projected] = table.query(
+        IndexName='UserIdentityIndex',
+        KeyConditionExpression='userIdentity = :user',
+        ExpressionAttributeValues={':user': 'IAMUser#alice'}
+    )['Items']
+    assert 'raw' not in projected and 'detail' not in projected
+    assert projected['consoleLogin'] == 'Failure'
+    assert projected['mfaUsed'] == 'No'
+    assert projected['sourceIPAddress'] == '203.0.113.7'
+    assert projected['userName'] == 'alice'
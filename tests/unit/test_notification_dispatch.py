@@ -0,0 +1,106 @@
+import json
+import time
+
+import boto3
+import pytest
+
+from tools.lambdas import load_handler
+from tools.smtp_stub import SmtpStub
+from tools.webhook_stub import WebhookStub
+
+from .test_slack_notification import Context, slack, sns_event
+
+
+def alert_event(count, targets):
+    event = sns_event(count)
+    for record in event['Records']:
+        record['Sns']['MessageAttributes']['targets'] = {'Type': 'String.Array', 'Value': json.dumps(targets)}
+    return event
+
+
+def dispatcher(slack_webhook, webhooks=(), smtp=None, **settings):
+    module = slack(slack_webhook, **settings)
+    module.NOTIFICATION_TARGETS = {'alarm-aws': {
+        'webhook': [webhook.url for webhook in webhooks],
+        'email': ['security@example.com'] if smtp else []
+    }}
+    if smtp:
+        module.SMTP_SETTINGS = smtp.settings
+    return module
+
+
+def test_targets_are_routed_from_message_attributes():
+    with WebhookStub() as slack_webhook, WebhookStub() as webhook, SmtpStub() as smtp:
+        module = dispatcher(slack_webhook, [webhook], smtp)
+        assert module.handler(alert_event(2, ['Slack', 'Webhook', 'Email']), Context(10000)) == {'sent': 6, 'failures': []}
+        assert module.handler(alert_event(1, ['Webhook']), Context(10000)) == {'sent': 1, 'failures': []}
+        # Slack only without the attribute
+        assert module.handler(sns_event(1), Context(10000)) == {'sent': 1, 'failures': []}
+
+    assert len(slack_webhook.requests) == 3
+    assert [request['reason'] for request in webhook.requests] == ['RootActivity'] * 3
+    assert webhook.requests[0]['fields']['User'] == 'Root'
+    assert [message['recipients'] for message in smtp.messages] == [['security@example.com']] * 2
+    assert smtp.messages[0]['message']['Subject'] == '[Critical] Detected Root activity'
+
+
+def test_slow_target_does_not_delay_the_others():
+    with WebhookStub() as slack_webhook, WebhookStub(latency=2) as slow, SmtpStub(latency=0.05) as smtp:
+        module = dispatcher(slack_webhook, [slow], smtp)
+        module.TARGET_TYPES = {**module.TARGET_TYPES, 'webhook': {'label': 'Webhook', 'timeout': 0.2, 'attempts': 2}}
+        start = time.monotonic()
+        with pytest.raises(module.NotificationError) as error:
+            module.handler(alert_event(4, ['Slack', 'Webhook', 'Email']), Context(10000))
+        elapsed = time.monotonic() - start
+
+    # the slow webhook times out after its attempts, the other targets are notified meanwhile
+    assert {(failure['target'], failure['messageId']) for failure in json.loads(str(error.value))} == {
+        ('webhook', f'message-{i}') for i in range(4)}
+    assert len(slack_webhook.requests) == 4
+    assert len(smtp.messages) == 4
+    assert elapsed < 1
+
+
+def test_a_post_that_may_have_been_delivered_is_not_sent_again():
+    with WebhookStub() as slack_webhook, WebhookStub(latency=0.5) as slow:
+        module = dispatcher(slack_webhook, [slow])
+        module.TARGET_TYPES = {**module.TARGET_TYPES, 'webhook': {'label': 'Webhook', 'timeout': 0.2, 'attempts': 3}}
+        with pytest.raises(module.NotificationError):
+            module.handler(alert_event(1, ['Webhook']), Context(10000))
+        # the webhook received it after the client gave up waiting
+        time.sleep(0.5)
+
+    assert len(slow.requests) == 1
+
+
+def test_transient_smtp_replies_are_retried():
+    with WebhookStub() as slack_webhook, SmtpStub(responses=[451, 421]) as smtp:
+        module = dispatcher(slack_webhook, smtp=smtp)
+        assert module.handler(alert_event(1, ['Email']), Context(10000)) == {'sent': 1, 'failures': []}
+
+    assert len(smtp.messages) == 1
+    assert smtp.connections == 3
+
+
+def test_only_failed_targets_are_sent_again(table):
+    with WebhookStub() as slack_webhook, WebhookStub(responses=[(400, {})]) as webhook:
+        module = dispatcher(slack_webhook, [webhook])
+        event = alert_event(1, ['Slack', 'Webhook'])
+        with pytest.raises(module.NotificationError):
+            module.handler(event, Context(10000))
+        module.handler(event, Context(10000))
+
+    assert len(slack_webhook.requests) == 1
+    assert len(webhook.requests) == 1
+
+
+def test_smtp_credentials_are_read_once_from_secrets_manager(aws):
+    secret = boto3.client('secretsmanager').create_secret(Name='aws-activity-smtp',
+        SecretString=json.dumps({'username': 'relay', 'password': 's3cret'}))
+    module = load_handler('slack-notification')
+    module.SMTP_CREDENTIALS_SECRET = secret['ARN']
+
+    assert module.get_smtp_credentials() == {'username': 'relay', 'password': 's3cret'}
+    boto3.client('secretsmanager').delete_secret(SecretId=secret['ARN'], ForceDeleteWithoutRecovery=True)
+    # kept by the container
+    assert module.get_smtp_credentials() == {'username': 'relay', 'password': 's3cret'}
@@ -0,0 +1,29 @@
+import json
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+
+from notification import AwsActivityNotificationStack
+
+
+def test_smtp_credentials_stay_out_of_the_template(monkeypatch):
+    monkeypatch.setenv('SLACK_WEBHOOK_ALARM_AWS', 'https://hooks.slack.com/services/T0/B0/X')
+    monkeypatch.setenv('SMTP_HOST', 'smtp.example.com')
+    monkeypatch.setenv('SMTP_USERNAME', 'relay')
+    monkeypatch.setenv('SMTP_PASSWORD', 'do-not-deploy-me')
+    monkeypatch.setenv('SMTP_CREDENTIALS_SECRET', 'aws-activity-smtp')
+    app = core.App()
+    template = assertions.Template.from_stack(AwsActivityNotificationStack(app, 'aws-activity-notification'))
+
+    assert 'do-not-deploy-me' not in json.dumps(template.to_json())
+    template.has_resource_properties('AWS::Lambda::Function', {
+        'Environment': {'Variables': assertions.Match.object_like({
+            'SMTP_HOST': 'smtp.example.com',
+            'SMTP_CREDENTIALS_SECRET': 'aws-activity-smtp'
+        })}
+    })
+    template.has_resource_properties('AWS::IAM::Policy', {
+        'PolicyDocument': {'Statement': assertions.Match.array_with([assertions.Match.object_like({
+            'Action': ['secretsmanager:GetSecretValue', 'secretsmanager:DescribeSecret']
+        })])}
+    })
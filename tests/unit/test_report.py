@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+import time
+
+import pytest
+
+from tools import report
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.local_aws import TABLE_NAME
+
+add_layers_to_path()
+from activity_common import failure_counter, item_format, reporting  # noqa: E402
+
+
+@pytest.fixture
+def activities(table):
+    build_item = load_handler('store-sign-in-activity').build_item
+    now = int(time.time())
+    items = [build_item(sign_in_event(now - i, user_name=f'user-{i % 3}')) for i in range(120)]
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item_format.encode(item))
+    failure_counter.record_failure(table, 'IAMUser#user-0', now)
+    return items
+
+
+def test_export_streams_every_activity(activities):
+    output = io.StringIO()
+
+    exported = report.export(report.segment_tables(TABLE_NAME, 4), output, page_size=7)
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert exported == len(lines) == 120
+    assert {line['id'] for line in lines} == {item['id'] for item in activities}
+    assert set(lines[0]) <= set(reporting.EXPORT_ATTRIBUTES)
+    assert 'raw' not in lines[0]
+
+
+def test_csv_export(activities):
+    output = io.StringIO()
+
+    report.export(report.segment_tables(TABLE_NAME, 2), output, attributes=['id', 'timestamp', 'userName'], output_format='csv')
+
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert len(rows) == 120
+    assert set(rows[0]) == {'id', 'timestamp', 'userName'}
+
+
+def test_stopped_export_releases_workers(activities, table):
+    pages = reporting.parallel_scan(report.segment_tables(TABLE_NAME, 4), page_size=1)
+
+    assert len(next(pages)) == 1
+    pages.close()
+
+
+def test_history_is_paginated_with_cursors(activities, table):
+    expected = sorted((item['timestamp'] for item in activities if item['userIdentity'] == 'IAMUser#user-1'), reverse=True)
+
+    timestamps, cursor = [], None
+    while True:
+        page = reporting.history(table, 'IAMUser#user-1', limit=15, cursor=cursor)
+        timestamps.extend(item['timestamp'] for item in page['items'])
+        cursor = page['cursor']
+        if not cursor:
+            break
+
+    assert timestamps == expected
+    first = reporting.history(table, 'IAMUser#user-1', limit=15)
+    with pytest.raises(ValueError):
+        reporting.history(table, 'IAMUser#user-2', cursor=first['cursor'])
+
+
+def test_history_time_range(activities, table):
+    now = max(item['timestamp'] for item in activities)
+
+    page = reporting.history(table, 'IAMUser#user-0', since=now - 29, until=now, newest_first=False)
+
+    assert [item['timestamp'] for item in page['items']] == sorted(t for t in range(now - 29, now + 1) if (now - t) % 3 == 0)
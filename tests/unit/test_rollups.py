@@ -0,0 +1,107 @@
+import time
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+
+from database import AwsActivityDatabaseStack
+from rollups import AwsActivityRollupStack
+from tools import report
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+
+from .test_archive import raw_items, stream_records
+from .test_buffered_ingestion import sqs_records
+
+add_layers_to_path()
+from activity_common import rollups  # noqa: E402
+
+DAY = 24 * 60 * 60
+SHARD = 'shardId-00000001650000000000-0a1b2c3d'
+
+
+def window(handler, batches, shard_id=SHARD):
+    # the invocations of one tumbling window, the state passed along as Lambda does
+    state = None
+    for i, batch in enumerate(batches):
+        result = handler({**batch, 'shardId': shard_id, 'state': state, 'isFinalInvokeForWindow': i == len(batches) - 1}, None)
+        state = result['state']
+    return state
+
+
+def stored_activities(table):
+    now = int(time.time())
+    events = [sign_in_event(now - day * DAY - i * 60, user_name=user, success=i % 3 != 0, mfa=i % 4 != 1,
+                            source_ip=f'198.51.100.{i % 5}')
+              for day in range(3) for i in range(12) for user in ('alice', 'bob')]
+    load_handler('store-sign-in-activity').handler(sqs_records(events), None)
+    return now, [item for item in raw_items(table) if 'eventName' in item]
+
+
+def test_windows_roll_activities_up_once(table, alerts):
+    now, items = stored_activities(table)
+    handler = load_handler('rollup-activity').handler
+    first, second = stream_records(items[:40]), stream_records(items[40:], sequence=100000000000000000040)
+
+    # a window of two invocations, applied when it closes
+    assert window(handler, [first, second]) == rollups.empty_window()
+    expected = rollups.summarize(item for item in items if item['userIdentity'] == 'IAMUser#alice')
+    assert rollups.query(table, 'IAMUser#alice', now - 2 * DAY, now) == expected
+    assert sum(day['signIns'] + day['failures'] for day in expected.values()) == 36
+    assert all(len(day['ips']) == 5 and day['noMfa'] > 0 for day in expected.values())
+
+    # the window retried, and replayed from another shard that has it applied already
+    window(handler, [first, second])
+    window(handler, [stream_records(items[:10])])
+    assert rollups.query(table, 'IAMUser#alice', now - 2 * DAY, now) == expected
+    # the next window of the shard, and an older one of another shard
+    alice = [item for item in items if item['userIdentity'] == 'IAMUser#alice']
+    window(handler, [stream_records(alice[:1], sequence=100000000000000000100)])
+    window(handler, [stream_records(alice[1:2], sequence=1000)], shard_id='shardId-00000001640000000000-00000000')
+    updated = rollups.query(table, 'IAMUser#alice', now - 2 * DAY, now)
+    assert sum(day['signIns'] + day['failures'] for day in updated.values()) == 38
+
+
+def test_removed_activities_are_uncounted_unless_expired(table, alerts):
+    now, items = stored_activities(table)
+    handler = load_handler('rollup-activity').handler
+    user = items[0]['userIdentity']
+    window(handler, [stream_records(items)])
+    before = rollups.query(table, user, now - 2 * DAY, now)
+
+    # a failed activity removed by store-sign-in-activity, then its expiry
+    removed = stream_records(items[:1], event_name='REMOVE', sequence=100000000000000000500)
+    expired = stream_records(items[1:2], event_name='REMOVE', sequence=100000000000000000501)
+    expired['Records'][0]['userIdentity'] = {'type': 'Service', 'principalId': 'dynamodb.amazonaws.com'}
+    window(handler, [{'Records': removed['Records'] + expired['Records']}])
+
+    after = rollups.query(table, user, now - 2 * DAY, now)
+    day = rollups.day_start(items[0]['timestamp'])
+    changed = {counter for counter in rollups.COUNTERS if after[day][counter] != before[day][counter]}
+    assert sum(before[day][counter] - after[day][counter] for counter in rollups.COUNTERS) == len(changed) >= 1
+    assert after[day]['ips'] == before[day]['ips']
+
+
+def test_daily_report_matches_the_activities(table, alerts):
+    now, items = stored_activities(table)
+    window(load_handler('rollup-activity').handler, [stream_records(items)])
+
+    for user in ('IAMUser#alice', 'IAMUser#bob'):
+        from_rollups = report.daily(table, user, now - 89 * DAY, now)
+        assert len(from_rollups) == 3
+        assert from_rollups == report.daily(table, user, now - 89 * DAY, now, from_activities=True)
+
+
+def test_rollup_stack_consumes_the_table_stream():
+    app = core.App()
+    database = AwsActivityDatabaseStack(app, 'aws-activity-db', stream=True)
+    template = assertions.Template.from_stack(AwsActivityRollupStack(app, 'aws-activity-rollup', dynamodb_table=database.table))
+
+    template.has_resource_properties('AWS::Lambda::EventSourceMapping', {
+        'TumblingWindowInSeconds': 60,
+        'StartingPosition': 'TRIM_HORIZON',
+        'ParallelizationFactor': assertions.Match.absent()
+    })
+    template.has_resource_properties('AWS::Lambda::Function', {
+        'FunctionName': 'rollup-aws-activity',
+        'Environment': {'Variables': assertions.Match.object_like({'ROLLUP_TTL_DAYS': '400'})}
+    })
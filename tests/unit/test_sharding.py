@@ -0,0 +1,80 @@
+import collections
+import json
+import time
+
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path, load_handler
+
+add_layers_to_path()
+from activity_common import reporting, sharding  # noqa: E402
+
+
+def stored_keys(table):
+    # userIdentity of every stored activity -> number of activities
+    items = table.scan(FilterExpression='attribute_exists(eventName)')['Items']
+    return collections.Counter(item['userIdentity'] for item in items)
+
+
+def all_pages(table, user_identity, **kwargs):
+    items, cursor = [], None
+    while True:
+        page = reporting.history(table, user_identity, limit=7, cursor=cursor, **kwargs)
+        items.extend(page['items'])
+        cursor = page['cursor']
+        if not cursor:
+            return items
+
+
+def test_sharded_reads_match_the_unsharded_path(table):
+    store = load_handler('store-sign-in-activity')
+    count = load_handler('count-failed-sign-in-attempt')
+    table.put_item(Item={**sharding.MAP_KEY, 'IAMUser#bob': 4})
+    now = int(time.time())
+    for i in range(60):
+        for user_name in ('alice', 'bob'):
+            store.handler(sign_in_event(now - i * 30, user_name=user_name, success=i % 3 != 0), None)
+
+    assert set(stored_keys(table)) == {'IAMUser#alice', 'IAMUser#bob', 'IAMUser#bob#1', 'IAMUser#bob#2', 'IAMUser#bob#3'}
+    for newest_first in (True, False):
+        alice = all_pages(table, 'IAMUser#alice', newest_first=newest_first)
+        bob = all_pages(table, 'IAMUser#bob', newest_first=newest_first)
+        assert len(bob) == 60
+        assert [item['timestamp'] for item in bob] == [item['timestamp'] for item in alice]
+        assert {item['userIdentity'] for item in bob} == {'IAMUser#bob'}
+    in_range = reporting.history(table, 'IAMUser#bob', since=now - 600, until=now - 300, limit=100)
+    assert len(in_range['items']) == 11 and in_range['cursor'] is None
+    assert (count.handler({'userIdentity': 'IAMUser#bob'}, None)['failedAttempts']
+            == count.handler({'userIdentity': 'IAMUser#alice'}, None)['failedAttempts'] == 20)
+
+
+def test_hot_user_is_sharded_and_partition_writes_are_bounded(table, alerts, monkeypatch):
+    monkeypatch.setenv('WRITE_SHARDS', '8')
+    monkeypatch.setenv('WRITE_SHARD_THRESHOLD', '20')
+    store = load_handler('store-sign-in-activity')
+    count = load_handler('count-failed-sign-in-attempt')
+    now = int(time.time())
+    batch_size = 50
+
+    for start in range(0, 200, batch_size):
+        events = [sign_in_event(now - i % 50, success=False) for i in range(start, start + batch_size)]
+        records = [{'messageId': f'message-{i}', 'body': json.dumps(event)} for i, event in enumerate(events)]
+        assert store.handler({'Records': records}, None) == {'batchItemFailures': []}
+    # a quiet user stays on one key
+    store.handler(sign_in_event(now, user_name='carol', success=False), None)
+
+    assert sharding.ShardMap(table).users() == {'IAMUser#alice': 8}
+    keys = stored_keys(table)
+    assert keys.pop('IAMUser#carol') == 1
+    assert len(keys) == 8 and sum(keys.values()) == 200
+    # the first batch crossed the threshold, the rest is spread over the shards
+    assert max(keys.values()) <= batch_size + 2 * (200 - batch_size) // 8
+    assert count.handler({'userIdentity': 'IAMUser#alice'}, None)['failedAttempts'] == 200
+    assert len(all_pages(table, 'IAMUser#alice')) == 200
+
+
+def test_logical_user_identity():
+    assert sharding.logical('IAMUser#alice#3') == 'IAMUser#alice'
+    assert sharding.logical('IAMUser#alice') == 'IAMUser#alice'
+    assert sharding.logical('IAMUser#7') == 'IAMUser#7'
+    assert sharding.shard_keys('Root#Root', 3) == ['Root#Root', 'Root#Root#1', 'Root#Root#2']
+    assert sharding.shard_key('Root#Root', 'event-id', 1) == 'Root#Root'
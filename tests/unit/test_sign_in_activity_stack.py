@@ -0,0 +1,177 @@
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+import pytest
+from aws_cdk import aws_sns as sns, aws_stepfunctions as sfn
+
+from database import AwsActivityDatabaseStack
+from tools import asl
+from tools.events import sign_in_event
+from tools.lambdas import add_layers_to_path
+
+add_layers_to_path()
+from activity_common import ip_database  # noqa: E402
+from login import AwsSignInActivityStack  # noqa: E402
+
+
+def synth(**kwargs):
+    app = core.App()
+    database = AwsActivityDatabaseStack(app, 'aws-activity-db')
+    notification = core.Stack(app, 'aws-activity-notification')
+    stack = AwsSignInActivityStack(app, 'aws-sign-in-activity',
+        dynamodb_table=database.table,
+        notification_topic=sns.Topic(notification, 'SnsTopic'),
+        **kwargs
+    )
+    return assertions.Template.from_stack(stack)
+
+
+@pytest.mark.parametrize('state_machine_type', [sfn.StateMachineType.STANDARD, sfn.StateMachineType.EXPRESS])
+def test_state_machine_type(state_machine_type):
+    template = synth(state_machine_type=state_machine_type)
+
+    template.has_resource_properties('AWS::StepFunctions::StateMachine', {
+        'StateMachineName': 'aws-sign-in-activity',
+        'StateMachineType': state_machine_type.value,
+        'LoggingConfiguration': {
+            'Level': 'ERROR',
+            'Destinations': assertions.Match.any_value()
+        }
+    })
+    template.has_resource_properties('AWS::Events::Rule', {
+        'Targets': [assertions.Match.object_like({
+            'Arn': {'Ref': assertions.Match.string_like_regexp('StepFunction')},
+            'RetryPolicy': {'MaximumRetryAttempts': 3}
+        })]
+    })
+    template.has_resource_properties('AWS::IAM::Policy', {
+        'PolicyDocument': {'Statement': [assertions.Match.object_like({'Action': 'states:StartExecution'})]}
+    })
+
+
+def test_express_deploys_the_standard_definition():
+    standard = asl.definition_from_template(synth().to_json())
+    express = asl.definition_from_template(synth(state_machine_type=sfn.StateMachineType.EXPRESS).to_json())
+
+    assert standard == express
+    lambda_tasks = [state for _, state in asl.states(standard) if asl.is_lambda_invoke(state)]
+    assert lambda_tasks and all(state['Retry'] for state in lambda_tasks)
+
+
+def test_buffered_mode_targets_queue():
+    template = synth(buffered=True, buffer_batch_size=50)
+
+    # ingestion queue, its DLQ and the alert digest queue
+    template.resource_count_is('AWS::SQS::Queue', 3)
+    template.has_resource_properties('AWS::Lambda::EventSourceMapping', {
+        'BatchSize': 50,
+        'FunctionResponseTypes': ['ReportBatchItemFailures']
+    })
+    template.has_resource_properties('AWS::Events::Rule', {
+        'Targets': [assertions.Match.object_like({
+            'Arn': {'Fn::GetAtt': [assertions.Match.string_like_regexp('Queue'), 'Arn']}
+        })]
+    })
+    # nothing starts a state machine, the store function applies the rules itself
+    template.resource_count_is('AWS::StepFunctions::StateMachine', 0)
+    template.resource_count_is('AWS::Logs::LogGroup', 0)
+    assert 'count-failed-sign-in-attempt' not in [function['Properties']['FunctionName']
+                                                  for function in template.find_resources('AWS::Lambda::Function').values()]
+
+
+def test_alerts_are_coalesced_before_publishing():
+    states = dict(asl.states(asl.definition_from_template(synth(alert_window=core.Duration.minutes(10)).to_json())))
+
+    for title in ['Root activity', 'no MFA', 'many failed sign-in attempts']:
+        assert states[f'Coalesce {title} alert']['Next'] == f'First {title} alert in window?'
+        assert states[f'First {title} alert in window?']['Choices'][0]['Next'] == f'Alert on {title}'
+
+
+def test_stateless_alerts_do_not_wait_on_the_store():
+    definition = asl.definition_from_template(synth().to_json())
+
+    parallel = definition['States'][definition['StartAt']]
+    assert parallel['Type'] == 'Parallel'
+    on_event, on_stored = parallel['Branches']
+    event_states, stored_states = dict(asl.states(on_event)), dict(asl.states(on_stored))
+    # the event branch alerts on Root activity and no MFA without a store or count step
+    assert on_event['StartAt'] == 'Name event'
+    assert not [name for name in event_states if name == 'Store activity' or name.startswith('Count')]
+    assert sorted(name for name in event_states if name.startswith('Alert on ')) == ['Alert on Root activity', 'Alert on no MFA']
+    assert event_states['Alert on no MFA']['Parameters']['Message.$'] == '$.alert.envelope'
+    # the rules on stored data, and the failure count, only run after the write
+    assert on_stored['StartAt'] == 'Store activity'
+    assert stored_states['Store activity']['Next'] == 'Duplicate event?'
+    assert 'Count many failed sign-in attempts' in stored_states
+    assert sorted(name for name in stored_states if name.startswith('Alert on ')) == [
+        'Alert on many failed sign-in attempts', 'Alert on new source IP']
+    assert stored_states['Rule no MFA?']['Choices'][0]['Next'] == 'Alerted on the event'
+    # a failed task ends its own branch, the execution fails after both
+    for branch_states, failed in ((event_states, 'Alerting on the event failed'), (stored_states, 'Storing or alerting failed')):
+        for state in branch_states.values():
+            if state['Type'] == 'Task':
+                assert state['Catch'] == [{'ErrorEquals': ['States.ALL'], 'ResultPath': '$.error', 'Next': failed}]
+    assert definition['States'][parallel['Next']]['Default'] == 'Done'
+
+
+def test_impossible_travel_needs_a_database_with_locations(tmp_path, monkeypatch):
+    def alert_states():
+        return [name for name, _ in asl.states(asl.definition_from_template(synth().to_json())) if name.startswith('Alert on ')]
+
+    # the bundled database has no locations
+    assert 'Alert on impossible travel' not in alert_states()
+    path = str(tmp_path / 'ip_ranges.db')
+    ip_database.build(path, [('198.51.100.0', '198.51.100.255', 64497, 'US', 'Example Cloud')],
+                      metadata={'locations': {'US': [38.79, -93.52]}})
+    monkeypatch.setenv('IP_DATABASE_PATH', path)
+    assert 'Alert on impossible travel' in alert_states()
+
+
+def test_sequential_alerts_store_first():
+    definition = asl.definition_from_template(synth(parallel_alerts=False).to_json())
+
+    assert definition['StartAt'] == 'Store activity'
+    assert not [state for state in definition['States'].values() if state['Type'] == 'Parallel']
+    assert definition['States']['Alert on Root activity']['Parameters']['Message.$'] == '$'
+
+
+def test_a_failed_store_does_not_hold_back_stateless_alerts():
+    machine = asl.StateMachine(asl.definition_from_template(synth().to_json()))
+    published = []
+
+    def store(payload):
+        raise RuntimeError('ProvisionedThroughputExceededException')
+
+    handlers = {'Store activity': store}
+    for name, _ in asl.states(machine.definition):
+        if name.startswith('Coalesce'):
+            handlers[name] = lambda payload: {'first': True, 'count': 1, 'envelope': {'id': payload['event']['id']}}
+        elif name.startswith('Alert on '):
+            handlers[name] = lambda parameters: published.append(parameters['Message'])
+
+    event = sign_in_event(0, identity_type='Root')
+    with pytest.raises(asl.ExecutionFailed) as failure:
+        machine.run(event, handlers=handlers, durations={'Store activity': 1000})
+
+    execution = failure.value.execution
+    assert published == [{'id': event['id']}]
+    assert execution.finished('Alert on Root activity') < execution.finished('Store activity')
+    assert execution.finished('Storing or alerting failed')
+
+
+def test_alert_window_is_bounded_by_sqs_delay():
+    with pytest.raises(ValueError):
+        synth(alert_window=core.Duration.minutes(16))
+
+
+def test_dashboard_and_alarms_on_emf_metrics():
+    template = synth()
+
+    template.resource_count_is('AWS::CloudWatch::Dashboard', 1)
+    template.resource_count_is('AWS::CloudWatch::Alarm', 3)
+    template.has_resource_properties('AWS::CloudWatch::Alarm', {
+        'AlarmName': 'aws-sign-in-activity-store-latency',
+        'Namespace': 'AwsActivityTracking',
+        'MetricName': 'InvocationDuration',
+        'ExtendedStatistic': 'p99',
+        'Dimensions': [{'Name': 'FunctionName', 'Value': {'Ref': assertions.Match.string_like_regexp('StoreActivityFunction')}}]
+    })
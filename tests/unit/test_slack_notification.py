@@ -0,0 +1,81 @@
+import json
+import time
+
+import pytest
+
+from tools.events import sign_in_event
+from tools.lambdas import load_handler
+from tools.webhook_stub import WebhookStub
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.deadline = time.monotonic() + remaining_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def sns_event(count):
+    # the state machine publishes the event as enriched by store-sign-in-activity
+    message = load_handler('store-sign-in-activity').build_item(sign_in_event(int(time.time()), identity_type='Root'))
+    return {'Records': [{'Sns': {
+        'MessageId': f'message-{i}',
+        'Message': json.dumps(message),
+        'MessageAttributes': {
+            'reason': {'Type': 'String', 'Value': 'RootActivity'},
+            'severity': {'Type': 'String', 'Value': 'Critical'},
+            'channel': {'Type': 'String', 'Value': 'alarm-aws'}
+        }
+    }} for i in range(count)]}
+
+
+def slack(webhook, **settings):
+    module = load_handler('slack-notification')
+    module.SLACK_CHANNELS['alarm-aws'] = webhook.url
+    for name, value in {'BACKOFF_BASE_SECONDS': 0.01, 'TIMEOUT_MARGIN_SECONDS': 0, **settings}.items():
+        setattr(module, name, value)
+    return module
+
+
+def test_every_record_is_sent_over_pooled_connections():
+    with WebhookStub(latency=0.05) as webhook:
+        module = slack(webhook)
+        start = time.monotonic()
+        result = module.handler(sns_event(16), Context(10000))
+        elapsed = time.monotonic() - start
+
+    assert result == {'sent': 16, 'failures': []}
+    assert len(webhook.requests) == 16
+    # concurrent: much faster than 16 sequential 50 ms posts
+    assert elapsed < 16 * 0.05
+    assert len(webhook.connections) <= module.MAX_WORKERS
+
+
+def test_rate_limit_and_server_errors_are_retried():
+    responses = [(429, {'Retry-After': '0.2'}), (503, {}), (500, {})]
+    with WebhookStub(responses=responses) as webhook:
+        result = slack(webhook).handler(sns_event(3), Context(10000))
+
+    assert result['sent'] == 3
+    assert len(webhook.requests) == 3
+
+
+def test_failures_are_reported_per_record():
+    with WebhookStub(responses=[(400, {})]) as webhook:
+        module = slack(webhook, MAX_WORKERS=1)
+        with pytest.raises(module.NotificationError) as error:
+            module.handler(sns_event(2), Context(10000))
+
+    assert [failure['messageId'] for failure in json.loads(str(error.value))] == ['message-0']
+    assert len(webhook.requests) == 1
+
+
+def test_retries_stop_at_the_lambda_deadline():
+    with WebhookStub(responses=[(503, {})] * 1000) as webhook:
+        module = slack(webhook)
+        start = time.monotonic()
+        with pytest.raises(module.NotificationError):
+            module.handler(sns_event(1), Context(500))
+
+    assert time.monotonic() - start < 1
@@ -0,0 +1,33 @@
+import pytest
+
+from tools.events import sign_in_event
+from tools.lambdas import load_handler
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2022-04-20T10:00:00Z', 1650448800),
+    ('2022-04-20T12:00:00+02:00', 1650448800),
+    # not ISO-8601, handled by the dateutil fallback
+    ('Wed, 20 Apr 2022 10:00:00 GMT', 1650448800)
+])
+def test_parse_timestamp(value, expected):
+    store = load_handler('store-sign-in-activity')
+
+    assert store.parse_timestamp(value) == expected
+
+
+def test_table_is_reused_across_invocations(table):
+    store = load_handler('store-sign-in-activity')
+
+    assert store.get_table() is store.get_table()
+
+
+@pytest.mark.parametrize('identity_type, user_name, expected', [
+    ('IAMUser', 'alice', 'IAMUser#alice'),
+    ('Root', None, 'Root#Root'),
+    ('AssumedRole', 'admin', 'AssumedRole#admin')
+])
+def test_user_identity(identity_type, user_name, expected):
+    store = load_handler('store-sign-in-activity')
+
+    assert store.build_item(sign_in_event(1650448800, identity_type=identity_type, user_name=user_name))['userIdentity'] == expected
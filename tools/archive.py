@@ -0,0 +1,98 @@
+"""Archive of the activity table: batch export and queries by user and time.
+
+    python -m tools.archive export s3://BUCKET[/PREFIX] | DIR [--segments 8] [--flush-every 50000]
+    python -m tools.archive query s3://BUCKET[/PREFIX] | DIR --since EPOCH [--until EPOCH] [--user USER_IDENTITY]
+
+export archives every activity of the table, e.g. those stored before the table stream
+was archived or to rebuild the archive; objects of the same activities overwrite each
+other, readers drop any other duplicate. query prints the archived activities of a time
+range (of one user) as JSON lines, reading only the day and user bucket partitions that
+can hold them, and how many objects and bytes it read. The archive layout is described
+in activity_common/archive.py.
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+import boto3
+
+from tools.lambdas import add_layers_to_path
+from tools.local_aws import TABLE_NAME
+from tools.report import segment_tables
+
+add_layers_to_path()
+from activity_common import archive, item_format, reporting  # noqa: E402
+
+
+def open_store(location: str):
+    # (store, prefix) of s3://bucket/prefix or a local directory
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return archive.S3Store(boto3.client('s3'), bucket), prefix.strip('/') or archive.PREFIX
+    return archive.LocalStore(location), archive.PREFIX
+
+
+def activity(item: dict) -> dict:
+    # scanned items are plain JSON, with the compressed raw event in base64
+    if isinstance(item.get('raw'), str):
+        item = {**item, 'raw': base64.b64decode(item['raw'])}
+    return item_format.decode(item)
+
+
+def export(tables: list, store, prefix: str = archive.PREFIX, flush_every: int = 50000) -> tuple:
+    # archives every activity of the table, scanned one segment per table. Activities are
+    # written by `flush_every`, so objects stay large and memory bounded. Returns the
+    # number of activities and of objects written
+    pending, exported, objects = [], 0, 0
+    for page in reporting.parallel_scan(tables, attributes=None):
+        pending.extend(activity(item) for item in page)
+        if len(pending) >= flush_every:
+            objects += len(archive.write(store, pending, prefix))
+            exported += len(pending)
+            pending = []
+    if pending:
+        objects += len(archive.write(store, pending, prefix))
+        exported += len(pending)
+    return exported, objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--table', default=os.getenv('DYNAMODB_TABLE_NAME', TABLE_NAME))
+    parser.add_argument('--endpoint-url', help='AWS endpoint, e.g. a local DynamoDB or moto server')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='archive every activity of the table')
+    export_parser.add_argument('location', help='s3://bucket[/prefix] or a local directory')
+    export_parser.add_argument('--segments', type=int, default=8)
+    export_parser.add_argument('--flush-every', type=int, default=50000, help='activities per write')
+
+    query_parser = commands.add_parser('query', help='archived activities of a time range')
+    query_parser.add_argument('location', help='s3://bucket[/prefix] or a local directory')
+    query_parser.add_argument('--since', type=int, required=True)
+    query_parser.add_argument('--until', type=int)
+    query_parser.add_argument('--user', help='e.g. IAMUser#alice')
+    args = parser.parse_args()
+    if args.endpoint_url:
+        os.environ['AWS_ENDPOINT_URL'] = args.endpoint_url
+
+    store, prefix = open_store(args.location)
+    start = time.perf_counter()
+    if args.command == 'export':
+        exported, objects = export(segment_tables(args.table, args.segments), store, prefix, args.flush_every)
+        print(f'{exported} activities archived into {objects} objects in {time.perf_counter() - start:.1f}s',
+              file=sys.stderr)
+        return
+
+    found = 0
+    for found, item in enumerate(archive.query(store, args.since, args.until or int(time.time()), args.user, prefix), 1):
+        print(json.dumps(item, separators=(',', ':'), sort_keys=True))
+    print(f'{found} activities from {store.reads} objects ({store.bytes_read} bytes) in '
+          f'{time.perf_counter() - start:.2f}s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+import copy
+import json
+import re
+import uuid
+
+
+# A small local interpreter for the Amazon States Language definitions synthesized by
+# the stacks. It supports the states and Choice operators this project uses, runs Task
+# states through Python callables and keeps a simulated clock, so graphs can be
+# walked, costed and timed without AWS. The branches of a Parallel state run one after
+# the other, each from the clock the Parallel state was entered at.
+
+
+def states(definition: dict):
+    # (name, state) of every state, those of Parallel branches included
+    for name, state in definition['States'].items():
+        yield name, state
+        for branch in state.get('Branches', ()):
+            yield from states(branch)
+
+
+def is_lambda_invoke(state: dict) -> bool:
+    # the partition in the resource arn is a reference in synthesized templates
+    return state.get('Resource', '').endswith(':states:::lambda:invoke')
+
+
+class ExecutionFailed(RuntimeError):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.execution = None
+
+
+class Execution:
+    def __init__(self, execution_id: str = None):
+        self.id = execution_id or f'execution:{uuid.uuid4()}'
+        self.output = None
+        # (state name, state type, started ms, finished ms), in the order states are entered
+        self.states = []
+
+    @property
+    def transitions(self) -> int:
+        return len(self.states)
+
+    def finished(self, state_name: str):
+        for name, _, _, finished in self.states:
+            if name == state_name:
+                return finished
+        return None
+
+
+def definition_from_template(template: dict, logical_id_prefix: str = 'StepFunction') -> dict:
+    # DefinitionString is a Fn::Join of literal parts and references, which are replaced
+    # by placeholders since only the shape of the graph matters here
+    for logical_id, resource in template['Resources'].items():
+        if resource['Type'] == 'AWS::StepFunctions::StateMachine' and logical_id.startswith(logical_id_prefix):
+            definition = resource['Properties']['DefinitionString']
+            if isinstance(definition, dict):
+                _, parts = definition['Fn::Join']
+                definition = ''.join(part if isinstance(part, str) else 'placeholder' for part in parts)
+            return json.loads(definition)
+    raise KeyError(f'No state machine {logical_id_prefix} in template')
+
+
+def _keys(path: str) -> list:
+    # $.a.b[0].c -> ['a', 'b', 0, 'c']
+    return [int(index) if index else key for key, index in re.findall(r'\.([^.\[]+)|\[(\d+)\]', path[1:])]
+
+
+def get_path(data, path: str):
+    if path == '$':
+        return data
+    for key in _keys(path):
+        if isinstance(key, int):
+            if not isinstance(data, list) or key >= len(data):
+                raise KeyError(path)
+        elif not isinstance(data, dict) or key not in data:
+            raise KeyError(path)
+        data = data[key]
+    return data
+
+
+def set_path(data, path: str, value):
+    if path == '$':
+        return value
+    data = copy.deepcopy(data)
+    target = data
+    keys = path[2:].split('.')
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+    target[keys[-1]] = value
+    return data
+
+
+def resolve_parameters(template, data, context: dict = None):
+    # `$$.` paths are read from the context object, e.g. $$.Execution.Id
+    if isinstance(template, dict):
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith('.$'):
+                resolved[key[:-2]] = get_path(context or {}, value[1:]) if value.startswith('$$.') else get_path(data, value)
+            else:
+                resolved[key] = resolve_parameters(value, data, context)
+        return resolved
+    if isinstance(template, list):
+        return [resolve_parameters(value, data, context) for value in template]
+    return template
+
+
+def _compare(rule: dict, data) -> bool:
+    if 'And' in rule:
+        return all(_compare(r, data) for r in rule['And'])
+    if 'Or' in rule:
+        return any(_compare(r, data) for r in rule['Or'])
+    if 'Not' in rule:
+        return not _compare(rule['Not'], data)
+
+    try:
+        value = get_path(data, rule['Variable'])
+        present = True
+    except KeyError:
+        value, present = None, False
+    if 'IsPresent' in rule:
+        return present == rule['IsPresent']
+    if not present:
+        # Step Functions fails the execution on a missing variable as well
+        raise ExecutionFailed(f'States.Runtime: invalid path {rule["Variable"]}')
+
+    for operator, expected in rule.items():
+        if operator == 'Variable' or operator == 'Next':
+            continue
+        if operator.endswith('Path'):
+            operator, expected = operator[:-4], get_path(data, expected)
+        if operator == 'StringEquals':
+            return isinstance(value, str) and value == expected
+        if operator == 'BooleanEquals':
+            return isinstance(value, bool) and value == expected
+        numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+        if operator == 'NumericEquals':
+            return numeric and value == expected
+        if operator == 'NumericGreaterThan':
+            return numeric and value > expected
+        if operator == 'NumericGreaterThanEquals':
+            return numeric and value >= expected
+        if operator == 'NumericLessThan':
+            return numeric and value < expected
+        if operator == 'NumericLessThanEquals':
+            return numeric and value <= expected
+        if operator == 'IsNull':
+            return (value is None) == expected
+        if operator == 'IsNumeric':
+            return numeric == expected
+        if operator == 'IsString':
+            return isinstance(value, str) == expected
+        if operator == 'IsBoolean':
+            return isinstance(value, bool) == expected
+        raise NotImplementedError(f'Choice operator {operator}')
+    raise ValueError(f'Invalid choice rule {rule}')
+
+
+class StateMachine:
+    def __init__(self, definition: dict):
+        self.definition = definition
+
+    def run(self, data, handlers: dict = None, durations: dict = None, transition_ms: float = 0,
+            execution_id: str = None) -> Execution:
+        # handlers: state name -> callable(input) returning the task result, tasks without a
+        # handler return their input. durations: state name -> simulated milliseconds
+        execution = Execution(execution_id)
+        try:
+            execution.output, _ = self._run(self.definition, data, handlers or {}, durations or {}, transition_ms, 0.0, execution)
+        except ExecutionFailed as error:
+            error.execution = execution
+            raise
+        return execution
+
+    def _run(self, definition, data, handlers, durations, transition_ms, clock, execution):
+        state_name = definition['StartAt']
+        while True:
+            state = definition['States'][state_name]
+            started = clock
+            clock += transition_ms + durations.get(state_name, 0)
+            raw, data = data, self._input(state, data)
+
+            if state['Type'] == 'Choice':
+                next_state = state.get('Default')
+                for rule in state['Choices']:
+                    if _compare(rule, data):
+                        next_state = rule['Next']
+                        break
+                execution.states.append((state_name, 'Choice', started, clock))
+                if next_state is None:
+                    raise ExecutionFailed(f'States.NoChoiceMatched in {state_name}')
+                state_name = next_state
+                continue
+
+            if state['Type'] == 'Parallel':
+                results, finished = [], clock
+                for branch in state['Branches']:
+                    result, branch_clock = self._run(branch, data, handlers, durations, transition_ms, clock, execution)
+                    results.append(result)
+                    finished = max(finished, branch_clock)
+                clock = finished
+                result = results
+            elif state['Type'] == 'Task':
+                try:
+                    result = self._task(state_name, state, data, handlers, {'Execution': {'Id': execution.id}})
+                except ExecutionFailed:
+                    raise
+                except Exception as error:
+                    catcher = self._catcher(state, error)
+                    if catcher is None:
+                        raise
+                    # the error replaces the result, and the Catch its Next
+                    execution.states.append((state_name, 'Task', started, clock))
+                    error_output = {'Error': type(error).__name__, 'Cause': str(error)}
+                    data = set_path(raw, catcher['ResultPath'], error_output) if catcher.get('ResultPath', '$') is not None else raw
+                    state_name = catcher['Next']
+                    continue
+            elif state['Type'] == 'Pass':
+                result = state.get('Result', data)
+            elif state['Type'] == 'Fail':
+                execution.states.append((state_name, 'Fail', started, clock))
+                raise ExecutionFailed(f'{state.get("Error", "States.Fail")} in {state_name}')
+            else:
+                # Succeed, Wait
+                result = data
+
+            execution.states.append((state_name, state['Type'], started, clock))
+            data = self._output(state, raw, data, result)
+            if state['Type'] == 'Succeed' or state.get('End'):
+                return data, clock
+            state_name = state['Next']
+
+    @staticmethod
+    def _input(state, data):
+        if 'InputPath' in state:
+            data = get_path(data, state['InputPath'])
+        return data
+
+    @staticmethod
+    def _catcher(state, error):
+        # the first Catch of a task matching a handler error
+        for catcher in state.get('Catch', ()):
+            errors = catcher['ErrorEquals']
+            if 'States.ALL' in errors or 'States.TaskFailed' in errors or type(error).__name__ in errors:
+                return catcher
+        return None
+
+    @staticmethod
+    def _task(state_name, state, data, handlers, context):
+        parameters = resolve_parameters(state['Parameters'], data, context) if 'Parameters' in state else data
+        handler = handlers.get(state_name)
+        if is_lambda_invoke(state):
+            payload = parameters.get('Payload', data) if isinstance(parameters, dict) else data
+            return {'Payload': handler(payload) if handler else payload, 'StatusCode': 200}
+        return handler(parameters) if handler else {}
+
+    @staticmethod
+    def _output(state, raw, data, result):
+        # `raw` is the input of the state, `data` what its InputPath selected. ResultPath
+        # places the result into the raw input
+        if state['Type'] in ('Choice', 'Succeed', 'Wait'):
+            output = data
+        else:
+            if 'ResultSelector' in state:
+                result = resolve_parameters(state['ResultSelector'], result)
+            output = set_path(raw, state.get('ResultPath', '$'), result) if state.get('ResultPath', '$') is not None else raw
+        if 'OutputPath' in state:
+            output = get_path(output, state['OutputPath'])
+        return output
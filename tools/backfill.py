@@ -0,0 +1,338 @@
+"""Backfill the activity table from a CloudTrail log archive.
+
+    python -m tools.backfill SOURCE [--table aws-activity] [--workers 4] [--checkpoint backfill.ckpt]
+                             [--alert --topic-arn ARN --digest-queue-url URL] [--endpoint-url URL]
+
+SOURCE is a local directory or an s3://bucket/prefix of gzipped CloudTrail log files.
+Log files are streamed record by record and processed in parallel, one file per worker
+process. aws.signin events are stored exactly like store-sign-in-activity stores them,
+keyed by their CloudTrail eventID, so a replay rewrites the same items. Every finished
+file is appended to the checkpoint, and a rerun with the same checkpoint skips it.
+
+Alerting is off by default. With --alert, every event is written with a conditional put
+and only events that were not stored yet go through the alerting decision tree, so a
+replay never alerts twice. Failed attempts are counted as of the time of each event.
+"""
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+import boto3
+from botocore.exceptions import ClientError
+
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.local_aws import TABLE_NAME
+
+add_layers_to_path()
+from activity_common import alerting, coalescing, failure_counter, item_format  # noqa: E402
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# items buffered per worker before they are written with BatchWriteItem
+WRITE_BATCH_SIZE = 500
+RECORDS_START = re.compile(r'"Records"\s*:\s*\[')
+SIGN_IN_EVENT_SOURCE = 'signin.amazonaws.com'
+
+# per worker process
+_store = None
+_table = None
+_options = {}
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = load_handler('store-sign-in-activity')
+    return _store
+
+
+def get_table():
+    global _table
+    if _table is None:
+        _table = boto3.resource('dynamodb').Table(_options.get('table_name', TABLE_NAME))
+    return _table
+
+
+def init_worker(options: dict):
+    global _options, _table
+    _options = options
+    _table = None
+
+
+def list_files(source: str):
+    # CloudTrail log files of a local directory or an S3 prefix, in delivery order
+    if source.startswith('s3://'):
+        bucket, _, prefix = source[len('s3://'):].partition('/')
+        paginator = boto3.client('s3').get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for entry in page.get('Contents', []):
+                if is_log_file(entry['Key']):
+                    yield f's3://{bucket}/{entry["Key"]}'
+    else:
+        for directory, directories, files in os.walk(source):
+            directories.sort()
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                if is_log_file(path):
+                    yield path
+
+
+def is_log_file(path: str) -> bool:
+    # digest files are delivered next to the logs but carry no records
+    return path.endswith('.json.gz') and 'CloudTrail-Digest' not in path
+
+
+def open_file(path: str):
+    if path.startswith('s3://'):
+        bucket, _, key = path[len('s3://'):].partition('/')
+        body = boto3.client('s3').get_object(Bucket=bucket, Key=key)['Body']
+    else:
+        body = open(path, 'rb')
+    return gzip.GzipFile(fileobj=body, mode='rb')
+
+
+def iter_records(stream, chunk_size: int = CHUNK_SIZE):
+    # yields the entries of the "Records" array of a CloudTrail log file one at a time,
+    # holding at most the record being decoded and one chunk in memory
+    decoder = json.JSONDecoder()
+    reader = io.TextIOWrapper(stream, encoding='utf-8')
+    buffer = ''
+    while True:
+        chunk = reader.read(chunk_size)
+        buffer += chunk
+        match = RECORDS_START.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        if not chunk:
+            return
+        # the key may be split across chunks
+        buffer = buffer[-32:]
+
+    position = 0
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer):
+            if buffer[position] == ']':
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield record
+                continue
+        elif eof:
+            raise ValueError('Unterminated Records array')
+        chunk = reader.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def is_sign_in(record: dict) -> bool:
+    return record.get('eventSource') == SIGN_IN_EVENT_SOURCE
+
+
+def to_event(record: dict) -> dict:
+    # the EventBridge envelope the rule would have delivered. CloudTrail doesn't keep the
+    # EventBridge id, the eventID makes replays idempotent instead
+    return {
+        'version': '0',
+        'id': record['eventID'],
+        'detail-type': 'AWS Console Sign In via CloudTrail' if record.get('eventType') == 'AwsConsoleSignIn' else 'AWS API Call via CloudTrail',
+        'source': 'aws.signin',
+        'account': record.get('recipientAccountId'),
+        'time': record['eventTime'],
+        'region': record.get('awsRegion'),
+        'resources': [],
+        'detail': record
+    }
+
+
+def counted(records, stats: dict):
+    for record in records:
+        stats['records'] += 1
+        yield record
+
+
+def sign_in_events(records):
+    for record in records:
+        if is_sign_in(record):
+            yield get_store().build_item(to_event(record))
+
+
+def batches(events, size: int = WRITE_BATCH_SIZE):
+    # BatchWriteItem rejects duplicated keys in one request
+    batch = {}
+    for event in events:
+        batch[(event['id'], event['timestamp'])] = event
+        if len(batch) >= size:
+            yield list(batch.values())
+            batch = {}
+    if batch:
+        yield list(batch.values())
+
+
+def put_new(table, event: dict) -> bool:
+    # False when a previous run already stored the event
+    try:
+        table.put_item(Item=item_format.encode(event), ConditionExpression='attribute_not_exists(id)')
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+
+def apply_alerting(table, events, now: int) -> int:
+    # the decision tree of the state machine, with failures counted as of each event
+    sns = boto3.client('sns')
+    sqs = boto3.client('sqs')
+    published = 0
+    for event in sorted(events, key=lambda e: e['timestamp']):
+        if alerting.is_failed_console_login(event):
+            failure_counter.record_failure(table, event['userIdentity'], event['timestamp'], event_ids=[event['id']])
+        if alerting.needs_failed_attempts(event):
+            event['failedAttempts'] = failure_counter.count_failures(table, event['userIdentity'], event['timestamp'])
+        reason = alerting.classify(event)
+        if not reason:
+            continue
+        result = coalescing.coalesce(table, sqs, _options['digest_queue_url'], event['userIdentity'], reason,
+                                     event['timestamp'], now, _options.get('alert_window', coalescing.DEFAULT_WINDOW_SECONDS),
+                                     event['id'])
+        if result['first']:
+            alerting.publish(sns, _options['topic_arn'], event, reason)
+            published += 1
+    return published
+
+
+def backfill_file(path: str) -> dict:
+    table = get_table()
+    stats = {'file': path, 'records': 0, 'events': 0, 'written': 0, 'existing': 0, 'alerts': 0}
+    with open_file(path) as stream:
+        for batch in batches(sign_in_events(counted(iter_records(stream), stats))):
+            stats['events'] += len(batch)
+            if _options.get('alert'):
+                new = [event for event in batch if put_new(table, event)]
+                stats['existing'] += len(batch) - len(new)
+                stats['written'] += len(new)
+                stats['alerts'] += apply_alerting(table, new, int(time.time()))
+                continue
+            unprocessed = get_store().batch_put(table, [item_format.encode(event) for event in batch])
+            if unprocessed:
+                # not checkpointed, the next run retries the whole file
+                raise RuntimeError(f'{len(unprocessed)} items of {path} could not be written')
+            stats['written'] += len(batch)
+    return stats
+
+
+def read_checkpoint(path: str) -> dict:
+    done = {}
+    if path and os.path.exists(path):
+        with open(path) as checkpoint:
+            for line in checkpoint:
+                if line.strip():
+                    stats = json.loads(line)
+                    done[stats['file']] = stats
+    return done
+
+
+def run(source: str, options: dict, workers: int = os.cpu_count(), checkpoint: str = None) -> dict:
+    # returns the totals of the files processed by this run
+    done = read_checkpoint(checkpoint)
+    files = (path for path in list_files(source) if path not in done)
+    totals = {'files': 0, 'skipped': len(done), 'failed': 0, 'records': 0, 'events': 0, 'written': 0, 'existing': 0, 'alerts': 0}
+    log = open(checkpoint, 'a') if checkpoint else None
+
+    def finished(path, future):
+        try:
+            stats = future.result()
+        except Exception:
+            logger.exception(f'Cannot backfill {path}')
+            totals['failed'] += 1
+            return
+        totals['files'] += 1
+        for name in ('records', 'events', 'written', 'existing', 'alerts'):
+            totals[name] += stats[name]
+        if log:
+            log.write(json.dumps(stats) + '\n')
+            log.flush()
+            os.fsync(log.fileno())
+        logger.info(f'{path}: {stats["events"]} sign-in events of {stats["records"]} records')
+
+    try:
+        if workers <= 1:
+            init_worker(options)
+            for path in files:
+                future = Future()
+                try:
+                    future.set_result(backfill_file(path))
+                except Exception as error:
+                    future.set_exception(error)
+                finished(path, future)
+            return totals
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(options,)) as executor:
+            # a bounded number of files in flight, S3 prefixes can list millions of keys
+            pending = {}
+            for path in files:
+                pending[executor.submit(backfill_file, path)] = path
+                if len(pending) >= workers * 4:
+                    completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        finished(pending.pop(future), future)
+            for future in wait(pending).done:
+                finished(pending.pop(future), future)
+        return totals
+    finally:
+        if log:
+            log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help='local directory or s3://bucket/prefix of CloudTrail log files')
+    parser.add_argument('--table', default=os.getenv('DYNAMODB_TABLE_NAME', TABLE_NAME))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--checkpoint', help='file recording finished log files, reused to resume')
+    parser.add_argument('--alert', action='store_true', help='alert on events that were not stored yet')
+    parser.add_argument('--topic-arn', default=os.getenv('SNS_TOPIC_ARN'))
+    parser.add_argument('--digest-queue-url', default=os.getenv('DIGEST_QUEUE_URL'))
+    parser.add_argument('--alert-window', type=int, default=coalescing.DEFAULT_WINDOW_SECONDS)
+    parser.add_argument('--endpoint-url', help='AWS endpoint, e.g. a local DynamoDB or moto server')
+    args = parser.parse_args()
+    if args.alert and not (args.topic_arn and args.digest_queue_url):
+        parser.error('--alert needs --topic-arn and --digest-queue-url')
+    if args.endpoint_url:
+        # inherited by the worker processes
+        os.environ['AWS_ENDPOINT_URL'] = args.endpoint_url
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    start = time.perf_counter()
+    totals = run(args.source, {
+        'table_name': args.table,
+        'alert': args.alert,
+        'topic_arn': args.topic_arn,
+        'digest_queue_url': args.digest_queue_url,
+        'alert_window': args.alert_window
+    }, workers=args.workers, checkpoint=args.checkpoint)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({**totals, 'seconds': round(elapsed, 1), 'events_per_second': round(totals['events'] / elapsed)}))
+    if totals['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import base64
+import json
+import math
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer
+
+
+# moto reports a constant ConsumedCapacity, so capacity is estimated offline with
+# DynamoDB's documented item sizing rules instead
+
+
+def _number_size(value) -> int:
+    digits = str(abs(Decimal(str(value)))).replace('.', '').strip('0') or '0'
+    return math.ceil(len(digits) / 2) + 1
+
+
+def value_size(value) -> int:
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (int, float, Decimal)):
+        return _number_size(value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, 'value') and isinstance(value.value, (bytes, bytearray)):
+        # boto3.dynamodb.types.Binary
+        return len(value.value)
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode('utf-8')) + 1 + value_size(v) for k, v in value.items())
+    if isinstance(value, (set, frozenset)):
+        return sum(value_size(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(1 + value_size(v) for v in value)
+    raise TypeError(f'Unsupported DynamoDB value: {type(value).__name__}')
+
+
+def item_size(item: dict) -> int:
+    return sum(len(name.encode('utf-8')) + value_size(value) for name, value in item.items())
+
+
+def write_units(item: dict) -> int:
+    return math.ceil(item_size(item) / 1024) or 1
+
+
+def read_units(total_size: int, consistent: bool = False) -> float:
+    # Query and Scan round the summed size of every item read per page, not per item
+    units = math.ceil(total_size / 4096) or 1
+    return units if consistent else units / 2
+
+
+def project(item: dict, attributes) -> dict:
+    return {name: value for name, value in item.items() if name in attributes}
+
+
+class CapacityMeter:
+    # Estimates the capacity consumed by every DynamoDB call of a boto3 session, per
+    # `stage` (set by the caller). Writes of items carrying `index_key` are billed again
+    # for the index projection of `index_attributes`.
+
+    def __init__(self, index_key: str = 'userIdentity', index_attributes=()):
+        self.index_key = index_key
+        self.index_attributes = {'id', 'timestamp', index_key, *index_attributes}
+        self.stage = None
+        self.usage = {}
+        self._deserializer = TypeDeserializer()
+
+    def attach(self, session):
+        # clients created by the session afterwards are metered
+        session.events.register('before-call.dynamodb', self._before_call)
+        session.events.register('after-call.dynamodb', self._after_call)
+        return self
+
+    def add(self, rcu: float = 0, wcu: float = 0):
+        usage = self.usage.setdefault(self.stage, {'rcu': 0.0, 'wcu': 0.0})
+        usage['rcu'] += rcu
+        usage['wcu'] += wcu
+
+    def _item(self, value: dict) -> dict:
+        return {name: self._value(attribute) for name, attribute in value.items()}
+
+    def _value(self, attribute: dict):
+        (kind, value), = attribute.items()
+        if kind == 'B':
+            return self._binary(value)
+        if kind == 'BS':
+            return {self._binary(v) for v in value}
+        if kind == 'M':
+            return self._item(value)
+        if kind == 'L':
+            return [self._value(v) for v in value]
+        return self._deserializer.deserialize(attribute)
+
+    @staticmethod
+    def _binary(value):
+        # base64 in request bodies, already decoded in parsed responses
+        return base64.b64decode(value) if isinstance(value, str) else value
+
+    def _write(self, item: dict) -> int:
+        units = write_units(item)
+        if self.index_key in item:
+            units += write_units(project(item, self.index_attributes))
+        return units
+
+    def _before_call(self, params, context, **kwargs):
+        context['capacity_request'] = json.loads(params['body'] or b'{}')
+
+    def _after_call(self, parsed, model, context, **kwargs):
+        request = context.pop('capacity_request', {})
+        operation = model.name
+        if 'Error' in parsed:
+            return
+        if operation == 'PutItem':
+            self.add(wcu=self._write(self._item(request['Item'])))
+        elif operation == 'BatchWriteItem':
+            for requests in request['RequestItems'].values():
+                for entry in requests:
+                    item = entry.get('PutRequest', {}).get('Item') or entry['DeleteRequest']['Key']
+                    self.add(wcu=self._write(self._item(item)))
+        elif operation in ('UpdateItem', 'DeleteItem'):
+            # the larger of the item before and after the write, approximated by what is known
+            item = self._item(parsed.get('Attributes') or request['Key'])
+            self.add(wcu=self._write(item))
+        elif operation == 'GetItem':
+            item = self._item(parsed.get('Item', {}))
+            self.add(rcu=read_units(item_size(item), consistent=request.get('ConsistentRead', False)))
+        elif operation in ('Query', 'Scan'):
+            size = sum(item_size(self._item(item)) for item in parsed.get('Items', []))
+            self.add(rcu=read_units(size, consistent=request.get('ConsistentRead', False)))
@@ -0,0 +1,157 @@
+import gzip
+import json
+import random
+import uuid
+from datetime import datetime, timezone
+
+
+ACCOUNT_ID = '123456789012'
+
+# share of each kind of sign-in in generated traffic
+DEFAULT_MIX = {
+    'iam_mfa': 0.80,
+    'iam_no_mfa': 0.05,
+    'iam_failure': 0.10,
+    'root': 0.01,
+    'assumed_role': 0.04
+}
+
+
+def _iso(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def user_identity(identity_type: str, user_name: str = None) -> dict:
+    if identity_type == 'Root':
+        return {
+            'type': 'Root',
+            'principalId': ACCOUNT_ID,
+            'arn': f'arn:aws:iam::{ACCOUNT_ID}:root',
+            'accountId': ACCOUNT_ID
+        }
+    if identity_type == 'AssumedRole':
+        return {
+            'type': 'AssumedRole',
+            'principalId': f'AROAEXAMPLE:{user_name}',
+            'arn': f'arn:aws:sts::{ACCOUNT_ID}:assumed-role/{user_name}/session',
+            'accountId': ACCOUNT_ID,
+            'sessionContext': {
+                'sessionIssuer': {
+                    'type': 'Role',
+                    'principalId': 'AROAEXAMPLE',
+                    'arn': f'arn:aws:iam::{ACCOUNT_ID}:role/{user_name}',
+                    'accountId': ACCOUNT_ID,
+                    'userName': user_name
+                }
+            }
+        }
+    return {
+        'type': 'IAMUser',
+        'principalId': 'AIDAEXAMPLE',
+        'arn': f'arn:aws:iam::{ACCOUNT_ID}:user/{user_name}',
+        'accountId': ACCOUNT_ID,
+        'userName': user_name
+    }
+
+
+def sign_in_event(timestamp: int, user_name: str = 'alice', identity_type: str = 'IAMUser', success: bool = True,
+                  mfa: bool = True, source_ip: str = '198.51.100.10', event_name: str = 'ConsoleLogin') -> dict:
+    # EventBridge envelope of a CloudTrail console sign-in event, as received by the state machine
+    event_id = str(uuid.uuid4())
+    detail = {
+        'eventVersion': '1.08',
+        'userIdentity': user_identity(identity_type, user_name),
+        'eventTime': _iso(timestamp),
+        'eventSource': 'signin.amazonaws.com',
+        'eventName': event_name,
+        'awsRegion': 'us-east-1',
+        'sourceIPAddress': source_ip,
+        'userAgent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0 Safari/537.36',
+        'requestParameters': None,
+        'responseElements': {'ConsoleLogin': 'Success' if success else 'Failure'},
+        'additionalEventData': {
+            'LoginTo': 'https://console.aws.amazon.com/console/home?state=hashArgs%23&isauthcode=true',
+            'MobileVersion': 'No',
+            'MFAUsed': 'Yes' if mfa else 'No'
+        },
+        'eventID': str(uuid.uuid4()),
+        'readOnly': False,
+        'eventType': 'AwsConsoleSignIn',
+        'managementEvent': True,
+        'recipientAccountId': ACCOUNT_ID,
+        'eventCategory': 'Management'
+    }
+    if not success:
+        detail['errorMessage'] = 'Failed authentication'
+
+    return {
+        'version': '0',
+        'id': event_id,
+        'detail-type': 'AWS Console Sign In via CloudTrail',
+        'source': 'aws.signin',
+        'account': ACCOUNT_ID,
+        'time': _iso(timestamp),
+        'region': 'us-east-1',
+        'resources': [],
+        'detail': detail
+    }
+
+
+def event_of_kind(kind: str, timestamp: int, user_name: str = 'alice', source_ip: str = '198.51.100.10') -> dict:
+    if kind not in DEFAULT_MIX:
+        raise ValueError(f'Unknown event kind {kind}, expected one of {", ".join(DEFAULT_MIX)}')
+    if kind == 'root':
+        return sign_in_event(timestamp, identity_type='Root', source_ip=source_ip)
+    if kind == 'assumed_role':
+        return sign_in_event(timestamp, user_name=user_name, identity_type='AssumedRole', source_ip=source_ip)
+    return sign_in_event(timestamp, user_name=user_name, success=kind != 'iam_failure', mfa=kind != 'iam_no_mfa',
+                         source_ip=source_ip)
+
+
+def generate(count: int, start: int, duration: int = 3600, mix: dict = None, users: int = 50,
+             bursts: int = 0, burst_size: int = 10, burst_seconds: int = 60, seed: int = None):
+    # `count` sign-in events spread over [start, start + duration) in time order, drawn from
+    # `mix` (kind -> share). `bursts` brute-force bursts of `burst_size` failed logins of one
+    # user within `burst_seconds` are mixed in on top of them
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = list(mix), list(mix.values())
+    planned = []
+    for _ in range(count):
+        planned.append((start + rng.randrange(duration), rng.choices(kinds, weights)[0], f'user-{rng.randrange(users)}'))
+    for burst in range(bursts):
+        burst_start = start + rng.randrange(max(1, duration - burst_seconds))
+        user_name = f'brute-force-{burst}'
+        for _ in range(burst_size):
+            planned.append((burst_start + rng.randrange(burst_seconds), 'iam_failure', user_name))
+    for timestamp, kind, user_name in sorted(planned):
+        source_ip = f'203.0.113.{rng.randrange(1, 255)}'
+        yield event_of_kind(kind, timestamp, user_name=user_name, source_ip=source_ip)
+
+
+def cloudtrail_log(records) -> bytes:
+    # a gzipped CloudTrail log file as delivered to the trail bucket
+    return gzip.compress(json.dumps({'Records': list(records)}).encode('utf-8'))
+
+
+def api_call_record(timestamp: int, user_name: str = 'alice', event_name: str = 'DescribeInstances') -> dict:
+    # an unrelated management event, the bulk of every CloudTrail archive
+    return {
+        'eventVersion': '1.08',
+        'userIdentity': user_identity('IAMUser', user_name),
+        'eventTime': _iso(timestamp),
+        'eventSource': 'ec2.amazonaws.com',
+        'eventName': event_name,
+        'awsRegion': 'us-east-1',
+        'sourceIPAddress': '198.51.100.10',
+        'userAgent': 'aws-cli/2.5.0 Python/3.9.11 Linux/5.10.0 exe/x86_64.ubuntu.20',
+        'requestParameters': {'maxResults': 1000},
+        'responseElements': None,
+        'requestID': str(uuid.uuid4()),
+        'eventID': str(uuid.uuid4()),
+        'readOnly': True,
+        'eventType': 'AwsApiCall',
+        'managementEvent': True,
+        'recipientAccountId': ACCOUNT_ID,
+        'eventCategory': 'Management'
+    }
@@ -0,0 +1,196 @@
+import json
+import math
+import os
+import time
+
+import boto3
+from moto import mock_aws
+
+from tools import asl, capacity
+from tools.lambdas import add_layers_to_path, load_handler
+from tools.local_aws import TABLE_NAME, create_activity_table
+from tools.webhook_stub import WebhookStub
+
+add_layers_to_path()
+from activity_common import coalescing, item_format  # noqa: E402
+
+
+# End-to-end local run of the sign-in pipeline. Every event goes through the synthesized
+# state machine (tools/asl.py) with the real handlers: store -> decision -> count ->
+# coalesce -> SNS publish, stateless rules next to the store step. Every published alert then goes through slack-notification to
+# a local webhook stub. DynamoDB, SNS and SQS are moto, so latencies are only comparable
+# between runs of the harness. Capacity is estimated per call (see tools/capacity.py).
+STAGES = ['store', 'count', 'coalesce', 'publish', 'notify', 'execution']
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'DYNAMODB_TABLE_NAME': TABLE_NAME,
+    'LOG_LEVEL': 'WARNING'
+}
+
+
+def stage_of(state_name: str, state: dict):
+    if state['Type'] != 'Task':
+        return None
+    if not asl.is_lambda_invoke(state):
+        return 'publish'
+    if state_name.startswith('Count'):
+        return 'count'
+    if state_name.startswith('Coalesce'):
+        return 'coalesce'
+    return 'store'
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class Harness:
+    def __init__(self, definition: dict, webhook_latency: float = 0.0, rate_limit: float = None,
+                 alert_window_seconds: int = coalescing.DEFAULT_WINDOW_SECONDS):
+        # `definition` is the state machine as synthesized, see tools.workflow_cost.synth_definition
+        self.machine = asl.StateMachine(definition)
+        self.definition = definition
+        self.webhook = WebhookStub(latency=webhook_latency, rate_limit=rate_limit)
+        self.alert_window_seconds = alert_window_seconds
+        self.meter = capacity.CapacityMeter(index_attributes=item_format.HOT_ATTRIBUTES)
+        self._mock = mock_aws()
+        self._environment = {}
+
+    def __enter__(self):
+        environment = {**ENVIRONMENT, 'ALERT_WINDOW_SECONDS': str(self.alert_window_seconds)}
+        self._environment = {name: os.environ.get(name) for name in environment}
+        os.environ.update(environment)
+        self._mock.start()
+        self.webhook.__enter__()
+
+        boto3.setup_default_session()
+        self.meter.attach(boto3.DEFAULT_SESSION)
+        create_activity_table(boto3.resource('dynamodb'))
+        self.sns = boto3.client('sns')
+        self.sqs = boto3.client('sqs')
+        self.topic_arn = self.sns.create_topic(Name='aws-activity-notification')['TopicArn']
+        # SNS -> SQS stands in for the Lambda subscription of slack-notification
+        self.subscription_url = self.sqs.create_queue(QueueName='slack-notification')['QueueUrl']
+        queue_arn = self.sqs.get_queue_attributes(QueueUrl=self.subscription_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+        self.sns.subscribe(TopicArn=self.topic_arn, Protocol='sqs', Endpoint=queue_arn)
+        os.environ['SNS_TOPIC_ARN'] = self.topic_arn
+        os.environ['DIGEST_QUEUE_URL'] = self.sqs.create_queue(QueueName='alert-digest')['QueueUrl']
+
+        # fresh modules, like new Lambda containers
+        self.store = load_handler('store-sign-in-activity')
+        self.count = load_handler('count-failed-sign-in-attempt')
+        self.coalesce = load_handler('coalesce-alert')
+        self.notify = load_handler('slack-notification')
+        self.notify.SLACK_CHANNELS['alarm-aws'] = self.webhook.url
+        return self
+
+    def __exit__(self, *exc):
+        self.webhook.__exit__(*exc)
+        self._mock.stop()
+        for name, value in self._environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    def _handlers(self, latencies):
+        def timed(stage, function):
+            def call(payload):
+                self.meter.stage = stage
+                start = time.perf_counter()
+                try:
+                    return function(payload)
+                finally:
+                    latencies[stage].append(time.perf_counter() - start)
+            return call
+
+        def publish(parameters):
+            return self.sns.publish(TopicArn=self.topic_arn, Message=json.dumps(parameters['Message'], default=str),
+                                    MessageAttributes=parameters['MessageAttributes'])
+
+        functions = {
+            'store': lambda payload: self.store.handler(payload, None),
+            'count': lambda payload: self.count.handler(payload, None),
+            'coalesce': lambda payload: self.coalesce.handler(payload, None),
+            'publish': publish
+        }
+        return {
+            name: timed(stage_of(name, state), functions[stage_of(name, state)])
+            for name, state in asl.states(self.definition) if stage_of(name, state)
+        }
+
+    def published(self):
+        # SNS notifications as delivered to a Lambda subscriber
+        records = []
+        while True:
+            messages = self.sqs.receive_message(QueueUrl=self.subscription_url, MaxNumberOfMessages=10).get('Messages', [])
+            if not messages:
+                return records
+            for message in messages:
+                body = json.loads(message['Body'])
+                records.append({'Sns': {
+                    'MessageId': body['MessageId'],
+                    'Message': body['Message'],
+                    'MessageAttributes': body.get('MessageAttributes', {})
+                }})
+                self.sqs.delete_message(QueueUrl=self.subscription_url, ReceiptHandle=message['ReceiptHandle'])
+
+    def run(self, events) -> dict:
+        latencies = {stage: [] for stage in STAGES}
+        handlers = self._handlers(latencies)
+        self.meter.usage = {}
+        executions = 0
+        failures = {}
+        coalesced = 0
+
+        for event in events:
+            executions += 1
+            start = time.perf_counter()
+            try:
+                execution = self.machine.run(event, handlers=handlers)
+            except asl.ExecutionFailed as error:
+                failures[str(error)] = failures.get(str(error), 0) + 1
+                continue
+            finally:
+                latencies['execution'].append(time.perf_counter() - start)
+            # the output of the sequential graph, or those of both branches of the parallel one
+            outputs = [execution.output[branch] for branch in ('event', 'stored') if branch in execution.output]
+            coalesced += sum(1 for output in outputs or [execution.output] if 'alert' in output and not output['alert']['first'])
+
+        alerts = {}
+        self.meter.stage = 'notify'
+        for record in self.published():
+            reason = record['Sns']['MessageAttributes']['reason']['Value']
+            alerts[reason] = alerts.get(reason, 0) + 1
+            start = time.perf_counter()
+            self.notify.handler({'Records': [record]}, None)
+            latencies['notify'].append(time.perf_counter() - start)
+
+        # an execution consumes what its states consume
+        self.meter.usage['execution'] = {
+            unit: sum(self.meter.usage.get(stage, {}).get(unit, 0.0) for stage in ('store', 'count', 'coalesce', 'publish'))
+            for unit in ('rcu', 'wcu')
+        }
+        stages = {}
+        for stage in STAGES:
+            usage = self.meter.usage.get(stage, {'rcu': 0.0, 'wcu': 0.0})
+            stages[stage] = {
+                'count': len(latencies[stage]),
+                'p50_ms': percentile(latencies[stage], 0.50) * 1000,
+                'p99_ms': percentile(latencies[stage], 0.99) * 1000,
+                'rcu': usage['rcu'],
+                'wcu': usage['wcu']
+            }
+        return {
+            'events': executions,
+            'failed_executions': failures,
+            'stages': stages,
+            'alerts': alerts,
+            'coalesced': coalesced,
+            'notified': len(self.webhook.requests)
+        }
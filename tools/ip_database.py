@@ -0,0 +1,109 @@
+"""Build the IP enrichment database of store-sign-in-activity.
+
+    python -m tools.ip_database --asn ip2asn-v4.tsv [--asn ip2asn-v6.tsv] [--list NAME=FILE ...]
+                                [--cities cities15000.txt] [--output PATH]
+
+--asn reads the range files of https://iptoasn.com (range_start, range_end, AS number,
+country code, AS description, tab separated, .gz accepted). --list reads a known-bad list
+with one CIDR or address per line, comments after ';' or '#', e.g. the Spamhaus DROP
+list. --cities reads a GeoNames cities file (https://download.geonames.org/export/dump/,
+cities15000.zip unzipped) into the location of every country, the population-weighted
+center of its cities, which the impossible travel detection of the sign-in baseline
+compares. The database is written into the common layer by default, next to the module that
+reads it, so the next deploy ships it. Without sources the bundled reserved ranges are
+rebuilt from assets/ip-database.
+"""
+import argparse
+import datetime
+import gzip
+import math
+import os
+
+from tools.lambdas import ROOT_DIR, add_layers_to_path
+
+add_layers_to_path()
+from activity_common import ip_database  # noqa: E402
+
+SOURCES_DIR = os.path.join(ROOT_DIR, 'assets', 'ip-database')
+
+
+def _open(path: str):
+    return gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else open(path, encoding='utf-8')
+
+
+def read_asn_ranges(path: str):
+    # (first, last, asn, country, org) of every routed or reserved range
+    with _open(path) as file:
+        for line in file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 5 or line.startswith('#'):
+                continue
+            first, last, asn, country, org = fields[:5]
+            if org == 'Not routed':
+                continue
+            yield first, last, int(asn), '' if country in ('None', 'Unknown') else country, org
+
+
+def read_list(path: str) -> list:
+    networks = []
+    with _open(path) as file:
+        for line in file:
+            network = line.split(';', 1)[0].split('#', 1)[0].strip()
+            if network:
+                networks.append(network)
+    return networks
+
+
+def read_locations(path: str) -> dict:
+    # {country: [latitude, longitude]}, the population-weighted mean of the city positions
+    # as unit vectors, so countries across the antimeridian are not averaged to the middle
+    sums = {}
+    with _open(path) as file:
+        for line in file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 15 or not fields[8]:
+                continue
+            latitude, longitude = math.radians(float(fields[4])), math.radians(float(fields[5]))
+            weight = max(int(fields[14] or 0), 1)
+            x, y, z, total = sums.get(fields[8], (0.0, 0.0, 0.0, 0))
+            sums[fields[8]] = (x + weight * math.cos(latitude) * math.cos(longitude),
+                               y + weight * math.cos(latitude) * math.sin(longitude),
+                               z + weight * math.sin(latitude), total + weight)
+    return {
+        country: [round(math.degrees(math.atan2(z, math.hypot(x, y))), 2), round(math.degrees(math.atan2(y, x)), 2)]
+        for country, (x, y, z, _) in sorted(sums.items())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--asn', action='append', default=[], help='iptoasn.com range file')
+    parser.add_argument('--list', action='append', default=[], metavar='NAME=FILE', help='known-bad list')
+    parser.add_argument('--cities', help='GeoNames cities file, locates countries')
+    parser.add_argument('--output', default=ip_database.DEFAULT_PATH)
+    args = parser.parse_args()
+
+    asn_files = args.asn or [os.path.join(SOURCES_DIR, 'reserved.tsv')]
+    lists = {}
+    for entry in args.list:
+        name, _, path = entry.partition('=')
+        if not path:
+            parser.error(f'--list expects NAME=FILE, got {entry}')
+        lists[name] = read_list(path)
+
+    ranges = [entry for path in asn_files for entry in read_asn_ranges(path)]
+    sources = asn_files + [entry.partition('=')[2] for entry in args.list] + ([args.cities] if args.cities else [])
+    metadata = {
+        'built': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'sources': [os.path.basename(path) for path in sources]
+    }
+    if args.cities:
+        metadata['locations'] = read_locations(args.cities)
+    metadata = ip_database.build(args.output, ranges, lists, metadata=metadata)
+    print(f'{metadata["ipv4"]} IPv4 and {metadata["ipv6"]} IPv6 ranges, {len(lists)} lists, '
+          f'{len(metadata.get("locations", {}))} country locations, '
+          f'{os.path.getsize(args.output)} bytes written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import importlib.util
+import os
+import sys
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS_DIR = os.path.join(ROOT_DIR, 'assets', 'lambda-functions')
+LAYERS_DIR = os.path.join(ROOT_DIR, 'assets', 'lambda-layers')
+
+
+def add_layers_to_path():
+    # the Lambda runtime puts <layer>/python of every attached layer on sys.path
+    for layer in sorted(os.listdir(LAYERS_DIR)):
+        path = os.path.join(LAYERS_DIR, layer, 'python')
+        if os.path.isdir(path) and path not in sys.path:
+            sys.path.append(path)
+
+
+def load_handler(function_name: str):
+    # every function ships an `index.py`, so load each one under its own module name.
+    # A fresh module is returned on every call, like a new Lambda container.
+    add_layers_to_path()
+    spec = importlib.util.spec_from_file_location(
+        function_name.replace('-', '_'),
+        os.path.join(FUNCTIONS_DIR, function_name, 'index.py')
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,62 @@
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import boto3
+
+
+TABLE_NAME = 'aws-activity'
+INDEX_ATTRIBUTES = ['eventName', 'identityType', 'userName', 'consoleLogin', 'mfaUsed', 'sourceIPAddress', 'userAgent']
+
+
+def create_activity_table(dynamodb=None, table_name: str = TABLE_NAME, index_attributes: list = None):
+    # mirrors AwsActivityDatabaseStack in database/infra.py; `index_attributes` projected
+    # into UserIdentityIndex instead, e.g. the legacy full-event ones
+    dynamodb = dynamodb or boto3.resource('dynamodb')
+    table = dynamodb.create_table(
+        TableName=table_name,
+        AttributeDefinitions=[
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'timestamp', 'AttributeType': 'N'},
+            {'AttributeName': 'userIdentity', 'AttributeType': 'S'}
+        ],
+        KeySchema=[
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'UserIdentityIndex',
+            'KeySchema': [
+                {'AttributeName': 'userIdentity', 'KeyType': 'HASH'},
+                {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {
+                'ProjectionType': 'INCLUDE',
+                'NonKeyAttributes': index_attributes or INDEX_ATTRIBUTES
+            }
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.wait_until_exists()
+    return table
+
+
+def start_moto_server():
+    # a moto server in its own process, for clients in several processes or threads.
+    # Returns (process, endpoint url)
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen([sys.executable, '-m', 'moto.server', '-p', str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f'{url}/moto-api/', timeout=1)
+            return server, url
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('moto server did not start')
@@ -0,0 +1,145 @@
+"""Reports on the activity table: parallel export and per-user history.
+
+    python -m tools.report export [--segments 8] [--format ndjson|csv] [--attributes ...] [--output FILE]
+    python -m tools.report history USER_IDENTITY [--since EPOCH] [--until EPOCH] [--limit 50] [--cursor CURSOR]
+    python -m tools.report daily USER_IDENTITY [--days 90] [--until EPOCH] [--from-activities]
+
+export runs a segmented Scan with one worker per segment and streams every page to the
+output as it arrives, so the table is never held in memory. By default only the keys
+and the hot attributes are read, not the compressed raw event (--attributes all reads
+everything). history prints one page of a user's activities from UserIdentityIndex and
+the cursor of the next page. daily prints the sign-ins, failures, sign-ins without MFA
+and source addresses of a user per UTC day, from the rollups maintained from the table
+stream (activity_common/rollups.py), or computed from every activity in
+UserIdentityIndex with --from-activities, e.g. for days before the rollups were deployed.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import boto3
+
+from tools.lambdas import add_layers_to_path
+from tools.local_aws import TABLE_NAME
+
+add_layers_to_path()
+from activity_common import reporting, rollups  # noqa: E402
+
+
+class NdjsonWriter:
+    def __init__(self, output, attributes):
+        self.output = output
+
+    def write(self, items):
+        for item in items:
+            self.output.write(json.dumps(item, separators=(',', ':'), sort_keys=True) + '\n')
+
+
+class CsvWriter:
+    # one column per attribute, nested values as JSON
+    def __init__(self, output, attributes):
+        if not attributes:
+            raise ValueError('csv needs the list of attributes')
+        self.writer = csv.DictWriter(output, fieldnames=list(attributes), extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, items):
+        self.writer.writerows(
+            {name: json.dumps(value) if isinstance(value, (dict, list)) else value for name, value in item.items()}
+            for item in items
+        )
+
+
+WRITERS = {'ndjson': NdjsonWriter, 'csv': CsvWriter}
+
+
+def segment_tables(table_name: str, segments: int) -> list:
+    # resources are not thread safe, each segment worker gets its own
+    return [boto3.session.Session().resource('dynamodb').Table(table_name) for _ in range(segments)]
+
+
+def export(tables: list, output, attributes=reporting.EXPORT_ATTRIBUTES, output_format: str = 'ndjson',
+           page_size: int = None) -> int:
+    # scans one segment per table, returns the number of activities written
+    writer = WRITERS[output_format](output, attributes)
+    exported = 0
+    for page in reporting.parallel_scan(tables, attributes, page_size):
+        writer.write(page)
+        exported += len(page)
+    return exported
+
+
+def daily(table, user_identity: str, since: int, until: int, from_activities: bool = False) -> dict:
+    # {day start: daily report} of the days with activities
+    if not from_activities:
+        return rollups.query(table, user_identity, since, until)
+    activities, cursor = [], None
+    while True:
+        page = reporting.history(table, user_identity, rollups.day_start(since), rollups.day_start(until) + rollups.DAY - 1,
+                                 limit=reporting.MAX_PAGE_SIZE, cursor=cursor)
+        activities.extend(page['items'])
+        cursor = page['cursor']
+        if not cursor:
+            return rollups.summarize(activities)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--table', default=os.getenv('DYNAMODB_TABLE_NAME', TABLE_NAME))
+    parser.add_argument('--endpoint-url', help='AWS endpoint, e.g. a local DynamoDB or moto server')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='export every activity')
+    export_parser.add_argument('--segments', type=int, default=8)
+    export_parser.add_argument('--format', choices=sorted(WRITERS), default='ndjson')
+    export_parser.add_argument('--attributes', nargs='+', default=list(reporting.EXPORT_ATTRIBUTES),
+                               help='attributes to read, "all" for whole items')
+    export_parser.add_argument('--output', help='file to write, default stdout')
+
+    history_parser = commands.add_parser('history', help='one page of the activities of a user')
+    history_parser.add_argument('user_identity', help='e.g. IAMUser#alice')
+    history_parser.add_argument('--since', type=int)
+    history_parser.add_argument('--until', type=int)
+    history_parser.add_argument('--limit', type=int, default=reporting.DEFAULT_PAGE_SIZE)
+    history_parser.add_argument('--cursor')
+    history_parser.add_argument('--oldest-first', action='store_true')
+
+    daily_parser = commands.add_parser('daily', help='daily sign-in counters of a user')
+    daily_parser.add_argument('user_identity', help='e.g. IAMUser#alice')
+    daily_parser.add_argument('--days', type=int, default=90)
+    daily_parser.add_argument('--until', type=int)
+    daily_parser.add_argument('--from-activities', action='store_true', help='read every activity instead of the rollups')
+    args = parser.parse_args()
+    if args.endpoint_url:
+        os.environ['AWS_ENDPOINT_URL'] = args.endpoint_url
+
+    if args.command == 'daily':
+        until = args.until or int(time.time())
+        reports = daily(boto3.resource('dynamodb').Table(args.table), args.user_identity,
+                        until - (args.days - 1) * rollups.DAY, until, args.from_activities)
+        for day, report in sorted(reports.items()):
+            print(json.dumps({'date': rollups.date(day), **report}, separators=(',', ':')))
+        return
+
+    if args.command == 'history':
+        page = reporting.history(boto3.resource('dynamodb').Table(args.table), args.user_identity, args.since,
+                                 args.until, args.limit, args.cursor, newest_first=not args.oldest_first)
+        print(json.dumps(page, indent=2))
+        return
+
+    attributes = None if args.attributes == ['all'] else args.attributes
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        start = time.perf_counter()
+        exported = export(segment_tables(args.table, args.segments), output, attributes, args.format)
+        print(f'{exported} activities exported in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Replay alert rules over a CloudTrail archive, to tune them before deploying.
+
+    python -m tools.rule_replay SOURCE [--rules rules.json]
+
+SOURCE is read like tools/backfill.py reads it, nothing is written. failedAttempts is
+counted in process over the minute buckets of count-failed-sign-in-attempt, so log files
+are expected in delivery (time) order. Prints the alerts every rule would have raised.
+"""
+import argparse
+import collections
+import json
+import time
+
+from tools import backfill
+from tools.lambdas import add_layers_to_path
+
+add_layers_to_path()
+from activity_common import alerting, failure_counter, rules  # noqa: E402
+
+
+def replay(events, evaluator: rules.Evaluator) -> dict:
+    # reason -> alerts, for events in time order
+    failures = collections.defaultdict(collections.deque)
+    alerts = collections.Counter()
+    for event in events:
+        if alerting.is_failed_console_login(event):
+            failures[event['userIdentity']].append(failure_counter.bucket_of(event['timestamp']))
+        if 'failedAttempts' in evaluator.needs(event):
+            buckets = failures[event['userIdentity']]
+            oldest = failure_counter.bucket_of(event['timestamp']) - failure_counter.WINDOW_SECONDS + failure_counter.BUCKET_SECONDS
+            while buckets and buckets[0] < oldest:
+                buckets.popleft()
+            event['failedAttempts'] = len(buckets)
+        reason = evaluator.classify(event)
+        if reason:
+            alerts[reason] += 1
+    return dict(alerts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help='local directory or s3://bucket/prefix of CloudTrail log files')
+    parser.add_argument('--rules', default=rules.RULES_FILE, help='rules file, default the deployed rules')
+    args = parser.parse_args()
+
+    evaluator = rules.Evaluator(rules.load(args.rules))
+    counted = {'events': 0}
+
+    def events():
+        for path in backfill.list_files(args.source):
+            with backfill.open_file(path) as stream:
+                for event in backfill.sign_in_events(backfill.iter_records(stream)):
+                    counted['events'] += 1
+                    yield event
+
+    start = time.perf_counter()
+    alerts = replay(events(), evaluator)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'events': counted['events'], 'alerts': alerts, 'seconds': round(elapsed, 1)}, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
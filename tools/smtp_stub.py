@@ -0,0 +1,96 @@
+import socketserver
+import threading
+import time
+from email import message_from_bytes, policy
+
+
+class SmtpStub:
+    # A local stand-in for an SMTP relay, without STARTTLS or authentication.
+    # `latency` delays the reply to every message, `responses` is an optional list of
+    # SMTP reply codes given to messages in order before falling back to 250.
+    # Accepted messages are kept in `messages` as {'sender', 'recipients', 'message'}.
+
+    def __init__(self, latency: float = 0.0, responses=None):
+        self.latency = latency
+        self.responses = list(responses or [])
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def settings(self) -> dict:
+        # SMTP settings of the notification function
+        host, port = self._server.server_address
+        return {'host': host, 'port': port, 'sender': 'alerts@example.com', 'starttls': False}
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_response(self) -> int:
+        with self._lock:
+            return self.responses.pop(0) if self.responses else 250
+
+    def _handler(self):
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            # multiline replies are written line by line, don't let Nagle hold the last one
+            disable_nagle_algorithm = True
+
+            def reply(self, line: str):
+                self.wfile.write(f'{line}\r\n'.encode('ascii'))
+
+            def handle(self):
+                with stub._lock:
+                    stub.connections += 1
+                sender, recipients = None, []
+                self.reply('220 localhost SMTP stub')
+                for line in self.rfile:
+                    command = line.decode('ascii', 'replace').strip()
+                    verb = command.split(' ', 1)[0].upper()
+                    if verb == 'EHLO':
+                        self.reply('250-localhost')
+                        self.reply('250 8BITMIME')
+                    elif verb == 'HELO':
+                        self.reply('250 localhost')
+                    elif verb == 'MAIL':
+                        sender, recipients = command.split(':', 1)[1].strip().strip('<>'), []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        recipients.append(command.split(':', 1)[1].strip().strip('<>'))
+                        self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        data = []
+                        for data_line in self.rfile:
+                            if data_line == b'.\r\n':
+                                break
+                            data.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                        if stub.latency:
+                            time.sleep(stub.latency)
+                        code = stub._next_response()
+                        if code < 300:
+                            with stub._lock:
+                                stub.messages.append({
+                                    'sender': sender,
+                                    'recipients': recipients,
+                                    'message': message_from_bytes(b''.join(data), policy=policy.default)
+                                })
+                        self.reply(f'{code} {"OK" if code < 300 else "Try again later" if code < 500 else "Rejected"}')
+                    elif verb in ('RSET', 'NOOP'):
+                        self.reply('250 OK')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('502 Command not implemented')
+
+        return Handler
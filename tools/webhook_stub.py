@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class WebhookStub:
+    # A local stand-in for Slack incoming webhooks (or any JSON webhook).
+    # `latency` delays every response, `responses` is an optional list of
+    # (status, headers) returned in order before falling back to 200, and
+    # `rate_limit` answers 429 with Retry-After beyond that many requests per second.
+
+    def __init__(self, latency: float = 0.0, responses=None, rate_limit: float = None):
+        self.latency = latency
+        self.responses = list(responses or [])
+        self.rate_limit = rate_limit
+        self.rate_limited = 0
+        self._window = (0, 0)
+        self.requests = []
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/services/webhook'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_response(self):
+        with self._lock:
+            if self.responses:
+                return self.responses.pop(0)
+            if self.rate_limit:
+                second, count = self._window
+                now = int(time.monotonic())
+                count = count + 1 if now == second else 1
+                self._window = (now, count)
+                if count > self.rate_limit:
+                    self.rate_limited += 1
+                    return 429, {'Retry-After': '1'}
+            return 200, {}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # keep-alive responses are written in two parts, don't let Nagle hold the second
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, headers = stub._next_response()
+                with stub._lock:
+                    stub.connections.add(self.client_address)
+                    if status < 300:
+                        stub.requests.append(json.loads(body or b'null'))
+                payload = b'ok' if status < 300 else b'error'
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
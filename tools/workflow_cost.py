@@ -0,0 +1,128 @@
+"""Cost and latency model of the sign-in state machine as a STANDARD or EXPRESS workflow.
+
+    python -m tools.workflow_cost --events-per-day 200000 [--mix root=0.01 ...]
+
+The synthesized definition is walked with tools/asl.py for a representative event of
+each kind, so the model follows the real graph. Prices default to us-east-1 list
+prices; latencies are assumptions to be replaced with measured values.
+"""
+import argparse
+import math
+import time
+
+from tools import asl
+from tools.events import DEFAULT_MIX, event_of_kind
+from tools.lambdas import add_layers_to_path, load_handler
+
+
+# price per state transition (STANDARD), per request and per GB-second (EXPRESS)
+STANDARD_TRANSITION_PRICE = 0.025 / 1000
+EXPRESS_REQUEST_PRICE = 1.00 / 1000000
+EXPRESS_GB_SECOND_PRICE = 0.00001667
+# EXPRESS bills duration in 100 ms increments, memory in 64 MB increments
+EXPRESS_BILLING_MS = 100
+EXPRESS_MEMORY_GB = 64 / 1024
+
+# assumed overhead of entering a state, and of starting an execution, per workflow type
+DEFAULT_TRANSITION_MS = {'STANDARD': 40, 'EXPRESS': 10}
+DEFAULT_START_MS = {'STANDARD': 150, 'EXPRESS': 30}
+DEFAULT_TASK_MS = {'lambda': 60, 'sns': 40}
+
+
+def synth_definition(state_machine_type: str = 'STANDARD', parallel_alerts: bool = True) -> dict:
+    import aws_cdk as cdk
+    from aws_cdk import assertions, aws_sns as sns, aws_stepfunctions as sfn
+    from database import AwsActivityDatabaseStack
+    add_layers_to_path()
+    from login import AwsSignInActivityStack
+
+    app = cdk.App()
+    database = AwsActivityDatabaseStack(app, 'database')
+    topic_stack = cdk.Stack(app, 'notification')
+    stack = AwsSignInActivityStack(app, 'sign-in',
+        dynamodb_table=database.table,
+        notification_topic=sns.Topic(topic_stack, 'Topic'),
+        state_machine_type=getattr(sfn.StateMachineType, state_machine_type),
+        parallel_alerts=parallel_alerts
+    )
+    return asl.definition_from_template(assertions.Template.from_stack(stack).to_json())
+
+
+def walk(definition: dict, kind: str, failed_attempts: int, task_ms: dict, transition_ms: float):
+    # returns (transitions, duration ms) of one execution
+    machine = asl.StateMachine(definition)
+    durations = {}
+    for name, state in asl.states(definition):
+        if state['Type'] == 'Task':
+            durations[name] = task_ms['lambda'] if asl.is_lambda_invoke(state) else task_ms['sns']
+    # the store step decides the shape of the input of every later state
+    build_item = load_handler('store-sign-in-activity').build_item
+    handlers = {'Store activity': lambda payload: build_item(payload['event'])}
+    for name, _ in asl.states(definition):
+        if name.startswith('Count'):
+            handlers[name] = lambda payload: {**payload, 'failedAttempts': failed_attempts}
+        elif name.startswith('Coalesce'):
+            # the first alert of its window, the expensive path
+            handlers[name] = lambda payload: {'first': True, 'count': 1, 'envelope': {}}
+    try:
+        execution = machine.run(event_of_kind(kind, int(time.time())), handlers=handlers, durations=durations, transition_ms=transition_ms)
+    except asl.ExecutionFailed as error:
+        # e.g. an identity type the graph has no branch for: the execution fails there,
+        # still billed for the states entered so far
+        execution = error.execution
+    return execution.transitions, max(finished for *_, finished in execution.states)
+
+
+def model(definition: dict, events_per_day: int, mix: dict, failed_attempts: int, task_ms: dict,
+          transition_ms: dict, start_ms: dict) -> dict:
+    total = sum(mix.values())
+    results = {}
+    for workflow_type in ('STANDARD', 'EXPRESS'):
+        transitions = latency = billed_ms = 0.0
+        for kind, share in mix.items():
+            count, duration = walk(definition, kind, failed_attempts, task_ms, transition_ms[workflow_type])
+            duration += start_ms[workflow_type]
+            weight = share / total
+            transitions += weight * count
+            latency += weight * duration
+            billed_ms += weight * math.ceil(duration / EXPRESS_BILLING_MS) * EXPRESS_BILLING_MS
+
+        per_month = events_per_day * 30
+        if workflow_type == 'STANDARD':
+            cost = per_month * transitions * STANDARD_TRANSITION_PRICE
+        else:
+            cost = per_month * (EXPRESS_REQUEST_PRICE + billed_ms / 1000 * EXPRESS_MEMORY_GB * EXPRESS_GB_SECOND_PRICE)
+        results[workflow_type] = {'transitions': transitions, 'latency_ms': latency, 'monthly_cost': cost}
+    return results
+
+
+def parse_mix(values):
+    mix = dict(DEFAULT_MIX)
+    for value in values or []:
+        kind, share = value.split('=')
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'Unknown event kind {kind}, expected one of {", ".join(DEFAULT_MIX)}')
+        mix[kind] = float(share)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events-per-day', type=int, required=True)
+    parser.add_argument('--mix', nargs='*', metavar='KIND=SHARE', help=f'event mix, default {DEFAULT_MIX}')
+    parser.add_argument('--failed-attempts', type=int, default=1, help='result of the count step for failures')
+    parser.add_argument('--lambda-ms', type=float, default=DEFAULT_TASK_MS['lambda'])
+    parser.add_argument('--sns-ms', type=float, default=DEFAULT_TASK_MS['sns'])
+    args = parser.parse_args()
+
+    definition = synth_definition()
+    results = model(definition, args.events_per_day, parse_mix(args.mix), args.failed_attempts,
+                    {'lambda': args.lambda_ms, 'sns': args.sns_ms}, DEFAULT_TRANSITION_MS, DEFAULT_START_MS)
+
+    print(f'{"type":<9} {"transitions/exec":>16} {"mean latency ms":>16} {"USD/month":>10}')
+    for workflow_type, result in results.items():
+        print(f'{workflow_type:<9} {result["transitions"]:>16.2f} {result["latency_ms"]:>16.0f} {result["monthly_cost"]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()